@@ -0,0 +1,292 @@
+"""
+Emergency alert fan-out.
+
+dispatch_alert() sends one message to every emergency contact
+concurrently, each send taking a token from a shared token bucket
+(ALERT_RATE_PER_S, ALERT_BURST) so a flood cannot trip the provider's
+rate limit.
+
+Repeats of the same device and event type within
+ALERT_COALESCE_WINDOW_S are not re-sent one by one: the first alert
+goes out immediately, later ones only bump a repeat count and the
+latest location, and when the window closes a single escalation
+("repeated N times", latest location) is sent and a new window opens.
+A burst ends after a window with no repeats. The escalation is
+journaled in the alert outbox on the first repeat (due when its window
+closes, its count and location updated by later repeats), so it is
+retried like any alert and survives a restart.
+
+Coalescing windows live in the memory of one process: every gunicorn
+worker and the SOS listener keep their own, so a burst whose events
+reach different processes is coalesced in each of them separately
+(each sends its own first alert).
+
+Providers are pluggable (ALERT_PROVIDER): "log" (console only, the
+default while SMS is sent by the Android app), "twilio" and "fake"
+(in-memory, for tests and load runs). Each keeps latency and error
+metrics, reported by stats().
+"""
+import os
+import time
+import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ALERT_PROVIDER = os.getenv("ALERT_PROVIDER", "log")
+ALERT_CONTACTS = [c.strip() for c in os.getenv("ALERT_CONTACTS", "+919595167618").split(",") if c.strip()]
+ALERT_RATE_PER_S = float(os.getenv("ALERT_RATE_PER_S", "1"))
+ALERT_BURST = int(os.getenv("ALERT_BURST", "10"))
+ALERT_RATE_WAIT_S = float(os.getenv("ALERT_RATE_WAIT_S", "30"))   # longest a send queues for a token
+COALESCE_WINDOW_S = float(os.getenv("ALERT_COALESCE_WINDOW_S", "60"))
+SEND_WORKERS = int(os.getenv("ALERT_SEND_WORKERS", "8"))
+LATENCY_WINDOW = 1000
+
+class AlertDeliveryError(Exception):
+    pass
+
+# --- 1. RATE LIMIT ---
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """Take one token, waiting up to `timeout` seconds. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+# --- 2. PROVIDERS ---
+class Provider:
+    name = "base"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.counters = {"sent": 0, "errors": 0}
+
+    def send(self, to, body):
+        raise NotImplementedError
+
+    def timed_send(self, to, body):
+        t0 = time.perf_counter()
+        try:
+            self.send(to, body)
+        except Exception:
+            with self.lock:
+                self.counters["errors"] += 1
+            raise
+        finally:
+            with self.lock:
+                self.latencies.append(time.perf_counter() - t0)
+        with self.lock:
+            self.counters["sent"] += 1
+
+    def stats(self):
+        with self.lock:
+            samples = list(self.latencies)
+            result = dict(self.counters, provider=self.name, samples=len(samples))
+        if samples:
+            p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+            result.update(p50_ms=round(float(p50) * 1000, 1), p95_ms=round(float(p95) * 1000, 1),
+                          p99_ms=round(float(p99) * 1000, 1))
+        return result
+
+class LogProvider(Provider):
+    name = "log"
+
+    def send(self, to, body):
+        print(f"ℹ️ [{to}] {body}")
+
+class TwilioProvider(Provider):
+    name = "twilio"
+
+    def __init__(self):
+        super().__init__()
+        from twilio.rest import Client
+        self.client = Client(os.getenv("TWILIO_ACCOUNT_SID"), os.getenv("TWILIO_AUTH_TOKEN"))
+        self.from_ = os.getenv("TWILIO_PHONE")
+
+    def send(self, to, body):
+        self.client.messages.create(body=body, from_=self.from_, to=to)
+
+class FakeProvider(Provider):
+    """Records messages in memory, with optional latency and failure rate."""
+    name = "fake"
+
+    def __init__(self, latency_s=None, fail_rate=None):
+        super().__init__()
+        self.latency_s = float(os.getenv("ALERT_FAKE_LATENCY_MS", "0")) / 1000.0 if latency_s is None else latency_s
+        self.fail_rate = float(os.getenv("ALERT_FAKE_FAIL_RATE", "0")) if fail_rate is None else fail_rate
+        self.sent = []
+
+    def send(self, to, body):
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        if random.random() < self.fail_rate:
+            raise AlertDeliveryError(f"fake provider failure for {to}")
+        with self.lock:
+            self.sent.append((time.time(), to, body))
+
+PROVIDERS = {"log": LogProvider, "twilio": TwilioProvider, "fake": FakeProvider}
+
+def register_provider(name, factory):
+    PROVIDERS[name] = factory
+
+# --- 3. DISPATCHER ---
+EVENT_MESSAGES = {
+    "USER_SOS": "SOS BUTTON PRESSED!",
+    "AUTO_UNUSUAL_ACTIVITY": "UNUSUAL ACTIVITY DETECTED!",
+    "MANUAL_SOS": "MANUAL SOS (Native App)",
+    "MANUAL_SOS_SMS_SENT": "User sent SOS via Native SMS",
+    "USER_SOS_SMS_SENT": "User sent SOS via Native SMS",
+    "AUTO_GEOFENCE_CRITICAL": "ENTERED A CRITICAL-RISK AREA AT NIGHT!"
+}
+
+def alert_body(event_type, lat, lon, repeats=0):
+    description = EVENT_MESSAGES.get(event_type, f"Emergency: {event_type}")
+    if repeats:
+        return (f"🚨 SAFE BAG ALERT: {description} (repeated {repeats} more times)\n"
+                f"Latest loc: http://maps.google.com/?q={lat},{lon}")
+    return f"🚨 SAFE BAG ALERT: {description}\nLoc: http://maps.google.com/?q={lat},{lon}"
+
+class Dispatcher:
+    def __init__(self, provider=None, contacts=None, rate=ALERT_RATE_PER_S, burst=ALERT_BURST,
+                 window_s=COALESCE_WINDOW_S, workers=SEND_WORKERS):
+        self.provider = provider or PROVIDERS[ALERT_PROVIDER]()
+        self.contacts = list(ALERT_CONTACTS if contacts is None else contacts)
+        self.bucket = TokenBucket(rate, burst)
+        self.window_s = window_s
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="alert-send")
+        self.bursts = {}   # (device_id, event_type) -> burst state
+        self.swept_at = time.time()
+        self.lock = threading.Lock()
+        self.counters = {"alerts": 0, "coalesced": 0, "escalations": 0, "rate_limited": 0}
+
+    def _send_one(self, to, body):
+        if not self.bucket.acquire(ALERT_RATE_WAIT_S):
+            with self.lock:
+                self.counters["rate_limited"] += 1
+            raise AlertDeliveryError(f"rate limit: no send slot for {to} within {ALERT_RATE_WAIT_S}s")
+        self.provider.timed_send(to, body)
+
+    def send_all(self, body):
+        """Send to every contact concurrently. Returns the contacts that failed."""
+        futures = {to: self.pool.submit(self._send_one, to, body) for to in self.contacts}
+        failed = []
+        for to, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                print(f"⚠️ Alert to {to} failed: {e}")
+                failed.append(to)
+        return failed
+
+    def dispatch(self, device_id, lat, lon, event_type):
+        """
+        Alert every contact, or fold the event into an open burst for the
+        same device and event type. Raises AlertDeliveryError when no
+        contact could be reached, so the caller (the outbox) retries.
+        """
+        key = (device_id, event_type)
+        now = time.time()
+        with self.lock:
+            self.counters["alerts"] += 1
+            self._sweep(now)
+            burst = self.bursts.get(key)
+            window = None
+            if burst is not None:
+                window = int((now - burst["opened"]) // self.window_s)
+                if window > burst["window"] + 1:
+                    # The last window was quiet: the burst is over and this alert starts a new one
+                    burst = None
+            if burst is not None:
+                if window != burst["window"]:
+                    burst["window"], burst["repeats"] = window, 0
+                burst["repeats"] += 1
+                repeats = burst["repeats"]
+                self.counters["coalesced"] += 1
+                idem_key = f"repeats:{device_id}:{event_type}:{burst['opened']:.3f}:{window}"
+                due_at = burst["opened"] + (window + 1) * self.window_s
+            else:
+                # Claim the window before sending so concurrent repeats fold into it
+                self.bursts[key] = {"opened": now, "window": 0, "repeats": 0}
+
+        if burst is not None:
+            self._journal_repeats(device_id, lat, lon, event_type, repeats, due_at, idem_key)
+            return {"status": "coalesced", "repeats": repeats}
+
+        failed = self.send_all(alert_body(event_type, lat, lon))
+        if self.contacts and len(failed) == len(self.contacts):
+            with self.lock:
+                self.bursts.pop(key, None)
+            raise AlertDeliveryError(f"{event_type} alert reached no contacts")
+        return {"status": "sent", "failed": failed}
+
+    def _journal_repeats(self, device_id, lat, lon, event_type, repeats, due_at, idem_key):
+        # Imported here: the outbox delivers through this module
+        import alert_outbox
+        alert_outbox.schedule_repeats(device_id, lat, lon, event_type, repeats, due_at, idem_key)
+        with self.lock:
+            self.counters["escalations"] += repeats == 1
+
+    def send_repeats(self, device_id, lat, lon, event_type, repeats):
+        """The window-close escalation (sent by the outbox). Raises AlertDeliveryError when no contact was reached."""
+        failed = self.send_all(alert_body(event_type, lat, lon, repeats=repeats))
+        if self.contacts and len(failed) == len(self.contacts):
+            raise AlertDeliveryError(f"{event_type} escalation for {device_id} reached no contacts")
+        return {"status": "sent", "failed": failed}
+
+    def _sweep(self, now):
+        # Caller holds the lock; drop bursts that ended without a later alert to notice
+        if now - self.swept_at < self.window_s:
+            return
+        self.swept_at = now
+        for key, burst in list(self.bursts.items()):
+            if now >= burst["opened"] + (burst["window"] + 2) * self.window_s:
+                del self.bursts[key]
+
+    def stats(self):
+        with self.lock:
+            result = dict(self.counters, open_bursts=len(self.bursts), contacts=len(self.contacts))
+        result["provider"] = self.provider.stats()
+        return result
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+def _after_fork():
+    # The send pool's threads do not survive a fork
+    global _dispatcher, _dispatcher_lock
+    _dispatcher = None
+    _dispatcher_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_after_fork)
+
+def get_dispatcher():
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = Dispatcher()
+        return _dispatcher
+
+def dispatch_alert(device_id, lat, lon, event_type):
+    return get_dispatcher().dispatch(device_id, lat, lon, event_type)
@@ -0,0 +1,316 @@
+"""
+Durable outbox for emergency alerts.
+
+/sos, /escalate and the SOS listener append an alert to a SQLite (WAL)
+journal and return at once; a pool of worker threads drains it. Each
+alert runs its delivery steps in order (the SMS/log alert, then the
+Firebase acknowledgement PATCH when there is one), and a step that has
+succeeded is never repeated, so retries only redo what failed. Failed
+alerts back off exponentially. A worker renews the lease on its
+in-flight alerts every LEASE_S / 3 for as long as a send takes (a
+token-bucket wait plus the provider call can outlast any fixed lease);
+an alert whose process died stops being renewed and is picked up again
+once its lease expires, by any process sharing the journal. Every
+process that enqueues also calls resume() at start, so alerts left
+pending by a crash or redeploy go out without waiting for a new one.
+
+An alert the dispatcher folds into an open burst ends as 'coalesced'
+rather than 'done': no contact heard about it yet, that happens when the
+burst's "repeated N times" escalation is delivered.
+
+Every alert carries an idempotency key (client supplied, the Firebase
+event key, or a fresh UUID); enqueueing the same key twice is a no-op.
+"""
+import os
+import json
+import time
+import uuid
+import random
+import sqlite3
+import threading
+import numpy as np
+
+import firebase
+import alert_dispatch
+from sms_alert import send_sms_alert
+
+OUTBOX_DB = os.getenv("OUTBOX_DB", "data/alert_outbox.db")
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "12"))
+BACKOFF_BASE_S = float(os.getenv("OUTBOX_BACKOFF_BASE_S", "0.5"))
+BACKOFF_MAX_S = float(os.getenv("OUTBOX_BACKOFF_MAX_S", "60"))
+LEASE_S = float(os.getenv("OUTBOX_LEASE_S", "30"))       # an in-flight alert not renewed for this long is retried
+RETAIN_S = float(os.getenv("OUTBOX_RETAIN_S", "86400"))   # delivered rows kept for stats
+POLL_S = 0.5
+LATENCY_WINDOW = 1000
+
+# --- 1. DELIVERY STEPS ---
+def _step_sms(alert):
+    return send_sms_alert(alert["latitude"], alert["longitude"], alert["event_type"], alert["device_id"])
+
+def _step_ack(alert):
+    firebase.patch(f"latest_events/{alert['device_id']}", alert["ack"])
+
+def _step_repeats(alert):
+    alert_dispatch.get_dispatcher().send_repeats(alert["device_id"], alert["latitude"], alert["longitude"],
+                                                 alert["event_type"], alert["repeats"])
+
+def steps_for(alert):
+    # A burst's window-close escalation is sent as is, never coalesced again
+    steps = [("sms", _step_repeats if alert.get("repeats") else _step_sms)]
+    if alert.get("ack"):
+        steps.append(("firebase", _step_ack))
+    return steps
+
+def backoff_s(attempts):
+    delay = min(BACKOFF_BASE_S * 2 ** (attempts - 1), BACKOFF_MAX_S)
+    return delay * random.uniform(0.5, 1.0)
+
+# --- 2. JOURNAL ---
+class Outbox:
+    def __init__(self, path=OUTBOX_DB, workers=OUTBOX_WORKERS):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.workers = workers
+        self.db = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS alerts ("
+            "id INTEGER PRIMARY KEY, idem_key TEXT UNIQUE, payload TEXT, status TEXT, "
+            "steps_done TEXT DEFAULT '[]', attempts INTEGER DEFAULT 0, last_error TEXT, "
+            "created_at REAL, next_attempt_at REAL, claimed_at REAL, delivered_at REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS alerts_due ON alerts (status, next_attempt_at)")
+        self.lock = threading.Lock()
+        self.wake = threading.Condition()
+        self.threads = []
+        self.pid = None
+        self.state_lock = threading.Lock()
+        self.inflight = set()   # ids this process is delivering; their leases are renewed
+        self.counters = {"enqueued": 0, "duplicates": 0, "delivered": 0, "coalesced": 0, "retries": 0,
+                         "dead": 0, "recovered": 0}
+
+    def _count(self, name):
+        with self.state_lock:
+            self.counters[name] += 1
+
+    def _execute(self, sql, params=()):
+        """Run a write; returns the row count."""
+        with self.lock:
+            return self.db.execute(sql, params).rowcount
+
+    def _query(self, sql, params=()):
+        with self.lock:
+            return self.db.execute(sql, params).fetchall()
+
+    def start(self):
+        """Start the worker pool (again, in a forked child)."""
+        with self.wake:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.inflight = set()
+            self.threads = [threading.Thread(target=self._worker, name=f"outbox-{i}", daemon=True)
+                            for i in range(self.workers)]
+            for t in self.threads:
+                t.start()
+            threading.Thread(target=self._renew_leases, name="outbox-lease", daemon=True).start()
+
+    def recover(self):
+        """
+        Hand alerts whose lease has expired (their process died mid-send)
+        straight back to the queue. Returns the undelivered alerts waiting.
+        """
+        now = time.time()
+        recovered = self._execute(
+            "UPDATE alerts SET status = 'pending', next_attempt_at = ? "
+            "WHERE status = 'inflight' AND claimed_at < ?", (now, now - LEASE_S))
+        with self.state_lock:
+            self.counters["recovered"] += recovered
+        with self.wake:
+            self.wake.notify_all()
+        return self._query("SELECT COUNT(*) FROM alerts WHERE status = 'pending'")[0][0]
+
+    def enqueue(self, alert, idem_key=None):
+        """Journal an alert. Returns (idem_key, created); a known key is not queued twice."""
+        idem_key = idem_key or uuid.uuid4().hex
+        now = time.time()
+        created = self._execute(
+            "INSERT OR IGNORE INTO alerts (idem_key, payload, status, created_at, next_attempt_at) "
+            "VALUES (?, ?, 'pending', ?, ?)", (idem_key, json.dumps(alert), now, now)) == 1
+        self._count("enqueued" if created else "duplicates")
+        self.start()
+        if created:
+            with self.wake:
+                self.wake.notify()
+        return idem_key, created
+
+    def schedule(self, alert, idem_key, due_at):
+        """
+        Journal an alert carrying a running `repeats` tally, to go out at
+        due_at. While it is still pending, a later call with a higher
+        tally replaces its payload (calls may land out of order).
+        """
+        created = self._execute(
+            "INSERT OR IGNORE INTO alerts (idem_key, payload, status, created_at, next_attempt_at) "
+            "VALUES (?, ?, 'pending', ?, ?)", (idem_key, json.dumps(alert), time.time(), due_at)) == 1
+        if created:
+            self._count("enqueued")
+            self.start()
+        else:
+            self._execute("UPDATE alerts SET payload = ? WHERE idem_key = ? AND status = 'pending' "
+                          "AND json_extract(payload, '$.repeats') < ?", (json.dumps(alert), idem_key,
+                                                                       alert["repeats"]))
+        return idem_key, created
+
+    def _claim(self):
+        now = time.time()
+        rows = self._query(
+            "SELECT id, payload, steps_done, attempts, created_at FROM alerts "
+            "WHERE (status = 'pending' AND next_attempt_at <= ?) "
+            "OR (status = 'inflight' AND claimed_at < ?) ORDER BY id LIMIT 1",
+            (now, now - LEASE_S))
+        if not rows:
+            return None
+        row = rows[0]
+        # Conditional update so only one worker (in any process) wins the row
+        won = self._execute(
+            "UPDATE alerts SET status = 'inflight', claimed_at = ?, attempts = attempts + 1 "
+            "WHERE id = ? AND attempts = ?", (now, row[0], row[3]))
+        return row if won == 1 else self._claim()
+
+    def _worker(self):
+        while True:
+            try:
+                row = self._claim()
+                if row is not None:
+                    with self.state_lock:
+                        self.inflight.add(row[0])
+                    try:
+                        self._deliver(*row)
+                    finally:
+                        with self.state_lock:
+                            self.inflight.discard(row[0])
+                    continue
+            except sqlite3.Error as e:
+                # The lease brings a half-recorded alert back
+                print(f"Outbox error: {e}")
+            with self.wake:
+                self.wake.wait(POLL_S)
+
+    def _renew_leases(self):
+        while True:
+            time.sleep(LEASE_S / 3)
+            with self.state_lock:
+                ids = list(self.inflight)
+            if not ids:
+                continue
+            marks = ",".join("?" * len(ids))
+            try:
+                self._execute(f"UPDATE alerts SET claimed_at = ? WHERE status = 'inflight' AND id IN ({marks})",
+                              [time.time()] + ids)
+            except sqlite3.Error as e:
+                print(f"Outbox lease renewal failed: {e}")
+
+    def _deliver(self, alert_id, payload, steps_done, attempts, created_at):
+        alert = json.loads(payload)
+        done = json.loads(steps_done)
+        attempts += 1
+        try:
+            for name, step in steps_for(alert):
+                if name in done:
+                    continue
+                result = step(alert)
+                done.append(name)
+                if isinstance(result, dict) and result.get("status") == "coalesced":
+                    # Kept with the steps so a retry of a later step still knows
+                    done.append("coalesced")
+                self._execute("UPDATE alerts SET steps_done = ? WHERE id = ?", (json.dumps(done), alert_id))
+        except Exception as e:
+            if attempts >= MAX_ATTEMPTS:
+                print(f"🚨 Alert {alert_id} undeliverable after {attempts} attempts: {e}")
+                self._count("dead")
+                self._execute("UPDATE alerts SET status = 'dead', last_error = ? WHERE id = ?", (str(e), alert_id))
+            else:
+                self._count("retries")
+                self._execute("UPDATE alerts SET status = 'pending', last_error = ?, next_attempt_at = ? "
+                              "WHERE id = ?", (str(e), time.time() + backoff_s(attempts), alert_id))
+            return
+
+        now = time.time()
+        status = "coalesced" if "coalesced" in done else "done"
+        self._count("delivered" if status == "done" else "coalesced")
+        self._execute("UPDATE alerts SET status = ?, delivered_at = ? WHERE id = ?", (status, now, alert_id))
+        self._execute("DELETE FROM alerts WHERE status IN ('done', 'coalesced') AND delivered_at < ?",
+                      (now - RETAIN_S,))
+
+    # --- 3. STATS ---
+    def _counters(self):
+        with self.state_lock:
+            return dict(self.counters)
+
+    def stats(self):
+        now = time.time()
+        by_status = dict(self._query("SELECT status, COUNT(*) FROM alerts GROUP BY status"))
+        oldest = self._query(
+            "SELECT MIN(created_at) FROM alerts WHERE status IN ('pending', 'inflight')")[0][0]
+        latencies = [r[0] for r in self._query(
+            "SELECT delivered_at - created_at FROM alerts WHERE status = 'done' "
+            "ORDER BY delivered_at DESC LIMIT ?", (LATENCY_WINDOW,))]
+        percentiles = {}
+        if latencies:
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            percentiles = {"p50_ms": round(float(p50) * 1000, 1), "p95_ms": round(float(p95) * 1000, 1),
+                           "p99_ms": round(float(p99) * 1000, 1)}
+        return {
+            "depth": by_status.get("pending", 0) + by_status.get("inflight", 0),
+            "inflight": by_status.get("inflight", 0),
+            "dead": by_status.get("dead", 0),
+            "coalesced": by_status.get("coalesced", 0),
+            "oldest_age_s": round(now - oldest, 3) if oldest else 0.0,
+            "delivery_latency": dict(percentiles, samples=len(latencies)),
+            "workers": len(self.threads),
+            "counters": self._counters(),
+        }
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+def _after_fork():
+    # Never share a SQLite connection across a fork; the child opens its own
+    global _outbox, _outbox_lock
+    _outbox = None
+    _outbox_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_after_fork)
+
+def get_outbox():
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = Outbox()
+        _outbox.start()
+        return _outbox
+
+def resume():
+    """
+    Start the workers at process start and requeue alerts stranded by a
+    crash, instead of waiting for the next enqueue to start them.
+    """
+    outbox = get_outbox()
+    waiting = outbox.recover()
+    if waiting:
+        print(f"✅ Outbox resumed with {waiting} undelivered alerts")
+    return outbox
+
+def schedule_repeats(device_id, lat, lon, event_type, repeats, due_at, idem_key):
+    """Journal (or update) a burst's "repeated N times" escalation, due when its window closes."""
+    alert = {"device_id": device_id, "latitude": lat, "longitude": lon,
+             "event_type": event_type, "ack": None, "repeats": repeats}
+    return get_outbox().schedule(alert, idem_key, due_at)
+
+def enqueue_alert(device_id, lat, lon, event_type, ack=None, idem_key=None):
+    """Queue an emergency alert; `ack` is PATCHed onto latest_events/<device> after it is sent."""
+    alert = {"device_id": device_id, "latitude": lat, "longitude": lon,
+             "event_type": event_type, "ack": ack}
+    return get_outbox().enqueue(alert, idem_key)
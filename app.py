@@ -1,19 +1,75 @@
-from flask import Flask, jsonify, request
-import requests
+from flask import Flask, Response, g, jsonify, request
 import os
+import sys
+import time
+import gzip
+import zlib
+import datetime
 from dotenv import load_dotenv
-from sms_alert import send_sms_alert
+import firebase
+import location_feed
+import device_store
+import event_store
+import alert_outbox
+import alert_dispatch
+import startup
+import metrics
 # Ensure these files exist in your project folder
-from routing import get_fast_route, get_safe_route
-from ml_engine import predict    
+from geometry import simplify, encode_polyline, decode_polyline, zoom_tolerance_m
+
+# Heavy modules (pandas, sklearn, osmnx...): imported on first use with STARTUP_MODE=lazy
+routing = startup.module("routing")
+route_risk = startup.module("route_risk")
+ml_engine = startup.module("ml_engine")
 
 load_dotenv()
 
 app = Flask(__name__)
 
 # Configuration
-FIREBASE_BASE = os.getenv("FIREBASE_URL")
-DEVICE_ID = "handbag_001"
+# Default device for the single-bag endpoints; requests may name another with device_id
+DEVICE_ID = firebase.DEVICE_ID
+# Most ids one /locations request may ask for
+MAX_BULK_IDS = 1000
+# Most points one /predict_batch request may score
+MAX_BATCH_POINTS = int(os.getenv("MAX_BATCH_POINTS", "5000"))
+
+# Responses smaller than this are not worth compressing
+COMPRESS_MIN_BYTES = 1024
+
+def compress_response(response):
+    """gzip/deflate a response body when the client accepts it."""
+    accepted = request.headers.get("Accept-Encoding", "").lower()
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_BYTES or "Content-Encoding" in response.headers:
+        return response
+    if "gzip" in accepted:
+        response.set_data(gzip.compress(body, compresslevel=5))
+        response.headers["Content-Encoding"] = "gzip"
+    elif "deflate" in accepted:
+        response.set_data(zlib.compress(body, 5))
+        response.headers["Content-Encoding"] = "deflate"
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+# ---------- Request Timing ----------
+@app.before_request
+def start_request_timer():
+    if metrics.METRICS_ENABLED:
+        g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        # The URL rule, not the path, keeps the label set bounded
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.observe("http_request_seconds", time.perf_counter() - started,
+                        endpoint=endpoint, method=request.method)
+        metrics.inc("http_requests", endpoint=endpoint, method=request.method, status=response.status_code)
+        if response.status_code >= 500:
+            metrics.inc("http_errors", endpoint=endpoint)
+    return response
 
 @app.route("/")
 def home():
@@ -27,10 +83,9 @@ def status():
 # ---------- Get Live Device Location ----------
 @app.route("/location", methods=["GET"])
 def get_location():
+    # Served from the shared subscriber; hits Firebase only when it is stale
     try:
-        url = f"{FIREBASE_BASE}/latest_events/{DEVICE_ID}.json"
-        r = requests.get(url, timeout=6)
-        data = r.json()
+        data = location_feed.get_feed(DEVICE_ID).get()
     except Exception as e:
         # Return 200 with error status so App displays it, rather than failing silently
         return jsonify({
@@ -40,22 +95,119 @@ def get_location():
         }), 200
 
     # FIX: Don't return 404. Return 200 with defaults so the App UI updates.
-    if not data:
-        return jsonify({
-            "latitude": 0.0,
-            "longitude": 0.0,
-            "event_type": "WAITING_FOR_DATA",
-            "acknowledged": True,
-            "timestamp": 0
-        }), 200
+    return jsonify(location_feed.location_payload(data)), 200
 
-    return jsonify({
-        "latitude": data.get("latitude"),
-        "longitude": data.get("longitude"),
-        "event_type": data.get("event_type", "NORMAL"),
-        "acknowledged": data.get("acknowledged", False),
-        "timestamp": data.get("timestamp_ms")
-    }), 200
+# ---------- Live Location Push (Server-Sent Events) ----------
+@app.route("/location/stream", methods=["GET"])
+def location_stream():
+    # Each viewer pins a worker thread; past the cap, shed load rather than starve /sos
+    slots = location_feed.viewer_slots
+    if not slots.acquire(blocking=False):
+        return jsonify({"error": "Too many live viewers, retry shortly"}), 503, {"Retry-After": "5"}
+    try:
+        feed = location_feed.get_feed(DEVICE_ID)
+        response = Response(feed.sse(), mimetype="text/event-stream",
+                            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    except Exception:
+        slots.release()
+        raise
+    response.call_on_close(slots.release)
+    return response
+
+@app.route("/location/stats", methods=["GET"])
+def location_stats():
+    return jsonify(location_feed.get_feed(DEVICE_ID).stats()), 200
+
+# ---------- Fleet Locations (in-memory store) ----------
+def parse_bbox(value):
+    """bbox=south,west,north,east"""
+    south, west, north, east = (float(v) for v in value.split(","))
+    if south > north or west > east:
+        raise ValueError("bbox must be south,west,north,east")
+    return south, west, north, east
+
+@app.route("/locations", methods=["GET"])
+def locations():
+    # ids=a,b,c  or  bbox=south,west,north,east[&event_type=USER_SOS,...]; neither lists every device
+    try:
+        ids = [i for i in request.args.get("ids", "").split(",") if i]
+        bbox = parse_bbox(request.args["bbox"]) if "bbox" in request.args else None
+        event_types = [e for e in request.args.get("event_type", "").split(",") if e]
+        limit = int(request.args["limit"]) if "limit" in request.args else None
+    except ValueError as e:
+        return jsonify({"error": f"Invalid parameters: {e}"}), 400
+    if len(ids) > MAX_BULK_IDS:
+        return jsonify({"error": f"At most {MAX_BULK_IDS} ids per request"}), 400
+
+    fleet = device_store.get_fleet()
+    result = {}
+    if ids:
+        result["devices"], result["unknown"] = fleet.store.get_many(ids[:limit])
+    elif bbox:
+        result["devices"] = fleet.store.within_bbox(*bbox, event_types=event_types, limit=limit)
+    else:
+        result["devices"] = fleet.store.all(limit)
+    result["count"] = len(result["devices"])
+    result["connected"] = fleet.connected
+    return compress_response(jsonify(result)), 200
+
+@app.route("/locations/stats", methods=["GET"])
+def locations_stats():
+    return jsonify(device_store.get_fleet().stats()), 200
+
+# ---------- Event History (local columnar store) ----------
+def epoch_ms(value):
+    """start/end parameters: epoch seconds or ISO time."""
+    return int(parse_when(value).timestamp() * 1000) if value else None
+
+@app.route("/events", methods=["GET"])
+def events_api():
+    # device_id + start/end: that device's events in the range, oldest first;
+    # otherwise the newest `limit` events, optionally of one device_id / event_type
+    try:
+        device_id = request.args.get("device_id")
+        start_ms = epoch_ms(request.args.get("start"))
+        end_ms = epoch_ms(request.args.get("end"))
+        limit = min(max(int(request.args.get("limit", 100)), 1), 10000)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid parameters: {e}"}), 400
+
+    store = event_store.get_store()
+    if device_id and (start_ms is not None or end_ms is not None):
+        events = store.device_range(device_id, start_ms, end_ms, limit)
+    else:
+        events = store.last(limit, device_id=device_id, event_type=request.args.get("event_type"))
+    return compress_response(jsonify({"events": events, "count": len(events)})), 200
+
+@app.route("/events/counts", methods=["GET"])
+def event_counts():
+    try:
+        start_ms = epoch_ms(request.args.get("start"))
+        end_ms = epoch_ms(request.args.get("end"))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid parameters: {e}"}), 400
+    counts = event_store.get_store().counts(start_ms, end_ms, device_id=request.args.get("device_id"))
+    return jsonify({"counts": counts, "total": sum(counts.values())}), 200
+
+@app.route("/events/stats", methods=["GET"])
+def event_stats():
+    return jsonify(event_store.get_store().stats()), 200
+
+def parse_when(depart):
+    """depart=<epoch seconds or ISO time>; None means now. Raises ValueError on bad input."""
+    if not depart:
+        return None
+    try:
+        return datetime.datetime.fromtimestamp(float(depart))
+    except (OverflowError, OSError) as e:
+        # inf, or an epoch past what the platform's time functions take
+        raise ValueError(f"time out of range: {depart}") from e
+    except ValueError:
+        return datetime.datetime.fromisoformat(depart)
+
+def risk_spacing(value):
+    # Bounded so one request cannot ask for millions of samples
+    return min(max(float(value), 10.0), 1000.0)
 
 # ---------- DUAL ROUTE API ----------
 @app.route("/route", methods=["GET"])
@@ -66,17 +218,79 @@ def route_api():
         end_lat   = float(request.args.get("end_lat"))
         end_lon   = float(request.args.get("end_lon"))
 
-        fast = get_fast_route(start_lat, start_lon, end_lat, end_lon)
-        safe = get_safe_route(start_lat, start_lon, end_lat, end_lon)
+        # Optional output controls:
+        #   simplify=<metres> or zoom=<map zoom>  Douglas-Peucker tolerance
+        #   format=polyline                        Google encoded polylines
+        output_format = request.args.get("format", "json")
+        tolerance = float(request.args.get("simplify", 0))
+        if "zoom" in request.args:
+            tolerance = zoom_tolerance_m(float(request.args["zoom"]), start_lat)
 
-        return jsonify({
+        # depart=<epoch seconds or ISO time> picks the time-of-day safety weights
+        try:
+            when = parse_when(request.args.get("depart"))
+        except ValueError as e:
+            return jsonify({"error": f"Invalid depart: {e}"}), 400
+
+        # Both routes run concurrently, each within the routing budget
+        fast, safe = routing.get_dual_routes(start_lat, start_lon, end_lat, end_lon, when=when)
+
+        # risk=1 adds a risk profile of each route, scored at full resolution
+        profiles = None
+        if request.args.get("risk") in ("1", "true"):
+            spacing = risk_spacing(request.args.get("spacing_m", route_risk.DEFAULT_SPACING_M))
+            profiles = route_risk.score_routes([fast, safe], spacing, when)
+
+        if tolerance > 0:
+            fast, safe = simplify(fast, tolerance), simplify(safe, tolerance)
+        if output_format == "polyline":
+            fast, safe = encode_polyline(fast), encode_polyline(safe)
+
+        body = {
             "fast_route": fast,
-            "safe_route": safe
-        }), 200
+            "safe_route": safe,
+            "format": output_format
+        }
+        if profiles is not None:
+            body["fast_risk"], body["safe_risk"] = profiles
+        return compress_response(jsonify(body)), 200
     except Exception as e:
         print(f"Routing Error: {e}")
         return jsonify({"error": str(e)}), 500
 
+# ---------- ROUTE RISK PROFILE ----------
+@app.route("/route_risk", methods=["POST"])
+def route_risk_api():
+    # Body: {"route": [[lat, lon], ...]} or {"polyline": "<encoded>"},
+    #       optional "spacing_m", "depart", "speed_mps"
+    data = request.get_json(silent=True) or {}
+    try:
+        if "polyline" in data:
+            coords = decode_polyline(data["polyline"])
+        else:
+            coords = [[float(p[0]), float(p[1])] for p in data["route"]]
+        spacing = risk_spacing(data.get("spacing_m", route_risk.DEFAULT_SPACING_M))
+        speed = float(data.get("speed_mps", route_risk.WALKING_SPEED_MPS))
+        if speed <= 0:
+            raise ValueError("speed_mps must be positive")
+        when = parse_when(data.get("depart"))
+    except Exception:
+        return jsonify({"error": "route required as [[lat, lon], ...] or an encoded polyline"}), 400
+
+    try:
+        profile = route_risk.score_routes([coords], spacing, when, speed)[0]
+    except Exception as e:
+        print(f"ML Error: {e}")
+        return jsonify({"error": str(e)}), 500
+    if profile is None:
+        return jsonify({"error": "route needs at least two distinct points"}), 400
+    return compress_response(jsonify(profile)), 200
+
+# ---------- Route Cache Stats ----------
+@app.route("/route_cache", methods=["GET"])
+def route_cache_stats():
+    return jsonify(routing.route_cache.stats()), 200
+
 # ---------- ML PREDICTION API ----------
 @app.route("/predict", methods=["GET"])
 def predict_api():
@@ -84,7 +298,7 @@ def predict_api():
         lat = float(request.args.get("lat"))
         lon = float(request.args.get("lon"))
 
-        risk, crime, probability = predict(lat, lon)
+        risk, crime, probability = ml_engine.predict(lat, lon)
         
         return jsonify({
             "risk": risk, 
@@ -93,28 +307,74 @@ def predict_api():
         }), 200
     except Exception as e:
         print(f"ML Error: {e}")
+        metrics.inc("ml_errors", endpoint="/predict")
         # Return defaults on error to prevent app crash
         return jsonify({"risk": "Unknown", "crime": "Unknown", "safety_probability": 0.5}), 200
 
-# ---------- MISSING ROUTE 1: Police Stations ----------
-@app.route("/police", methods=["GET"])
-def get_police():
-    # Placeholder: Return empty list or nearby stations logic
+# ---------- BATCH ML PREDICTION API ----------
+@app.route("/predict_batch", methods=["POST"])
+def predict_batch_api():
+    # Body: {"points": [[lat, lon], ...]}
+    data = request.get_json(silent=True)
+    try:
+        points = data["points"]
+        if len(points) > MAX_BATCH_POINTS:
+            return jsonify({"error": f"At most {MAX_BATCH_POINTS} points per request"}), 400
+        lats = [float(p[0]) for p in points]
+        lons = [float(p[1]) for p in points]
+    except Exception:
+        return jsonify({"error": "points required as [[lat, lon], ...]"}), 400
+
+    try:
+        results = ml_engine.predict_many(lats, lons)
+    except Exception as e:
+        print(f"ML Error: {e}")
+        metrics.inc("ml_errors", endpoint="/predict_batch")
+        # Return defaults on error to prevent app crash
+        results = [("Unknown", "Unknown", 0.5)] * len(lats)
+
     return jsonify({
-        "stations": [] 
+        "predictions": [
+            {"risk": risk, "crime": crime, "safety_probability": probability}
+            for risk, crime, probability in results
+        ]
     }), 200
 
+# ---------- Police Stations ----------
+@app.route("/police", methods=["GET"])
+def get_police():
+    # /police?lat=&lon=&k=5 (optional radius_m) -> nearest stations with distances
+    if "lat" not in request.args or "lon" not in request.args:
+        return jsonify({"stations": []}), 200
+    try:
+        lat = float(request.args["lat"])
+        lon = float(request.args["lon"])
+        k = min(int(request.args.get("k", 5)), 50)
+        radius_m = float(request.args["radius_m"]) if "radius_m" in request.args else None
+    except ValueError:
+        return jsonify({"error": "lat, lon, k and radius_m must be numbers"}), 400
+
+    if radius_m is not None:
+        stations = ml_engine.poi_index.within(lat, lon, radius_m, category="police")[:k]
+    else:
+        stations = ml_engine.poi_index.nearest(lat, lon, k, category="police")
+    return jsonify({"stations": stations}), 200
+
 # ---------- MISSING ROUTE 2: Send Acknowledge ----------
 @app.route("/send_ack", methods=["POST"])
 def send_ack():
+    device_id = (request.get_json(silent=True) or {}).get("device_id", DEVICE_ID)
     try:
-        patch_url = f"{FIREBASE_BASE}/latest_events/{DEVICE_ID}.json"
         # Update Firebase so the bag stops beeping (if hardware connected)
-        requests.patch(patch_url, json={"acknowledged": True, "event_type": "SAFE"})
+        firebase.queue_patch(f"latest_events/{device_id}",
+                             {"acknowledged": True, "event_type": "SAFE"}).result(firebase.WRITE_WAIT_S)
         return jsonify({"status": "acknowledged"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def idempotency_key(data):
+    return request.headers.get("Idempotency-Key") or (data or {}).get("idempotency_key")
+
 # ---------- Manual SOS ----------
 @app.route("/sos", methods=["POST"])
 def sos_from_app():
@@ -128,12 +388,12 @@ def sos_from_app():
     print(f"📨 Manual SOS → {lat}, {lon}")
 
     try:
-        send_sms_alert(lat, lon, event_type="USER_SOS")
-        
-        patch_url = f"{FIREBASE_BASE}/latest_events/{DEVICE_ID}.json"
-        requests.patch(patch_url, json={"acknowledged": True, "event_type": "USER_SOS"})
+        # Journaled and delivered by the outbox workers; never waits on Firebase
+        key, _ = alert_outbox.enqueue_alert(data.get("device_id", DEVICE_ID), lat, lon, "USER_SOS",
+                                            ack={"acknowledged": True, "event_type": "USER_SOS"},
+                                            idem_key=idempotency_key(data))
         
-        return jsonify({"message": "SOS Sent"}), 200
+        return jsonify({"message": "SOS Sent", "status": "queued", "idempotency_key": key}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -148,13 +408,65 @@ def escalate():
     print(f"🚨 ESCALATING: {event}")
     
     try:
-        send_sms_alert(lat, lon, event)
-        patch_url = f"{FIREBASE_BASE}/latest_events/{DEVICE_ID}.json"
-        requests.patch(patch_url, json={"acknowledged": True})
-        return jsonify({"status": "success"}), 200
+        key, _ = alert_outbox.enqueue_alert(data.get("device_id", DEVICE_ID), lat, lon, event,
+                                            ack={"acknowledged": True},
+                                            idem_key=idempotency_key(data))
+        return jsonify({"status": "success", "idempotency_key": key}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# ---------- Alert Outbox Stats ----------
+@app.route("/outbox", methods=["GET"])
+def outbox_stats():
+    return jsonify(alert_outbox.get_outbox().stats()), 200
+
+# ---------- Alert Dispatch Stats ----------
+@app.route("/alert_dispatch", methods=["GET"])
+def alert_dispatch_stats():
+    return jsonify(alert_dispatch.get_dispatcher().stats()), 200
+
+# ---------- Prometheus Metrics ----------
+def collect_app_metrics():
+    """Cache, queue and feed state, read at scrape time (never loads anything)."""
+    samples = []
+    if "routing" in sys.modules:
+        stats = routing.route_cache.stats()
+        for event in ("hits", "store_hits", "misses", "evictions", "expired"):
+            samples.append(("route_cache_events_total", "counter", {"event": event}, stats[event]))
+        samples.append(("route_cache_bytes", "gauge", {}, stats["bytes"]))
+        samples.append(("route_cache_entries", "gauge", {}, stats["entries"]))
+    if alert_outbox._outbox is not None:
+        stats = alert_outbox._outbox.stats()
+        samples.append(("outbox_depth", "gauge", {}, stats["depth"]))
+        samples.append(("outbox_dead", "gauge", {}, stats["dead"]))
+        samples.append(("outbox_oldest_age_seconds", "gauge", {}, stats["oldest_age_s"]))
+    if alert_dispatch._dispatcher is not None:
+        stats = alert_dispatch._dispatcher.stats()
+        provider = stats["provider"]
+        for event in ("sent", "errors"):
+            samples.append(("alert_sends_total", "counter", {"provider": provider["provider"], "result": event},
+                            provider[event]))
+        samples.append(("alert_coalesced_total", "counter", {}, stats["coalesced"]))
+    if device_store._fleet is not None:
+        stats = device_store._fleet.stats()
+        samples.append(("fleet_devices", "gauge", {}, stats["devices"]))
+        samples.append(("fleet_devices_with_fix", "gauge", {}, stats["with_fix"]))
+        samples.append(("fleet_stream_connected", "gauge", {}, int(stats["connected"])))
+    for device_id, feed in list(location_feed.feeds.items()):
+        stats = feed.stats()
+        samples.append(("location_viewers", "gauge", {"device": device_id}, stats["viewers"]))
+        samples.append(("location_stream_connected", "gauge", {"device": device_id}, int(stats["connected"])))
+    return samples
+
+metrics.register_collector(collect_app_metrics)
+
+@app.route("/metrics", methods=["GET"])
+def metrics_api():
+    if not metrics.METRICS_ENABLED:
+        return jsonify({"error": "metrics disabled (METRICS_ENABLED=0)"}), 404
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
+    alert_outbox.resume()
     port = int(os.environ.get("PORT", 8080))
     app.run(host="0.0.0.0", port=port)
@@ -0,0 +1,101 @@
+"""
+Query latency of the local event history (event_store.py).
+
+    python benchmarks/bench_event_store.py [--events 2000000] [--devices 500] [--days 30]
+
+Appends synthetic events (batches of --batch, as the SOS listener
+would) to a temporary store, then times the queries behind /events
+with a fresh read-only reader: one device's day, event-type counts over
+a day and over everything, and the newest 100 events overall, for one
+device and for one event type.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from event_store import EventStore
+
+EVENT_TYPES = ["NORMAL"] * 90 + ["AUTO_UNUSUAL_ACTIVITY"] * 7 + ["USER_SOS"] * 3
+START_MS = 1704067200000   # 2024-01-01 UTC
+
+def fill(path, events, devices, days, batch, seed=0):
+    rng = np.random.default_rng(seed)
+    store = EventStore(path, writable=True)
+    span_ms = days * 86400 * 1000
+    ts = np.sort(START_MS + rng.integers(0, span_ms, events))
+    device = rng.integers(0, devices, events)
+    lat = 21.08 + rng.random(events) * 0.14
+    lon = 79.0 + rng.random(events) * 0.15
+    event_type = rng.choice(EVENT_TYPES, events)
+    t0 = time.perf_counter()
+    for lo in range(0, events, batch):
+        hi = min(lo + batch, events)
+        store.append({f"{i:012d}": {"device_id": f"bag_{device[i]:04d}", "latitude": lat[i], "longitude": lon[i],
+                                    "event_type": event_type[i], "timestamp_ms": int(ts[i])}
+                      for i in range(lo, hi)})
+    return time.perf_counter() - t0
+
+def timed(fn, repeat):
+    fn()
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return result, float(np.median(samples))
+
+def run(events, devices, days, batch, repeat):
+    path = tempfile.mkdtemp(prefix="safebag_events_")
+    try:
+        append_s = fill(path, events, devices, days, batch)
+        t0 = time.perf_counter()
+        reader = EventStore(path)
+        open_ms = (time.perf_counter() - t0) * 1000
+        day_start = START_MS + (days // 2) * 86400 * 1000
+        day_end = day_start + 86400 * 1000
+        queries = {
+            "device_range 1 day": lambda: reader.device_range("bag_0007", day_start, day_end, 10000),
+            "counts 1 day": lambda: reader.counts(day_start, day_end),
+            "counts all": lambda: reader.counts(),
+            "counts 1 device": lambda: reader.counts(device_id="bag_0007"),
+            "last 100": lambda: reader.last(100),
+            "last 100 of 1 device": lambda: reader.last(100, device_id="bag_0007"),
+            "last 100 USER_SOS": lambda: reader.last(100, event_type="USER_SOS"),
+        }
+        results = []
+        for name, fn in queries.items():
+            result, ms = timed(fn, repeat)
+            rows = sum(result.values()) if isinstance(result, dict) else len(result)
+            results.append({"query": name, "p50_ms": round(ms, 3), "rows": rows})
+        stats = reader.stats()
+        return {"events": stats["events"], "segments": stats["segments"], "bytes": stats["bytes"],
+                "append_s": round(append_s, 2), "open_ms": round(open_ms, 3), "queries": results}
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=2_000_000)
+    parser.add_argument("--devices", type=int, default=500)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--batch", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    result = run(args.events, args.devices, args.days, args.batch, args.repeat)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"{result['events']} events in {result['segments']} segments, {result['bytes'] / 1e6:.1f} MB; "
+              f"appended in {result['append_s']} s, reader opened in {result['open_ms']} ms")
+        print(f"{'query':<24}{'p50 ms':>10}{'rows':>10}")
+        for q in result["queries"]:
+            print(f"{q['query']:<24}{q['p50_ms']:>10.3f}{q['rows']:>10}")
@@ -0,0 +1,105 @@
+"""
+Per-request latency of bare `requests` calls vs the pooled firebase client.
+
+    python benchmarks/bench_firebase_client.py [--requests 200] [--connect-latency-ms 40]
+
+Runs against the local fake_firebase stand-in. --connect-latency-ms is
+paid on every new connection, like a TLS handshake to the real database.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import numpy as np
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import firebase
+from fake_firebase import start_fake_firebase
+
+DEVICE_PATH = f"latest_events/{firebase.DEVICE_ID}"
+
+def summarise(name, samples_ms, upstream):
+    samples = np.array(samples_ms)
+    return {
+        "case": name,
+        "mean_ms": round(float(samples.mean()), 3),
+        "p50_ms": round(float(np.percentile(samples, 50)), 3),
+        "p95_ms": round(float(np.percentile(samples, 95)), 3),
+        "upstream_requests": upstream,
+    }
+
+def measure(fn, n):
+    samples = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return samples
+
+def upstream_count(state, before):
+    return state.stats["requests"] - before
+
+def run(n, connect_latency_ms, latency_ms, writers):
+    server, url, state = start_fake_firebase(0, latency_ms, connect_latency_ms)
+    firebase.FIREBASE_URL = url
+    state.set(DEVICE_PATH.split("/"), {"latitude": 21.1458, "longitude": 79.0882,
+                                       "event_type": "NORMAL", "acknowledged": False})
+    results = []
+
+    before = state.stats["requests"]
+    samples = measure(lambda: requests.get(f"{url}/{DEVICE_PATH}.json", timeout=6).json(), n)
+    results.append(summarise("GET bare requests", samples, upstream_count(state, before)))
+
+    before = state.stats["requests"]
+    samples = measure(lambda: firebase.get_cached(DEVICE_PATH), n)
+    results.append(summarise("GET pooled + ETag", samples, upstream_count(state, before)))
+
+    before = state.stats["requests"]
+    samples = measure(lambda: requests.patch(f"{url}/{DEVICE_PATH}.json", json={"acknowledged": True}), n)
+    results.append(summarise("PATCH bare requests", samples, upstream_count(state, before)))
+
+    # Concurrent writers, as when /sos and /send_ack arrive together
+    def concurrent(fn):
+        samples, lock = [], threading.Lock()
+        def worker():
+            mine = measure(fn, n // writers)
+            with lock:
+                samples.extend(mine)
+        threads = [threading.Thread(target=worker) for _ in range(writers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return samples
+
+    before = state.stats["requests"]
+    samples = concurrent(lambda: requests.patch(f"{url}/{DEVICE_PATH}.json", json={"acknowledged": True}))
+    results.append(summarise(f"PATCH bare x{writers} threads", samples, upstream_count(state, before)))
+
+    before = state.stats["requests"]
+    samples = concurrent(lambda: firebase.queue_patch(DEVICE_PATH, {"acknowledged": True}).result(10))
+    results.append(summarise(f"PATCH coalesced x{writers} threads", samples, upstream_count(state, before)))
+
+    server.shutdown()
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--connect-latency-ms", type=float, default=40.0)
+    parser.add_argument("--latency-ms", type=float, default=2.0)
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    results = run(args.requests, args.connect_latency_ms, args.latency_ms, args.writers)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'case':<32}{'mean ms':>9}{'p50 ms':>9}{'p95 ms':>9}{'upstream':>10}")
+        for r in results:
+            print(f"{r['case']:<32}{r['mean_ms']:>9.2f}{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['upstream_requests']:>10}")
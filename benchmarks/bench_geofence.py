@@ -0,0 +1,117 @@
+"""
+Throughput of the geofence monitor on a replayed trace.
+
+    python benchmarks/bench_geofence.py [--devices 2000] [--duration 120]
+        [--trace trace.jsonl] [--save-trace out.jsonl]
+
+Without --trace, synthesises one: every device random-walks at walking
+pace from a random start, one fix per second, starting at 22:00 so the
+night rule applies; a tenth of them instead pace back and forth across
+a cell edge, to show the hysteresis holding. The trace is replayed
+through geofence.replay (escalations are counted, not sent) against
+the synthetic model fixtures from benchmarks/fixtures.py.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import tempfile
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fixtures import make_fixtures, BBOX
+
+STEP_DEG = 1.4 / 111_000   # one second of walking
+
+def synthetic_trace(devices, duration_s, cell_deg, seed=0):
+    rng = np.random.default_rng(seed)
+    start = int(datetime.datetime(2024, 1, 1, 22, 0).timestamp() * 1000)
+    south, west, north, east = BBOX
+    lat = rng.uniform(south, north, devices)
+    lon = rng.uniform(west, east, devices)
+    heading = rng.uniform(0, 2 * np.pi, devices)
+    # The pacers straddle a cell edge: 3 m either side of it
+    pacers = np.arange(devices) < devices // 10
+    lon[pacers] = (np.floor(lon[pacers] / cell_deg) + 1) * cell_deg
+    edge_lon = lon.copy()
+
+    fixes = []
+    for t in range(duration_s):
+        heading += rng.normal(0, 0.3, devices)
+        lat += np.cos(heading) * STEP_DEG * ~pacers
+        lon += np.sin(heading) * STEP_DEG * ~pacers
+        lon[pacers] = edge_lon[pacers] + np.where(t % 2, 3, -3) / 111_000
+        ts = start + t * 1000
+        fixes.extend({"device_id": f"bag_{i:05d}", "latitude": a, "longitude": b, "timestamp_ms": ts}
+                     for i, (a, b) in enumerate(zip(lat.tolist(), lon.tolist())))
+    return fixes
+
+def run(fixes, tick_s):
+    import geofence
+
+    sent = []
+    monitor = geofence.GeofenceMonitor(escalate=sent.append)
+    t0 = time.perf_counter()
+    geofence.replay(fixes, monitor, tick_s)
+    elapsed = time.perf_counter() - t0
+    stats = monitor.stats()
+
+    # Second pass over the same trace with the cell cache warm: the steady state
+    warm = geofence.GeofenceMonitor(escalate=lambda alert: None)
+    warm.cache = monitor.cache
+    t0 = time.perf_counter()
+    geofence.replay(fixes, warm, tick_s)
+    warm_elapsed = time.perf_counter() - t0
+
+    return {
+        "fixes": len(fixes),
+        "devices": stats["devices"],
+        "seconds": round(elapsed, 3),
+        "fixes_per_s": round(len(fixes) / elapsed),
+        "warm_fixes_per_s": round(len(fixes) / warm_elapsed),
+        "cells_scored": stats["scored"],
+        "cache_hit_rate": round(stats["cached"] / max(stats["fixes"], 1), 4),
+        "entered": stats["entered"],
+        "left": stats["left"],
+        "escalations": stats["escalations"],
+        "devices_escalated": len({a["device_id"] for a in sent}),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--devices", type=int, default=2000)
+    parser.add_argument("--duration", type=int, default=120, help="seconds of synthetic trace")
+    parser.add_argument("--trace", help="replay this recorded trace (geofence.py --record) instead")
+    parser.add_argument("--save-trace", help="write the synthetic trace here")
+    parser.add_argument("--tick", type=float, default=1.0)
+    parser.add_argument("--fixtures", help="fixture directory (default: the hot-path benchmark's)")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    trace = os.path.abspath(args.trace) if args.trace else None
+    save_trace = os.path.abspath(args.save_trace) if args.save_trace else None
+    fixtures = args.fixtures or os.path.join(tempfile.gettempdir(), "safebag_bench_grid60")
+    make_fixtures(fixtures)
+    os.environ["PREDICT_MODE"] = "live"
+    os.chdir(fixtures)
+
+    import geofence
+    if trace:
+        fixes = geofence.read_trace(trace)
+    else:
+        fixes = synthetic_trace(args.devices, args.duration, geofence.CELL_DEG)
+        if save_trace:
+            with open(save_trace, "w") as f:
+                f.writelines(json.dumps(fix) + "\n" for fix in fixes)
+
+    result = run(fixes, args.tick)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        for key, value in result.items():
+            print(f"{key:<20}{value:>12}")
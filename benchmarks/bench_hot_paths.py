@@ -0,0 +1,194 @@
+"""
+Latency of the ml_engine and routing hot paths on synthetic fixtures.
+
+    python benchmarks/bench_hot_paths.py [--grid 60] [--repeat 30]
+        [--out results.json] [--baseline old.json] [--tolerance 0.2]
+
+Builds (or reuses) the fixtures from benchmarks/fixtures.py, imports
+ml_engine and routing against them and times, per input size:
+  predict                         single point, then predict_many batches
+  get_safety_score_for_features   one row, then get_safety_scores batches
+  get_safe_route                  routes spanning 10% .. 100% of the grid
+  route_coords_networkx           geometry extraction for those same paths
+The route cache is disabled, so every call searches. --out writes the
+results with the interpreter, library versions and git commit;
+--baseline compares p50 against an earlier --out file and exits 1 if a
+case got slower by more than --tolerance.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import datetime
+import tempfile
+import subprocess
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fixtures import make_fixtures, BBOX
+
+BATCH_SIZES = [1, 10, 100, 1000]
+ROUTE_SPANS = [0.1, 0.25, 0.5, 1.0]
+# Fixed Monday night departure, so every run uses the same encodings and weights
+WHEN = datetime.datetime(2024, 1, 1, 22, 0)
+
+def timed(fn, repeat):
+    fn()  # warm-up: first-call caches and lazy loads stay out of the numbers
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return samples
+
+def summarise(case, size, samples, **extra):
+    samples = np.array(samples)
+    return dict({
+        "case": case,
+        "size": size,
+        "mean_ms": round(float(samples.mean()), 4),
+        "p50_ms": round(float(np.percentile(samples, 50)), 4),
+        "p95_ms": round(float(np.percentile(samples, 95)), 4),
+        "min_ms": round(float(samples.min()), 4),
+        "repeat": len(samples),
+    }, **extra)
+
+def random_points(n, seed=1):
+    rng = np.random.default_rng(seed)
+    south, west, north, east = BBOX
+    return rng.uniform(south, north, n), rng.uniform(west, east, n)
+
+def route_ends(span):
+    """Start and end on the grid diagonal, `span` of the way across it, centred."""
+    south, west, north, east = BBOX
+    lo, hi = 0.5 - span * 0.49, 0.5 + span * 0.49
+    return (south + (north - south) * lo, west + (east - west) * lo,
+            south + (north - south) * hi, west + (east - west) * hi)
+
+def run(repeat):
+    import ml_engine
+    import routing
+
+    results = []
+
+    lats, lons = random_points(max(BATCH_SIZES))
+    results.append(summarise("predict", 1, timed(lambda: ml_engine.predict(lats[0], lons[0], when=WHEN), repeat)))
+    for n in BATCH_SIZES[1:]:
+        samples = timed(lambda: ml_engine.predict_many(lats[:n], lons[:n], when=WHEN), repeat)
+        results.append(summarise("predict", n, samples))
+
+    artifact = ml_engine.risk_artifact
+    model, le_risk = artifact["model"], artifact["le_risk"]
+    day_enc, slot_enc = ml_engine.encode_time(WHEN.strftime("%A"), ml_engine.get_timeslot(WHEN.hour))
+    X = np.column_stack([np.zeros(len(lats)), lats, lons, np.full(len(lats), WHEN.hour),
+                         np.full(len(lats), day_enc), np.full(len(lats), slot_enc)])
+    samples = timed(lambda: ml_engine.get_safety_score_for_features(model, X[0], le_risk), repeat)
+    results.append(summarise("get_safety_score_for_features", 1, samples))
+    for n in BATCH_SIZES[1:]:
+        samples = timed(lambda: ml_engine.get_safety_scores(model, X[:n], le_risk), repeat)
+        results.append(summarise("get_safety_scores", n, samples))
+
+    routing.load_graph_if_needed()
+    if routing.G_latlon is None:
+        raise RuntimeError("graph fixture did not load")
+    for span in ROUTE_SPANS:
+        ends = route_ends(span)
+        coords = routing.get_safe_route(*ends, when=WHEN)
+        samples = timed(lambda: routing.get_safe_route(*ends, when=WHEN), repeat)
+        results.append(summarise("get_safe_route", span, samples, vertices=len(coords)))
+
+        orig, dest = routing.snap_route_ends(*ends)
+        path = routing.nx.shortest_path(routing.Gp, orig, dest, weight="safety_weight")
+        samples = timed(lambda: routing.route_coords_networkx(path), repeat)
+        results.append(summarise("route_coords_networkx", span, samples, edges=len(path) - 1))
+
+    graph = {"nodes": routing.G_latlon.number_of_nodes(), "edges": routing.G_latlon.number_of_edges()}
+    return results, graph
+
+def environment(grid, graph):
+    import sklearn
+    import networkx
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        commit = None
+    return {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "sklearn": sklearn.__version__,
+        "networkx": networkx.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "grid": grid,
+        "graph": graph,
+    }
+
+def compare(results, baseline, tolerance):
+    """Adds p50 ratios against the baseline; returns the cases over tolerance."""
+    previous = {(r["case"], r["size"]): r for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        old = previous.get((r["case"], r["size"]))
+        if old is None or not old["p50_ms"]:
+            continue
+        r["baseline_p50_ms"] = old["p50_ms"]
+        r["ratio"] = round(r["p50_ms"] / old["p50_ms"], 3)
+        if r["ratio"] > 1 + tolerance:
+            regressions.append(r)
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--grid", type=int, default=60, help="intersections per side of the synthetic graph")
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--fixtures", help="fixture directory (default: a per-grid temp directory, reused)")
+    parser.add_argument("--out", help="write results (with environment) to this JSON file")
+    parser.add_argument("--baseline", help="earlier --out file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p50 slowdown before failing")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    # Paths are relative to where the script was started, not the fixture directory
+    out = os.path.abspath(args.out) if args.out else None
+    baseline_file = os.path.abspath(args.baseline) if args.baseline else None
+    fixtures = args.fixtures or os.path.join(tempfile.gettempdir(), f"safebag_bench_grid{args.grid}")
+    make_fixtures(fixtures, args.grid)
+
+    # Measure the search, not the cache; keep the run offline and on the GraphML path
+    os.environ["ROUTE_CACHE_MAX_BYTES"] = "0"
+    os.environ.pop("ROUTE_CACHE_DB", None)
+    os.environ.update(ROUTING_BACKEND="networkx", FAST_ROUTE_BACKEND="local", PREDICT_MODE="live")
+    os.chdir(fixtures)
+
+    results, graph = run(args.repeat)
+    report = {"environment": environment(args.grid, graph), "results": results}
+
+    regressions = []
+    if baseline_file:
+        with open(baseline_file) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        report["baseline"] = baseline["environment"]
+    if out:
+        with open(out, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"{'case':<32}{'size':>6}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'vs base':>9}")
+        for r in results:
+            ratio = f"{r['ratio']:.2f}x" if "ratio" in r else "-"
+            print(f"{r['case']:<32}{r['size']:>6}{r['mean_ms']:>10.3f}{r['p50_ms']:>10.3f}"
+                  f"{r['p95_ms']:>10.3f}{ratio:>9}")
+        for r in regressions:
+            print(f"⚠️ {r['case']} size {r['size']}: p50 {r['baseline_p50_ms']} -> {r['p50_ms']} ms")
+    sys.exit(1 if regressions else 0)
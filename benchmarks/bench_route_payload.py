@@ -0,0 +1,74 @@
+"""
+Payload size and serialisation time of /route geometry.
+
+    python benchmarks/bench_route_payload.py [--vertices 6000] [--repeat 20]
+
+Uses a synthetic cross-city route (a winding ~20 km line with road-like
+vertex spacing), so it runs without the Nagpur graph.
+"""
+import os
+import sys
+import json
+import gzip
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from geometry import simplify, encode_polyline, zoom_tolerance_m
+
+def synthetic_route(vertices, seed=0):
+    rng = np.random.default_rng(seed)
+    heading = np.cumsum(rng.normal(0, 0.15, vertices))
+    step_deg = 3.5e-5  # ~4 m between vertices
+    lat = 21.10 + np.cumsum(np.cos(heading) * step_deg)
+    lon = 79.02 + np.cumsum(np.sin(heading) * step_deg)
+    return np.column_stack([lat, lon]).tolist()
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.perf_counter() - start) / repeat * 1000
+
+def run(vertices, repeat):
+    route = synthetic_route(vertices)
+    variants = {
+        "json (before)": lambda: json.dumps({"fast_route": route, "safe_route": route}),
+        "json simplify=5m": lambda: json.dumps({"fast_route": simplify(route, 5), "safe_route": simplify(route, 5)}),
+        "json zoom=14": lambda: json.dumps({"fast_route": simplify(route, zoom_tolerance_m(14)),
+                                            "safe_route": simplify(route, zoom_tolerance_m(14))}),
+        "polyline": lambda: json.dumps({"fast_route": encode_polyline(route), "safe_route": encode_polyline(route)}),
+        "polyline simplify=5m": lambda: json.dumps({"fast_route": encode_polyline(simplify(route, 5)),
+                                                    "safe_route": encode_polyline(simplify(route, 5))}),
+    }
+
+    results = []
+    for name, fn in variants.items():
+        body, ms = timed(fn, repeat)
+        body = body.encode()
+        gz, gz_ms = timed(lambda: gzip.compress(body, compresslevel=5), repeat)
+        results.append({
+            "variant": name,
+            "bytes": len(body),
+            "serialise_ms": round(ms, 3),
+            "gzip_bytes": len(gz),
+            "gzip_ms": round(gz_ms, 3),
+        })
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--vertices", type=int, default=6000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    results = run(args.vertices, args.repeat)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'variant':<24}{'bytes':>10}{'ms':>9}{'gzip bytes':>12}{'gzip ms':>9}")
+        for r in results:
+            print(f"{r['variant']:<24}{r['bytes']:>10}{r['serialise_ms']:>9.2f}{r['gzip_bytes']:>12}{r['gzip_ms']:>9.2f}")
@@ -0,0 +1,116 @@
+"""
+Startup time and memory per gunicorn worker for each startup mode.
+
+    python benchmarks/bench_startup.py [--workers 2] [--cwd DIR]
+
+Starts `gunicorn -c gunicorn.conf.py app:app` once per mode and reports
+the time until /status answers, the first /predict and /route latency,
+and RSS / PSS (shared pages split between the processes sharing them)
+of the master and each worker. Run from (or point --cwd at) a directory
+with models/ and data/. Linux only (reads /proc).
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+import requests
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+MODES = {
+    "eager": {"STARTUP_MODE": "eager"},
+    "lazy": {"STARTUP_MODE": "lazy"},
+    "eager + warm-up": {"STARTUP_MODE": "eager", "WARM_UP": "1"},
+    "preload": {"GUNICORN_PRELOAD": "1"},
+}
+ROUTE_QUERY = "start_lat=21.1498&start_lon=79.0806&end_lat=21.1610&end_lon=79.0880"
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def memory_mb(pid):
+    rss = pss = 0.0
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            if line.startswith("Rss:"):
+                rss = int(line.split()[1]) / 1024
+            elif line.startswith("Pss:"):
+                pss = int(line.split()[1]) / 1024
+    return rss, pss
+
+def children(pid):
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(p) for p in f.read().split()]
+
+def timed_get(url, timeout=300):
+    t0 = time.perf_counter()
+    r = requests.get(url, timeout=timeout)
+    return r.status_code, (time.perf_counter() - t0) * 1000
+
+def run_mode(name, env_overrides, workers, cwd):
+    port = free_port()
+    env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY=str(workers), WEB_THREADS="8",
+               FAST_ROUTE_BACKEND="local", PYTHONPATH=ROOT, **env_overrides)
+    t0 = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", os.path.join(ROOT, "gunicorn.conf.py"),
+                             "app:app"], cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{port}"
+    try:
+        while True:
+            try:
+                if requests.get(f"{base}/status", timeout=1).status_code == 200:
+                    break
+            except requests.RequestException:
+                pass
+            if proc.poll() is not None or time.perf_counter() - t0 > 600:
+                raise RuntimeError(f"{name}: gunicorn did not come up")
+            time.sleep(0.05)
+        ready_s = time.perf_counter() - t0
+        # Wait for every worker to finish booting before measuring memory
+        while len(children(proc.pid)) < workers:
+            time.sleep(0.05)
+        time.sleep(1.0)
+        boot = {"master": memory_mb(proc.pid), "workers": [memory_mb(p) for p in children(proc.pid)]}
+
+        _, predict_ms = timed_get(f"{base}/predict?lat=21.1458&lon=79.0882")
+        _, route_ms = timed_get(f"{base}/route?{ROUTE_QUERY}")
+        served = {"workers": [memory_mb(p) for p in children(proc.pid)]}
+    finally:
+        proc.terminate()
+        proc.wait(30)
+
+    return {
+        "mode": name,
+        "ready_s": round(ready_s, 2),
+        "first_predict_ms": round(predict_ms, 1),
+        "first_route_ms": round(route_ms, 1),
+        "master_rss_mb": round(boot["master"][0]),
+        "worker_rss_mb": [round(m[0]) for m in boot["workers"]],
+        "worker_pss_mb": [round(m[1]) for m in boot["workers"]],
+        "worker_pss_after_requests_mb": [round(m[1]) for m in served["workers"]],
+        "total_pss_mb": round(boot["master"][1] + sum(m[1] for m in served["workers"])),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--cwd", default=ROOT, help="directory with models/ and data/")
+    parser.add_argument("--modes", nargs="*", default=list(MODES))
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    results = [run_mode(name, MODES[name], args.workers, args.cwd) for name in args.modes]
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'mode':<17}{'ready s':>8}{'predict ms':>11}{'route ms':>10}"
+              f"{'worker RSS MB':>15}{'worker PSS MB':>15}{'total PSS MB':>14}")
+        for r in results:
+            print(f"{r['mode']:<17}{r['ready_s']:>8.2f}{r['first_predict_ms']:>11.1f}{r['first_route_ms']:>10.1f}"
+                  f"{'/'.join(map(str, r['worker_rss_mb'])):>15}"
+                  f"{'/'.join(map(str, r['worker_pss_after_requests_mb'])):>15}{r['total_pss_mb']:>14}")
@@ -0,0 +1,152 @@
+"""
+Synthetic stand-ins for the artifacts that are not checked in.
+
+    python benchmarks/fixtures.py DIR [--grid 60]
+
+writes, under DIR:
+  models/risk_model.pkl        {"model", "le_day", "le_slot", "le_risk"}
+  models/crime_type_model.pkl  {"model", "le_target"}
+  data/nagpur_graph.graphml    an N x N street grid over Nagpur in UTM 44N,
+                               with length and safety_weight on every edge
+and copies the ward centroids and safe havens from the repo's data/.
+The models are random forests fitted on random points with the same six
+features ml_engine builds, so predict_proba costs about what the real
+ones do. Everything is seeded: the same arguments give the same files.
+"""
+import os
+import sys
+import shutil
+import argparse
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+BBOX = (21.08, 79.00, 21.22, 79.15)    # south, west, north, east
+DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+SLOTS = ["Night", "Morning", "Afternoon", "Evening"]
+RISKS = ["Low", "Moderate", "High", "Critical"]
+CRIMES = ["Theft", "Assault", "Harassment", "Robbery"]
+UTM_CRS = "EPSG:32644"
+
+def risk_samples(rng, samples):
+    """Feature rows as ml_engine builds them, and a risk label for each."""
+    south, west, north, east = BBOX
+    lat = rng.uniform(south, north, samples)
+    lon = rng.uniform(west, east, samples)
+    hour = rng.integers(0, 24, samples)
+    X = np.column_stack([rng.integers(0, 10, samples), lat, lon, hour,
+                         rng.integers(0, 7, samples), rng.integers(0, 4, samples)])
+
+    # Smooth spatial pattern plus a night bump, bucketed into the four labels
+    score = np.sin(lat * 200) + np.cos(lon * 150) + (hour < 6) + rng.normal(0, 0.3, samples)
+    risk = np.select([score < -0.5, score < 0.5, score < 1.2], RISKS[:3], RISKS[3])
+    return X, risk
+
+def make_risk_artifact(samples=2000, trees=10, seed=0, string_classes=False, labels=RISKS):
+    """
+    A small in-memory risk artifact. By default the model is fitted on
+    le_risk-encoded integers, like the real one; string_classes=True fits
+    it on the label strings and leaves le_risk out. `labels` keeps only
+    the samples with those labels.
+    """
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.preprocessing import LabelEncoder
+
+    X, risk = risk_samples(np.random.default_rng(seed), samples)
+    keep = np.isin(risk, labels)
+    X, risk = X[keep], risk[keep]
+    model = RandomForestClassifier(trees, max_depth=8, random_state=seed, n_jobs=1)
+    artifact = {"model": model, "le_day": LabelEncoder().fit(DAYS), "le_slot": LabelEncoder().fit(SLOTS)}
+    if string_classes:
+        model.fit(X, risk)
+    else:
+        artifact["le_risk"] = LabelEncoder().fit(labels)
+        model.fit(X, artifact["le_risk"].transform(risk))
+    return artifact
+
+def make_models(root, samples=5000, trees=100, seed=0):
+    import joblib
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.preprocessing import LabelEncoder
+
+    rng = np.random.default_rng(seed)
+    le_day, le_slot = LabelEncoder().fit(DAYS), LabelEncoder().fit(SLOTS)
+    le_risk, le_target = LabelEncoder().fit(RISKS), LabelEncoder().fit(CRIMES)
+    X, risk = risk_samples(rng, samples)
+    crime = rng.choice(CRIMES, samples)
+
+    risk_model = RandomForestClassifier(trees, max_depth=12, random_state=seed, n_jobs=1)
+    crime_model = RandomForestClassifier(trees // 2, max_depth=10, random_state=seed, n_jobs=1)
+    os.makedirs(os.path.join(root, "models"), exist_ok=True)
+    joblib.dump({"model": risk_model.fit(X, le_risk.transform(risk)), "le_day": le_day,
+                 "le_slot": le_slot, "le_risk": le_risk},
+                os.path.join(root, "models", "risk_model.pkl"))
+    joblib.dump({"model": crime_model.fit(X, le_target.transform(crime)), "le_target": le_target},
+                os.path.join(root, "models", "crime_type_model.pkl"))
+
+def make_grid_graph(root, n=60, seed=0):
+    """Two-way N x N grid with jittered intersections, a few curved and missing streets."""
+    import networkx as nx
+    import osmnx as ox
+    from pyproj import Transformer
+    from shapely.geometry import LineString
+
+    rng = np.random.default_rng(seed)
+    to_utm = Transformer.from_crs("EPSG:4326", UTM_CRS, always_xy=True)
+    south, west, north, east = BBOX
+    step_lat, step_lon = (north - south) / n, (east - west) / n
+    G = nx.MultiDiGraph(crs=UTM_CRS)
+
+    ids = np.arange(n * n).reshape(n, n) + 1000
+    lats = south + np.arange(n)[:, None] * step_lat + rng.normal(0, step_lat * 0.1, (n, n))
+    lons = west + np.arange(n)[None, :] * step_lon + rng.normal(0, step_lon * 0.1, (n, n))
+    xs, ys = to_utm.transform(lons, lats)
+    for node, x, y in zip(ids.ravel(), xs.ravel(), ys.ravel()):
+        G.add_node(int(node), x=float(x), y=float(y))
+
+    def add_edge(u, v):
+        xu, yu, xv, yv = G.nodes[u]["x"], G.nodes[u]["y"], G.nodes[v]["x"], G.nodes[v]["y"]
+        length = float(np.hypot(xu - xv, yu - yv))
+        data = {"length": length, "safety_weight": length * rng.uniform(1, 3)}
+        if rng.random() < 0.4:
+            mid = ((xu + xv) / 2 + rng.normal(0, 20), (yu + yv) / 2 + rng.normal(0, 20))
+            data["geometry"] = LineString([(xu, yu), mid, (xv, yv)])
+        G.add_edge(u, v, **data)
+
+    for i in range(n):
+        for j in range(n):
+            for di, dj in ((0, 1), (1, 0)):
+                if i + di < n and j + dj < n:
+                    a, b = int(ids[i, j]), int(ids[i + di, j + dj])
+                    if rng.random() < 0.93:
+                        add_edge(a, b)
+                    if rng.random() < 0.93:
+                        add_edge(b, a)
+
+    os.makedirs(os.path.join(root, "data"), exist_ok=True)
+    ox.save_graphml(G, os.path.join(root, "data", "nagpur_graph.graphml"))
+    return G.number_of_nodes(), G.number_of_edges()
+
+def make_fixtures(root, grid=60, seed=0, force=False):
+    """Build whatever is missing under root (everything with force) and return root."""
+    models = os.path.join(root, "models", "risk_model.pkl")
+    graph = os.path.join(root, "data", "nagpur_graph.graphml")
+    if force or not os.path.exists(models):
+        make_models(root, seed=seed)
+    if force or not os.path.exists(graph):
+        make_grid_graph(root, grid, seed)
+    for name in ("nagpur_ward_centroids.csv", "safe_havens.csv"):
+        src = os.path.join(ROOT, "data", name)
+        if os.path.exists(src):
+            shutil.copy(src, os.path.join(root, "data", name))
+    return root
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("dir")
+    parser.add_argument("--grid", type=int, default=60, help="intersections per side")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    make_fixtures(args.dir, args.grid, args.seed, force=True)
+    print(f"Fixtures written to {args.dir}", file=sys.stderr)
@@ -0,0 +1,346 @@
+"""
+Latest state of every device, in memory.
+
+DeviceStore keeps one compact record per registered device in parallel
+numpy columns (fix, timestamp, event code, acknowledged flag) plus a
+uniform lat/lon cell index over the fixes, so a lookup by id is a dict
+hit and a bounding-box query only visits the cells it overlaps.
+FleetFeed fills it from one Firebase stream on latest_events (every
+device over a single connection) and polls that node while the stream
+is down. /locations answers from the store, with no Firebase call per
+request.
+"""
+import os
+import csv
+import json
+import time
+import threading
+import numpy as np
+
+import firebase
+from location_feed import sse_events, STREAM_READ_TIMEOUT_S, MAX_BACKOFF_S
+
+DEVICES_FILE = os.getenv("DEVICES_FILE", "data/devices.csv")
+# Side of one index cell in degrees (0.01 is ~1.1 km at Nagpur)
+CELL_DEG = float(os.getenv("DEVICE_CELL_DEG", "0.01"))
+NO_EVENT = "WAITING_FOR_DATA"
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+class DeviceStore:
+    def __init__(self, cell_deg=CELL_DEG, capacity=256):
+        self.cell_deg = cell_deg
+        self.lock = threading.Lock()
+        self.ids = []                 # slot -> device id
+        self.names = []               # slot -> registry name (or None)
+        self.slots = {}               # device id -> slot
+        self.lat = np.full(capacity, np.nan)
+        self.lon = np.full(capacity, np.nan)
+        self.timestamp_ms = np.zeros(capacity, dtype=np.int64)
+        self.event = np.zeros(capacity, dtype=np.int16)
+        self.acknowledged = np.zeros(capacity, dtype=bool)
+        self.event_types = [NO_EVENT]  # event code -> name
+        self.event_codes = {NO_EVENT: 0}
+        self.cell = []                # slot -> (row, col), None without a fix
+        self.cells = {}               # (row, col) -> set of slots
+        self.changed = set()          # slots updated since the last changes() call
+        self.updates = 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    # --- 1. REGISTRY ---
+    def register(self, device_id, name=None):
+        with self.lock:
+            slot = self._slot(device_id)
+            if name:
+                self.names[slot] = name
+            return slot
+
+    def _slot(self, device_id):
+        # Caller holds the lock
+        slot = self.slots.get(device_id)
+        if slot is not None:
+            return slot
+        slot = len(self.ids)
+        if slot == len(self.lat):
+            self._grow()
+        self.ids.append(device_id)
+        self.names.append(None)
+        self.cell.append(None)
+        self.slots[device_id] = slot
+        return slot
+
+    def _grow(self):
+        n = len(self.lat)
+        self.lat = np.concatenate([self.lat, np.full(n, np.nan)])
+        self.lon = np.concatenate([self.lon, np.full(n, np.nan)])
+        self.timestamp_ms = np.concatenate([self.timestamp_ms, np.zeros(n, dtype=np.int64)])
+        self.event = np.concatenate([self.event, np.zeros(n, dtype=np.int16)])
+        self.acknowledged = np.concatenate([self.acknowledged, np.zeros(n, dtype=bool)])
+
+    # --- 2. WRITES ---
+    def update(self, device_id, data, partial=False):
+        """
+        Apply a latest_events node (or, with partial=True, some of its
+        fields) to a device, registering it on first sight. A None field
+        or node clears it.
+        """
+        with self.lock:
+            slot = self._slot(device_id)
+            if not partial:
+                self._clear(slot)
+            for field, value in (data or {}).items():
+                if field == "latitude":
+                    self.lat[slot] = _float(value)
+                elif field == "longitude":
+                    self.lon[slot] = _float(value)
+                elif field == "timestamp_ms":
+                    ts = _float(value)
+                    self.timestamp_ms[slot] = 0 if np.isnan(ts) else int(ts)
+                elif field == "event_type":
+                    self.event[slot] = self._event_code(value or NO_EVENT)
+                elif field == "acknowledged":
+                    self.acknowledged[slot] = bool(value)
+            self._reindex(slot)
+            self.changed.add(slot)
+            self.updates += 1
+
+    def replace_all(self, nodes):
+        """The whole latest_events tree: devices missing from it lose their state."""
+        nodes = nodes if isinstance(nodes, dict) else {}
+        for device_id, node in nodes.items():
+            self.update(device_id, node if isinstance(node, dict) else None)
+        with self.lock:
+            missing = [device_id for device_id in self.ids if device_id not in nodes]
+        for device_id in missing:
+            self.update(device_id, None)
+
+    def _clear(self, slot):
+        self.lat[slot] = self.lon[slot] = np.nan
+        self.timestamp_ms[slot] = 0
+        self.event[slot] = 0
+        self.acknowledged[slot] = False
+
+    def _event_code(self, event_type):
+        code = self.event_codes.get(event_type)
+        if code is None:
+            code = self.event_codes[event_type] = len(self.event_types)
+            self.event_types.append(event_type)
+        return code
+
+    def _cell_of(self, lat, lon):
+        return int(np.floor(lat / self.cell_deg)), int(np.floor(lon / self.cell_deg))
+
+    def _reindex(self, slot):
+        lat, lon = self.lat[slot], self.lon[slot]
+        cell = None if np.isnan(lat) or np.isnan(lon) else self._cell_of(lat, lon)
+        old = self.cell[slot]
+        if cell == old:
+            return
+        if old is not None:
+            members = self.cells[old]
+            members.discard(slot)
+            if not members:
+                del self.cells[old]
+        if cell is not None:
+            self.cells.setdefault(cell, set()).add(slot)
+        self.cell[slot] = cell
+
+    # --- 3. READS ---
+    def _records(self, slots):
+        # One tolist() per column rather than a numpy scalar read per field
+        slots = np.asarray(slots, dtype=np.int64)
+        columns = zip(slots.tolist(), self.lat[slots].tolist(), self.lon[slots].tolist(),
+                      self.event[slots].tolist(), self.acknowledged[slots].tolist(),
+                      self.timestamp_ms[slots].tolist())
+        return [{
+            "device_id": self.ids[slot],
+            "name": self.names[slot],
+            "latitude": lat if self.cell[slot] is not None else None,
+            "longitude": lon if self.cell[slot] is not None else None,
+            "event_type": self.event_types[event],
+            "acknowledged": ack,
+            "timestamp": ts or None,
+        } for slot, lat, lon, event, ack, ts in columns]
+
+    def get(self, device_id):
+        with self.lock:
+            slot = self.slots.get(device_id)
+            return None if slot is None else self._records([slot])[0]
+
+    def get_many(self, device_ids):
+        """Returns (records, unknown ids)."""
+        slots, unknown = [], []
+        with self.lock:
+            for device_id in device_ids:
+                slot = self.slots.get(device_id)
+                if slot is None:
+                    unknown.append(device_id)
+                else:
+                    slots.append(slot)
+            return self._records(slots), unknown
+
+    def all(self, limit=None):
+        with self.lock:
+            return self._records(range(len(self.ids))[:limit])
+
+    def within_bbox(self, south, west, north, east, event_types=None, limit=None):
+        """Devices whose latest fix is inside the box, optionally only some event types."""
+        r0, c0 = self._cell_of(south, west)
+        r1, c1 = self._cell_of(north, east)
+        with self.lock:
+            # Walk the box's cells, or the occupied cells if there are fewer of those
+            if (r1 - r0 + 1) * (c1 - c0 + 1) <= len(self.cells):
+                groups = [self.cells.get((r, c)) for r in range(r0, r1 + 1) for c in range(c0, c1 + 1)]
+            else:
+                groups = [members for (r, c), members in self.cells.items()
+                          if r0 <= r <= r1 and c0 <= c <= c1]
+            slots = np.fromiter((slot for members in groups if members for slot in members), dtype=np.int64)
+            if not len(slots):
+                return []
+            slots.sort()
+            lat, lon = self.lat[slots], self.lon[slots]
+            inside = (lat >= south) & (lat <= north) & (lon >= west) & (lon <= east)
+            if event_types:
+                codes = [self.event_codes[e] for e in event_types if e in self.event_codes]
+                inside &= np.isin(self.event[slots], codes)
+            return self._records(slots[inside][:limit])
+
+    def changes(self):
+        """Fixes of the devices updated since the last call: (ids, lats, lons, timestamps_ms)."""
+        with self.lock:
+            slots = np.fromiter(self.changed, dtype=np.int64)
+            self.changed = set()
+            slots = slots[~np.isnan(self.lat[slots]) & ~np.isnan(self.lon[slots])]
+            return ([self.ids[slot] for slot in slots.tolist()], self.lat[slots], self.lon[slots],
+                    self.timestamp_ms[slots])
+
+    def stats(self):
+        with self.lock:
+            with_fix = sum(1 for cell in self.cell if cell is not None)
+            return {"devices": len(self.ids), "with_fix": with_fix, "cells": len(self.cells),
+                    "updates": self.updates, "event_types": len(self.event_types)}
+
+def load_registry(store, path=DEVICES_FILE):
+    """Register the devices listed in a device_id,name CSV."""
+    if not os.path.exists(path):
+        print(f"⚠️ Device registry not found at {path}; devices register on first update")
+        return 0
+    with open(path, newline="") as f:
+        rows = [row for row in csv.DictReader(f) if row.get("device_id")]
+    for row in rows:
+        store.register(row["device_id"].strip(), (row.get("name") or "").strip() or None)
+    return len(rows)
+
+class FleetFeed:
+    """One stream on latest_events feeding a DeviceStore."""
+    def __init__(self, store, path="latest_events"):
+        self.store = store
+        self.path = path
+        self.connected = False
+        self.synced_at = 0.0
+        self.lock = threading.Lock()
+        self.counters = {"stream_events": 0, "reconnects": 0, "polls": 0}
+        self.thread = threading.Thread(target=self.run, name="fleet-feed", daemon=True)
+
+    def run(self):
+        backoff = 1
+        while True:
+            with self.lock:
+                seen = self.counters["stream_events"]
+            try:
+                self._stream()
+            except Exception as e:
+                print(f"⚠️ Fleet stream dropped: {e}")
+            with self.lock:
+                # A stream that delivered events was healthy: reconnect quickly
+                if self.counters["stream_events"] > seen:
+                    backoff = 1
+                self.connected = False
+                self.counters["reconnects"] += 1
+            # Keep the store current by polling until the stream is back
+            try:
+                self.poll()
+            except Exception:
+                pass
+            time.sleep(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF_S)
+
+    def _stream(self):
+        with firebase.session.get(firebase.url_for(self.path), headers={"Accept": "text/event-stream"},
+                                  stream=True, timeout=(firebase.CONNECT_TIMEOUT_S, STREAM_READ_TIMEOUT_S)) as r:
+            r.raise_for_status()
+            for event, data in sse_events(r):
+                self._apply(event, data)
+
+    def _apply(self, event, data):
+        if event in ("cancel", "auth_revoked"):
+            raise RuntimeError(f"stream {event}: {data}")
+        with self.lock:
+            self.connected = True
+            self.synced_at = time.monotonic()
+            self.counters["stream_events"] += 1
+        if event not in ("put", "patch"):
+            return
+        msg = json.loads(data)
+        parts = [p for p in msg["path"].split("/") if p]
+        if event == "put":
+            self._put(parts, msg["data"])
+        else:
+            # A patch is a put of each listed child
+            for key, child in (msg["data"] or {}).items():
+                self._put(parts + [p for p in key.split("/") if p], child)
+
+    def _put(self, parts, value):
+        if not parts:
+            self.store.replace_all(value)
+        elif len(parts) == 1:
+            self.store.update(parts[0], value if isinstance(value, dict) else None)
+        elif len(parts) == 2:
+            self.store.update(parts[0], {parts[1]: value}, partial=True)
+
+    def poll(self):
+        self.store.replace_all(firebase.fetch_latest_devices())
+        with self.lock:
+            self.synced_at = time.monotonic()
+            self.counters["polls"] += 1
+
+    def stats(self):
+        with self.lock:
+            result = dict(self.counters, connected=self.connected,
+                          age_s=round(time.monotonic() - self.synced_at, 3) if self.synced_at else None)
+        result.update(self.store.stats())
+        return result
+
+_fleet = None
+_fleet_lock = threading.Lock()
+
+def get_fleet():
+    """The process-wide fleet feed, loading the registry and starting the stream on first use."""
+    global _fleet
+    with _fleet_lock:
+        if _fleet is None:
+            store = DeviceStore()
+            count = load_registry(store)
+            _fleet = FleetFeed(store)
+            # One synchronous read, so the first request is not answered from an empty store
+            try:
+                _fleet.poll()
+            except Exception as e:
+                print(f"⚠️ Initial fleet read failed, waiting for the stream: {e}")
+            _fleet.thread.start()
+            print(f"✅ Device store started ({count} registered devices)")
+        return _fleet
+
+def _after_fork():
+    # The stream thread does not survive a fork; children start their own
+    global _fleet, _fleet_lock
+    _fleet = None
+    _fleet_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,141 @@
+"""
+Time-dependent safety weights for the road graph snapshot.
+
+`python edge_risk.py` scores the midpoint of every snapshot edge with
+the risk model, in large batches on a process pool, once per time slot
+(or per weekday and slot with --per-day). For each slot it writes
+
+    weights/<slot>.npy    float32, parallel to the snapshot edge arrays
+                          safety_weight * (1 + RISK_PENALTY * (1 - safety))
+
+next to the snapshot, plus weights/manifest.json. A slot is rebuilt only
+when the risk model file, the snapshot or the penalty has changed.
+"""
+import os
+import json
+import time
+import argparse
+import datetime
+import multiprocessing
+import numpy as np
+
+import graph_snapshot
+from ml_engine import get_timeslot
+
+WEIGHTS_SUBDIR = "weights"
+RISK_MODEL_FILE = "models/risk_model.pkl"
+RISK_PENALTY = float(os.getenv("RISK_PENALTY", "2.0"))
+CHUNK_SIZE = 20000
+
+# Hour used to score each slot (the middle of the get_timeslot bucket)
+SLOT_HOURS = {"Night": 2, "Morning": 9, "Afternoon": 15, "Evening": 21}
+REFERENCE_MONDAY = datetime.datetime(2024, 1, 1)
+
+def weight_key(when, per_day=False):
+    slot = get_timeslot(when.hour)
+    return f"{when.strftime('%A')}_{slot}" if per_day else slot
+
+def edge_midpoints(snap):
+    indptr = np.asarray(snap["indptr"])
+    src = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    dst = np.asarray(snap["indices"])
+    lat, lon = np.asarray(snap["node_lat"]), np.asarray(snap["node_lon"])
+    return (lat[src] + lat[dst]) / 2, (lon[src] + lon[dst]) / 2
+
+def _score_chunk(task):
+    # Runs in a pool worker; forked workers share the parent's loaded model
+    import ml_engine
+    lats, lons, when = task
+    results = ml_engine.predict_many(lats, lons, when=when, mode="live")
+    return np.array([r[2] for r in results], dtype=np.float64)
+
+def _stamp(snap):
+    stamp = {"snapshot": snap["meta"]["built_at"], "penalty": RISK_PENALTY}
+    if os.path.exists(RISK_MODEL_FILE):
+        stamp["model_mtime"] = os.path.getmtime(RISK_MODEL_FILE)
+        stamp["model_size"] = os.path.getsize(RISK_MODEL_FILE)
+    return stamp
+
+def build_edge_weights(snapshot_dir=graph_snapshot.SNAPSHOT_DIR, per_day=False, workers=None, force=False):
+    import ml_engine
+    if not ml_engine.risk_artifact:
+        raise RuntimeError("Risk model not loaded; cannot score edges")
+
+    snap = graph_snapshot.load_snapshot(snapshot_dir)
+    out_dir = os.path.join(snapshot_dir, WEIGHTS_SUBDIR)
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_file = os.path.join(out_dir, "manifest.json")
+    manifest = {}
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+
+    stamp = _stamp(snap)
+    lats, lons = edge_midpoints(snap)
+    base = np.asarray(snap["safety_weight"], dtype=np.float64)
+    n = len(base)
+    ranges = [(a, min(a + CHUNK_SIZE, n)) for a in range(0, n, CHUNK_SIZE)]
+
+    slots = []
+    for day in (range(7) if per_day else [0]):
+        for slot, hour in SLOT_HOURS.items():
+            when = REFERENCE_MONDAY + datetime.timedelta(days=day, hours=hour)
+            slots.append((weight_key(when, per_day), when))
+
+    workers = workers or os.cpu_count()
+    print(f"Scoring {n} edges x {len(slots)} slots on {workers} workers")
+    total = time.time()
+    with multiprocessing.Pool(workers) as pool:
+        for key, when in slots:
+            out_file = os.path.join(out_dir, f"{key}.npy")
+            if not force and manifest.get(key, {}).get("stamp") == stamp and os.path.exists(out_file):
+                print(f"  {key}: up to date")
+                continue
+
+            t0 = time.time()
+            safety = np.concatenate(pool.map(_score_chunk, [(lats[a:b], lons[a:b], when) for a, b in ranges]))
+            weights = (base * (1 + RISK_PENALTY * (1 - safety))).astype(np.float32)
+
+            # Swap in atomically so running workers never see half a file
+            tmp_file = out_file + ".tmp.npy"
+            np.save(tmp_file, weights)
+            os.replace(tmp_file, out_file)
+
+            seconds = time.time() - t0
+            manifest[key] = {"stamp": stamp, "hour": when.hour, "seconds": round(seconds, 2),
+                             "built_at": datetime.datetime.now().isoformat(timespec="seconds")}
+            print(f"  {key}: {seconds:.1f}s ({n / max(seconds, 1e-9):,.0f} edges/s)")
+
+    with open(manifest_file, "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"✅ Edge weights up to date in {time.time() - total:.1f}s")
+    return manifest
+
+def load_edge_weights(snap, snapshot_dir=graph_snapshot.SNAPSHOT_DIR):
+    """
+    Map every weights/<key>.npy into the snapshot as snap["risk_<key>"].
+    Returns {key: weight name}; empty when the pipeline has not run.
+    """
+    out_dir = os.path.join(snapshot_dir, WEIGHTS_SUBDIR)
+    manifest_file = os.path.join(out_dir, "manifest.json")
+    if not os.path.exists(manifest_file):
+        return {}
+    with open(manifest_file) as f:
+        manifest = json.load(f)
+
+    names = {}
+    for key in manifest:
+        path = os.path.join(out_dir, f"{key}.npy")
+        if os.path.exists(path):
+            snap[f"risk_{key}"] = np.load(path, mmap_mode="r")
+            names[key] = f"risk_{key}"
+    return names
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build time-dependent edge weights")
+    parser.add_argument("--snapshot", default=graph_snapshot.SNAPSHOT_DIR)
+    parser.add_argument("--per-day", action="store_true", help="one array per weekday and slot")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--force", action="store_true", help="rebuild every slot")
+    args = parser.parse_args()
+    build_edge_weights(args.snapshot, args.per_day, args.workers, args.force)
@@ -0,0 +1,361 @@
+"""
+Local, append-only history of ingested events.
+
+Events are stored column by column in segment directories, each
+covering EVENT_SEGMENT_HOURS of event time, under EVENT_STORE_DIR:
+
+    data/events/manifest.json               cursor, dictionaries, row counts
+    data/events/<segment start ms>/ts.bin   int64 timestamp_ms
+                                  device.bin int32 device code
+                                  lat.bin, lon.bin  float32 (~1 m, served to 5 decimals)
+                                  event.bin  int16 event type code
+
+A batch is appended to the column files and then committed by
+atomically replacing manifest.json. Readers memory-map each column up
+to the committed row count, so a query never sees half a batch and
+never touches the network. Use one writer per directory (the SOS
+listener) and any number of readers (web workers); a read that races
+the writer expiring a segment re-reads the manifest and runs again.
+
+    python event_store.py --import     one-off backfill of the whole Firebase events tree
+    python event_store.py --stats
+"""
+import os
+import json
+import time
+import shutil
+import argparse
+import functools
+import threading
+import numpy as np
+import firebase
+
+STORE_DIR = os.getenv("EVENT_STORE_DIR", "data/events")
+SEGMENT_HOURS = float(os.getenv("EVENT_SEGMENT_HOURS", "24"))
+# Segments older than this are dropped by the writer (0 keeps everything)
+RETENTION_DAYS = float(os.getenv("EVENT_RETENTION_DAYS", "0"))
+MANIFEST = "manifest.json"
+COLUMNS = {"ts": np.int64, "device": np.int32, "lat": np.float32, "lon": np.float32, "event": np.int16}
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+def _retry_expired(read):
+    """
+    Run a read again on the current manifest if a segment it went to
+    map was expired (and its files deleted) after the read loaded its own.
+    """
+    @functools.wraps(read)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return read(self, *args, **kwargs)
+        except FileNotFoundError:
+            with self.lock:
+                self.stamp = None
+                self._load()
+            return read(self, *args, **kwargs)
+    return wrapper
+
+class EventStore:
+    def __init__(self, path=STORE_DIR, writable=False, segment_hours=SEGMENT_HOURS):
+        self.path = path
+        self.writable = writable
+        self.lock = threading.Lock()
+        self.maps = {}              # segment -> (row count, {column: memmap})
+        self.segment_ms = int(segment_hours * 3600 * 1000)
+        if writable:
+            os.makedirs(path, exist_ok=True)
+        self._reset()
+
+    def _reset(self):
+        """(Re)load the committed state; the writer also discards anything uncommitted."""
+        self.stamp = None           # manifest (mtime_ns, size) last loaded
+        self.maps.clear()
+        self.manifest = {"version": 1, "segment_ms": self.segment_ms, "cursor": None,
+                         "devices": [], "event_types": [], "segments": {}}
+        self.device_codes, self.event_codes = {}, {}
+        self._load()
+        if self.writable:
+            self._repair()
+
+    # --- 1. MANIFEST ---
+    def _manifest_path(self):
+        return os.path.join(self.path, MANIFEST)
+
+    def _load(self):
+        try:
+            st = os.stat(self._manifest_path())
+        except FileNotFoundError:
+            return
+        stamp = (st.st_mtime_ns, st.st_size)
+        if stamp == self.stamp:
+            return
+        with open(self._manifest_path()) as f:
+            self.manifest = json.load(f)
+        self.stamp = stamp
+        self.device_codes = {d: i for i, d in enumerate(self.manifest["devices"])}
+        self.event_codes = {e: i for i, e in enumerate(self.manifest["event_types"])}
+        # Unmap segments the writer has expired, so their disk space is freed
+        for segment in [s for s in self.maps if s not in self.manifest["segments"]]:
+            del self.maps[segment]
+
+    def _refresh(self):
+        # Readers pick up the writer's latest commit (one stat() when nothing changed)
+        if not self.writable:
+            with self.lock:
+                self._load()
+
+    def _commit(self):
+        tmp = self._manifest_path() + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp, self._manifest_path())
+
+    def _column_file(self, segment, column):
+        return os.path.join(self.path, segment, f"{column}.bin")
+
+    def _repair(self):
+        """Drop rows and segments a crashed writer appended but never committed."""
+        segments = self.manifest["segments"]
+        for name in os.listdir(self.path):
+            full = os.path.join(self.path, name)
+            if os.path.isdir(full) and name not in segments:
+                shutil.rmtree(full)
+        for segment, meta in segments.items():
+            for column, dtype in COLUMNS.items():
+                size = meta["count"] * np.dtype(dtype).itemsize
+                if os.path.getsize(self._column_file(segment, column)) > size:
+                    os.truncate(self._column_file(segment, column), size)
+
+    # --- 2. WRITES ---
+    def _code(self, kind, value):
+        codes = self.device_codes if kind == "devices" else self.event_codes
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(self.manifest[kind])
+            self.manifest[kind].append(value)
+        return code
+
+    def append(self, events):
+        """
+        Append {key: event} from the events tree. Keys at or before the
+        cursor (the newest key already stored) are skipped, so a replayed
+        batch is not stored twice. Returns the number of rows added.
+        """
+        if not self.writable:
+            raise RuntimeError("event store opened read-only")
+        cursor = self.manifest["cursor"]
+        keys = sorted(k for k in events if cursor is None or k > cursor)
+        if not keys:
+            return 0
+
+        rows = []
+        now_ms = int(time.time() * 1000)
+        for key in keys:
+            ev = events[key]
+            if not isinstance(ev, dict):
+                continue
+            ts = _float(ev.get("timestamp_ms"))
+            rows.append((now_ms if np.isnan(ts) else int(ts),
+                         self._code("devices", ev.get("device_id") or firebase.DEVICE_ID),
+                         _float(ev.get("latitude")), _float(ev.get("longitude")),
+                         self._code("event_types", ev.get("event_type") or "UNKNOWN")))
+
+        try:
+            if rows:
+                columns = dict(zip(COLUMNS, (np.array(c, dtype=dtype) for c, dtype in zip(zip(*rows),
+                                                                                            COLUMNS.values()))))
+                segment_ms = self.manifest["segment_ms"]
+                starts = columns["ts"] // segment_ms * segment_ms
+                for start in np.unique(starts).tolist():
+                    self._append_segment(str(start), {c: a[starts == start] for c, a in columns.items()})
+
+            self.manifest["cursor"] = keys[-1]
+            expired = self._expire()
+            self._commit()
+        except Exception:
+            # Back to the last commit, so the next batch does not commit rows that were never written
+            self._reset()
+            raise
+        for segment in expired:
+            shutil.rmtree(os.path.join(self.path, segment), ignore_errors=True)
+        return len(rows)
+
+    def _append_segment(self, segment, columns):
+        ts = columns["ts"]
+        meta = self.manifest["segments"].get(segment)
+        if meta is None:
+            os.makedirs(os.path.join(self.path, segment), exist_ok=True)
+            meta = self.manifest["segments"][segment] = {"count": 0, "min_ts": int(ts.min()),
+                                                         "max_ts": int(ts.max()), "sorted": True}
+        for column, values in columns.items():
+            with open(self._column_file(segment, column), "ab") as f:
+                f.write(values.tobytes())
+        # Sorted segments answer time ranges with a binary search
+        meta["sorted"] = bool(meta["sorted"] and (meta["count"] == 0 or ts[0] >= meta["max_ts"])
+                              and np.all(ts[1:] >= ts[:-1]))
+        meta["count"] += len(ts)
+        meta["min_ts"] = min(meta["min_ts"], int(ts.min()))
+        meta["max_ts"] = max(meta["max_ts"], int(ts.max()))
+
+    def _expire(self):
+        """Forget segments past the retention window; their files go after the commit."""
+        if RETENTION_DAYS <= 0:
+            return []
+        horizon = time.time() * 1000 - RETENTION_DAYS * 86400 * 1000
+        expired = [s for s, meta in self.manifest["segments"].items() if meta["max_ts"] < horizon]
+        for segment in expired:
+            del self.manifest["segments"][segment]
+            self.maps.pop(segment, None)
+        return expired
+
+    # --- 3. READS ---
+    def _columns(self, segment, count):
+        with self.lock:
+            cached = self.maps.get(segment)
+            if cached is None or cached[0] != count:
+                cached = self.maps[segment] = (count, {
+                    column: np.memmap(self._column_file(segment, column), dtype=dtype, mode="r", shape=(count,))
+                    for column, dtype in COLUMNS.items()})
+            return cached[1]
+
+    def _matches(self, start_ms=None, end_ms=None, device_id=None, event_type=None, newest_first=False):
+        """
+        (columns, rows in time order) for each segment with matching rows;
+        rows is a slice when every row in a time range matches, else an index array.
+        """
+        self._refresh()
+        with self.lock:
+            manifest = self.manifest
+            device = self.device_codes.get(device_id) if device_id is not None else None
+            event = self.event_codes.get(event_type) if event_type is not None else None
+        if (device_id is not None and device is None) or (event_type is not None and event is None):
+            return
+        segments = sorted(manifest["segments"].items(), key=lambda s: int(s[0]), reverse=newest_first)
+        for segment, meta in segments:
+            if (start_ms is not None and meta["max_ts"] < start_ms) or (end_ms is not None and meta["min_ts"] >= end_ms):
+                continue
+            columns = self._columns(segment, meta["count"])
+            ts = columns["ts"]
+            lo, hi = 0, meta["count"]
+            if meta["sorted"]:
+                if start_ms is not None:
+                    lo = int(np.searchsorted(ts, start_ms, "left"))
+                if end_ms is not None:
+                    hi = int(np.searchsorted(ts, end_ms, "left"))
+            if meta["sorted"] and device is None and event is None:
+                if hi > lo:
+                    yield columns, slice(lo, hi)
+                continue
+            mask = np.ones(hi - lo, dtype=bool)
+            if not meta["sorted"]:
+                if start_ms is not None:
+                    mask &= ts[lo:hi] >= start_ms
+                if end_ms is not None:
+                    mask &= ts[lo:hi] < end_ms
+            if device is not None:
+                mask &= columns["device"][lo:hi] == device
+            if event is not None:
+                mask &= columns["event"][lo:hi] == event
+            rows = lo + np.flatnonzero(mask)
+            if not meta["sorted"]:
+                rows = rows[np.argsort(ts[rows], kind="stable")]
+            if len(rows):
+                yield columns, rows
+
+    def _records(self, columns, rows):
+        devices, event_types = self.manifest["devices"], self.manifest["event_types"]
+        return [{
+            "device_id": devices[device],
+            "event_type": event_types[event],
+            "latitude": None if lat != lat else round(lat, 5),
+            "longitude": None if lon != lon else round(lon, 5),
+            "timestamp_ms": ts,
+        } for ts, device, lat, lon, event in zip(*(columns[c][rows].tolist() for c in COLUMNS))]
+
+    @_retry_expired
+    def device_range(self, device_id, start_ms=None, end_ms=None, limit=1000):
+        """A device's events in [start_ms, end_ms), oldest first, at most `limit`."""
+        records = []
+        for columns, rows in self._matches(start_ms, end_ms, device_id=device_id):
+            # device_id is always set here, so rows is an index array
+            records.extend(self._records(columns, rows[:limit - len(records)]))
+            if len(records) >= limit:
+                break
+        return records
+
+    @_retry_expired
+    def counts(self, start_ms=None, end_ms=None, device_id=None):
+        """{event_type: count} in [start_ms, end_ms), for one device or all."""
+        totals = np.zeros(len(self.manifest["event_types"]) or 1, dtype=np.int64)
+        for columns, rows in self._matches(start_ms, end_ms, device_id=device_id):
+            found = np.bincount(columns["event"][rows], minlength=len(totals))
+            if len(found) > len(totals):
+                totals = np.concatenate([totals, np.zeros(len(found) - len(totals), dtype=np.int64)])
+            totals[:len(found)] += found
+        return {self.manifest["event_types"][i]: int(n) for i, n in enumerate(totals.tolist()) if n}
+
+    @_retry_expired
+    def last(self, n=100, device_id=None, event_type=None):
+        """The newest n events (optionally of one device / type), newest first."""
+        records = []
+        for columns, rows in self._matches(device_id=device_id, event_type=event_type, newest_first=True):
+            wanted = n - len(records)
+            rows = slice(max(rows.stop - wanted, rows.start), rows.stop) if isinstance(rows, slice) else rows[-wanted:]
+            # Segments partition time, so the newest segment's rows come first
+            records.extend(reversed(self._records(columns, rows)))
+            if len(records) >= n:
+                break
+        return records
+
+    def stats(self):
+        self._refresh()
+        with self.lock:
+            segments = self.manifest["segments"]
+            return {
+                "events": sum(meta["count"] for meta in segments.values()),
+                "segments": len(segments),
+                "devices": len(self.manifest["devices"]),
+                "event_types": len(self.manifest["event_types"]),
+                "cursor": self.manifest["cursor"],
+                "bytes": sum(meta["count"] for meta in segments.values())
+                         * sum(np.dtype(d).itemsize for d in COLUMNS.values()),
+                "oldest_ts": min((meta["min_ts"] for meta in segments.values()), default=None),
+                "newest_ts": max((meta["max_ts"] for meta in segments.values()), default=None),
+            }
+
+_reader = None
+_reader_lock = threading.Lock()
+
+def get_store():
+    """Process-wide read-only view of STORE_DIR (the listener owns the writer)."""
+    global _reader
+    with _reader_lock:
+        if _reader is None:
+            _reader = EventStore(STORE_DIR)
+        return _reader
+
+def _after_fork():
+    global _reader_lock
+    _reader_lock = threading.Lock()
+    if _reader is not None:
+        _reader.lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_after_fork)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--import", dest="backfill", action="store_true",
+                        help="append the whole Firebase events tree (one large read)")
+    parser.add_argument("--stats", action="store_true")
+    args = parser.parse_args()
+
+    if args.backfill:
+        store = EventStore(STORE_DIR, writable=True)
+        t0 = time.perf_counter()
+        added = store.append(firebase.fetch_events() or {})
+        print(f"✅ Imported {added} events in {time.perf_counter() - t0:.1f} s")
+    print(json.dumps(EventStore(STORE_DIR).stats(), indent=2))
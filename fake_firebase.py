@@ -0,0 +1,252 @@
+"""
+Local stand-in for the Firebase Realtime Database REST API.
+
+Good enough for tests, benchmarks and load generation: an in-memory
+JSON tree with GET / PUT / PATCH (including multi-path updates) / POST
+(chronological push keys) / DELETE, Firebase ETags, the orderBy="$key"
+startAt / endAt / limitToFirst / limitToLast query parameters, REST
+streaming (GET with Accept: text/event-stream), and request counters at
+GET /__stats.
+
+    python fake_firebase.py --port 9000 [--latency-ms 5] [--connect-latency-ms 40]
+
+then point FIREBASE_URL at http://127.0.0.1:9000.
+
+--connect-latency-ms is paid once per new TCP connection, standing in for
+the TLS handshake that keep-alive connections avoid.
+"""
+import json
+import time
+import queue
+import random
+import hashlib
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PUSH_CHARS = "-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz"
+
+class FirebaseState:
+    def __init__(self):
+        self.root = None
+        self.lock = threading.Lock()
+        self.stats = {"connections": 0, "requests": 0, "GET": 0, "PUT": 0, "PATCH": 0,
+                      "POST": 0, "DELETE": 0, "not_modified": 0, "streams": 0, "stream_events": 0}
+        self.listeners = []   # (path parts, queue) per open stream
+        self.last_push_ms = 0
+        self.last_rand = [0] * 12
+
+    # --- tree helpers ---
+    def get(self, parts):
+        node = self.root
+        for part in parts:
+            if not isinstance(node, dict) or part not in node:
+                return None
+            node = node[part]
+        return node
+
+    def set(self, parts, value):
+        if not parts:
+            self.root = value
+            self.notify(parts)
+            return
+        if not isinstance(self.root, dict):
+            self.root = {}
+        node = self.root
+        for part in parts[:-1]:
+            if not isinstance(node.get(part), dict):
+                node[part] = {}
+            node = node[part]
+        if value is None:
+            node.pop(parts[-1], None)
+        else:
+            node[parts[-1]] = value
+        self.notify(parts)
+
+    def notify(self, parts):
+        """Tell every stream watching `parts`, or a node above or below it."""
+        for path, events in self.listeners:
+            if parts[:len(path)] == path:
+                rel = "/" + "/".join(parts[len(path):])
+                events.put(("put", {"path": rel, "data": self.get(parts)}))
+            elif path[:len(parts)] == parts:
+                events.put(("put", {"path": "/", "data": self.get(path)}))
+
+    def push_id(self):
+        """Chronologically sortable key, same scheme as Firebase push IDs."""
+        now = int(time.time() * 1000)
+        if now == self.last_push_ms:
+            i = 11
+            while i >= 0 and self.last_rand[i] == 63:
+                self.last_rand[i] = 0
+                i -= 1
+            self.last_rand[i] += 1
+        else:
+            self.last_rand = [random.randrange(64) for _ in range(12)]
+        self.last_push_ms = now
+        stamp = []
+        for _ in range(8):
+            stamp.append(PUSH_CHARS[now % 64])
+            now //= 64
+        return "".join(reversed(stamp)) + "".join(PUSH_CHARS[r] for r in self.last_rand)
+
+def _split(path):
+    path = path[:-len(".json")] if path.endswith(".json") else path
+    return [p for p in path.split("/") if p]
+
+def _apply_query(value, query):
+    if not isinstance(value, dict) or query.get("orderBy") != "$key":
+        return value
+    keys = sorted(value)
+    if "startAt" in query:
+        keys = [k for k in keys if k >= query["startAt"]]
+    if "endAt" in query:
+        keys = [k for k in keys if k <= query["endAt"]]
+    if "limitToFirst" in query:
+        keys = keys[:int(query["limitToFirst"])]
+    if "limitToLast" in query:
+        keys = keys[-int(query["limitToLast"]):]
+    return {k: value[k] for k in keys}
+
+def make_handler(state, latency_ms=0.0, connect_latency_ms=0.0, keepalive_s=30.0):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def setup(self):
+            super().setup()
+            with state.lock:
+                state.stats["connections"] += 1
+            if connect_latency_ms:
+                time.sleep(connect_latency_ms / 1000.0)
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, value=None, headers=None):
+            body = json.dumps(value).encode() if status != 304 else b""
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for key, val in (headers or {}).items():
+                self.send_header(key, val)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _body(self):
+            length = int(self.headers.get("Content-Length", 0))
+            return json.loads(self.rfile.read(length) or b"null")
+
+        def _start(self, method):
+            if latency_ms:
+                time.sleep(latency_ms / 1000.0)
+            url = urlparse(self.path)
+            query = {k: json.loads(v[0]) if v[0][:1] in '"[{' else v[0]
+                     for k, v in parse_qs(url.query).items()}
+            with state.lock:
+                state.stats["requests"] += 1
+                state.stats[method] += 1
+            return _split(url.path), query
+
+        def do_GET(self):
+            if self.path.startswith("/__stats"):
+                with state.lock:
+                    return self._send(200, dict(state.stats))
+            parts, query = self._start("GET")
+            if "text/event-stream" in self.headers.get("Accept", ""):
+                return self._stream(parts)
+            with state.lock:
+                value = _apply_query(state.get(parts), query)
+                body = json.dumps(value)
+            headers = {}
+            if self.headers.get("X-Firebase-ETag") == "true":
+                etag = hashlib.sha1(body.encode()).hexdigest()
+                headers["ETag"] = etag
+                if self.headers.get("If-None-Match") == etag:
+                    with state.lock:
+                        state.stats["not_modified"] += 1
+                    return self._send(304, headers=headers)
+            self._send(200, value, headers)
+
+        def _stream(self, parts):
+            events = queue.Queue()
+            with state.lock:
+                state.stats["streams"] += 1
+                state.listeners.append((parts, events))
+                events.put(("put", {"path": "/", "data": state.get(parts)}))
+            self.close_connection = True
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                while True:
+                    try:
+                        name, data = events.get(timeout=keepalive_s)
+                    except queue.Empty:
+                        name, data = "keep-alive", None
+                    chunk = f"event: {name}\ndata: {json.dumps(data)}\n\n".encode()
+                    self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+                    self.wfile.flush()
+                    with state.lock:
+                        state.stats["stream_events"] += 1
+            except OSError:
+                pass
+            finally:
+                with state.lock:
+                    state.listeners.remove((parts, events))
+
+        def do_PUT(self):
+            parts, _ = self._start("PUT")
+            value = self._body()
+            with state.lock:
+                state.set(parts, value)
+            self._send(200, value)
+
+        def do_PATCH(self):
+            parts, _ = self._start("PATCH")
+            value = self._body()
+            with state.lock:
+                for key, child in (value or {}).items():
+                    state.set(parts + _split(key), child)
+            self._send(200, value)
+
+        def do_POST(self):
+            parts, _ = self._start("POST")
+            value = self._body()
+            with state.lock:
+                key = state.push_id()
+                state.set(parts + [key], value)
+            self._send(200, {"name": key})
+
+        def do_DELETE(self):
+            parts, _ = self._start("DELETE")
+            with state.lock:
+                state.set(parts, None)
+            self._send(200, None)
+
+    return Handler
+
+def start_fake_firebase(port=0, latency_ms=0.0, connect_latency_ms=0.0, keepalive_s=30.0):
+    """Serve on a background thread. Returns (server, base_url, state)."""
+    state = FirebaseState()
+    handler = make_handler(state, latency_ms, connect_latency_ms, keepalive_s)
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}", state
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Firebase REST stand-in")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="added to every request")
+    parser.add_argument("--connect-latency-ms", type=float, default=0.0, help="added to every new connection")
+    args = parser.parse_args()
+
+    server, url, _ = start_fake_firebase(args.port, args.latency_ms, args.connect_latency_ms)
+    print(f"🔥 Fake Firebase listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -1,16 +1,212 @@
-import os, requests
+"""
+Firebase Realtime Database REST client shared by the app and the listener.
+
+- One keep-alive requests.Session (pooled connections, no TLS handshake
+  per call) with strict connect/read timeouts on every request.
+- get_cached(): conditional GETs with Firebase ETags; an unchanged node
+  is answered from the local copy without re-parsing the body.
+- queue_patch(): PATCHes issued within FIREBASE_COALESCE_MS are merged
+  into one multi-path update at the database root.
+"""
+import os
+import json
+import threading
+from concurrent.futures import Future
+import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
+import metrics
 
 load_dotenv()
 
 FIREBASE_URL = os.getenv("FIREBASE_URL")
+# The bag reporting under latest_events/ when an event or request names none
+DEVICE_ID = os.getenv("DEVICE_ID", "handbag_001")
+
+CONNECT_TIMEOUT_S = float(os.getenv("FIREBASE_CONNECT_TIMEOUT_S", "3"))
+READ_TIMEOUT_S = float(os.getenv("FIREBASE_READ_TIMEOUT_S", "6"))
+POOL_SIZE = int(os.getenv("FIREBASE_POOL_SIZE", "16"))
+COALESCE_MS = float(os.getenv("FIREBASE_COALESCE_MS", "20"))
+
+TIMEOUT = (CONNECT_TIMEOUT_S, READ_TIMEOUT_S)
+# Longest a caller should wait on a queued PATCH
+WRITE_WAIT_S = CONNECT_TIMEOUT_S + READ_TIMEOUT_S + COALESCE_MS / 1000.0
+
+def new_session():
+    s = requests.Session()
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    return s
+
+session = new_session()
+
+def url_for(path):
+    return f"{FIREBASE_URL}/{path.strip('/')}.json"
+
+# --- 1. PLAIN REQUESTS ---
+def request(method, url, op, **kwargs):
+    """session.request, timed into firebase_request_seconds{op}."""
+    with metrics.span("firebase_request_seconds", op=op):
+        r = session.request(method, url, **kwargs)
+    if r.status_code >= 400:
+        metrics.inc("firebase_request_errors", op=op)
+    return r
 
-def fetch_latest_device(device_id="handbag_001"):
-    url = f"{FIREBASE_URL}/latest_events/{device_id}.json"
-    r = requests.get(url, timeout=10)
+def get(path, params=None, timeout=TIMEOUT):
+    r = request("GET", url_for(path), "get", params=params, timeout=timeout)
+    r.raise_for_status()
     return r.json()
 
-def fetch_events():
-    url = f"{FIREBASE_URL}/events.json"
-    r = requests.get(url, timeout=10)
+def put(path, data, timeout=TIMEOUT):
+    r = request("PUT", url_for(path), "put", json=data, timeout=timeout)
+    r.raise_for_status()
     return r.json()
+
+def patch(path, data, timeout=TIMEOUT):
+    r = request("PATCH", url_for(path), "patch", json=data, timeout=timeout)
+    r.raise_for_status()
+    return r.json()
+
+def post(path, data, timeout=TIMEOUT):
+    r = request("POST", url_for(path), "post", json=data, timeout=timeout)
+    r.raise_for_status()
+    return r.json()
+
+# --- 2. CONDITIONAL GETS ---
+_etag_cache = {}   # path -> (etag, value)
+_etag_lock = threading.Lock()
+
+def get_cached(path, timeout=TIMEOUT):
+    """GET with the node's ETag; reuse the previous value when unchanged."""
+    with _etag_lock:
+        cached = _etag_cache.get(path)
+    headers = {"X-Firebase-ETag": "true"}
+    if cached:
+        headers["If-None-Match"] = cached[0]
+
+    r = request("GET", url_for(path), "get_cached", headers=headers, timeout=timeout)
+    if r.status_code == 304 and cached:
+        metrics.inc("firebase_not_modified")
+        return cached[1]
+    r.raise_for_status()
+
+    etag = r.headers.get("ETag")
+    if cached and etag == cached[0]:
+        return cached[1]
+    value = r.json()
+    if etag:
+        with _etag_lock:
+            _etag_cache[path] = (etag, value)
+    return value
+
+# --- 3. COALESCED PATCHES ---
+_pending = {}          # "path/child" -> value
+_waiters = []          # futures resolved by the next flush
+_pending_lock = threading.Lock()
+# Batches go out one at a time in the order they were taken: each gets a
+# sequence number under _pending_lock and waits for its turn outside it,
+# so callers only queueing a PATCH never wait on a request in flight
+_send_turn = threading.Condition()
+_next_seq = 0      # number for the next batch taken
+_turn = 0          # number of the batch allowed to send
+_flush_timer = None
+
+def _overlaps(a, b):
+    return a.startswith(b + "/") or b.startswith(a + "/")
+
+def queue_patch(path, data):
+    """
+    PATCH `data` under `path`, merged with any other PATCHes issued in
+    the next FIREBASE_COALESCE_MS into one multi-path update. Returns a
+    Future that resolves once the update has been written.
+    """
+    global _flush_timer
+    future = Future()
+    updates = {f"{path.strip('/')}/{key}": value for key, value in data.items()}
+
+    batch = None
+    with _pending_lock:
+        # Multi-path updates may not nest; send what is pending first
+        if any(_overlaps(key, pending) for key in updates for pending in _pending):
+            batch = _take_batch()
+        _pending.update(updates)
+        _waiters.append(future)
+        if _flush_timer is None:
+            _flush_timer = threading.Timer(COALESCE_MS / 1000.0, flush)
+            _flush_timer.daemon = True
+            _flush_timer.start()
+    if batch:
+        _send_batch(*batch)
+    return future
+
+def flush():
+    with _pending_lock:
+        batch = _take_batch()
+    if batch:
+        _send_batch(*batch)
+
+def _take_batch():
+    # Caller holds _pending_lock; the sequence number fixes the batch's place in line
+    global _flush_timer, _pending, _waiters, _next_seq
+    if _flush_timer is not None and _flush_timer is not threading.current_thread():
+        _flush_timer.cancel()
+    _flush_timer = None
+    if not _pending:
+        return None
+    batch = (_next_seq, _pending, _waiters)
+    _pending, _waiters = {}, []
+    _next_seq += 1
+    return batch
+
+def _send_batch(seq, updates, waiters):
+    global _turn
+    with _send_turn:
+        _send_turn.wait_for(lambda: _turn == seq)
+    try:
+        r = request("PATCH", f"{FIREBASE_URL}/.json", "patch_batch", data=json.dumps(updates), timeout=TIMEOUT)
+        r.raise_for_status()
+        for future in waiters:
+            future.set_result(updates)
+    except Exception as e:
+        for future in waiters:
+            future.set_exception(e)
+    finally:
+        with _send_turn:
+            _turn += 1
+            _send_turn.notify_all()
+
+# --- 4. DEVICE HELPERS ---
+def fetch_latest_device(device_id=DEVICE_ID):
+    return get_cached(f"latest_events/{device_id}")
+
+def fetch_latest_devices():
+    """latest_events for the whole fleet, {device_id: node}, in one request."""
+    return get_cached("latest_events")
+
+def fetch_events(start_at=None, limit_first=None, limit_last=None):
+    """/events ordered by key; with no arguments, the whole tree."""
+    params = {}
+    if start_at is not None:
+        params["startAt"] = json.dumps(start_at)
+    if limit_first:
+        params["limitToFirst"] = limit_first
+    if limit_last:
+        params["limitToLast"] = limit_last
+    if params:
+        params["orderBy"] = json.dumps("$key")
+    return get("events", params=params or None)
+
+# --- 5. FORK SAFETY ---
+def _after_fork():
+    # A forked worker must not share the parent's sockets or inherit held locks
+    global session, _etag_lock, _pending, _waiters, _pending_lock, _send_turn, _next_seq, _turn, _flush_timer
+    session = new_session()
+    _etag_lock = threading.Lock()
+    _pending, _waiters = {}, []
+    _pending_lock = threading.Lock()
+    _send_turn = threading.Condition()
+    _next_seq = _turn = 0
+    _flush_timer = None
+
+os.register_at_fork(after_in_child=_after_fork)
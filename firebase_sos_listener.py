@@ -1,41 +1,130 @@
-import requests
-import time
 import os
-from dotenv import load_dotenv
-from sms_alert import send_sms_alert
+import time
+import sqlite3
+import firebase
+import alert_outbox
+import event_store
 
-load_dotenv()
+CHECK_INTERVAL = float(os.getenv("LISTENER_INTERVAL_S", "4"))  # seconds
+ALERT_EVENTS = ["USER_SOS", "AUTO_UNUSUAL_ACTIVITY"]
 
-FIREBASE_URL = os.getenv("FIREBASE_URL")
+# Events are read in key order after a persisted cursor, BATCH_SIZE at a time
+BATCH_SIZE = int(os.getenv("LISTENER_BATCH_SIZE", "200"))
+# On the very first run (no checkpoint) only the newest BACKFILL events are replayed
+BACKFILL = int(os.getenv("LISTENER_BACKFILL", "50"))
+STATE_DB = os.getenv("LISTENER_STATE_DB", "data/listener_state.db")
+DEDUP_MAX_KEYS = int(os.getenv("LISTENER_DEDUP_MAX_KEYS", "100000"))
 
-CHECK_INTERVAL = 4  # seconds
-PROCESSED = set()
+class ListenerState:
+    """
+    Checkpoint (last ingested event key) and a bounded set of alerted
+    event keys, kept in SQLite so a restart neither re-alerts nor
+    re-downloads history.
+    """
+    def __init__(self, path=STATE_DB, max_keys=DEDUP_MAX_KEYS):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.max_keys = max_keys
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS checkpoint (name TEXT PRIMARY KEY, value TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS processed (key TEXT PRIMARY KEY, processed_at REAL)")
 
-def listen_sos():
-    print("🔥 Firebase SOS Listener started...")
-    while True:
+    def cursor(self):
+        row = self.db.execute("SELECT value FROM checkpoint WHERE name = 'events'").fetchone()
+        return row[0] if row else None
+
+    def seen(self, keys):
+        if not keys:
+            return set()
+        marks = ",".join("?" * len(keys))
+        return {row[0] for row in self.db.execute(f"SELECT key FROM processed WHERE key IN ({marks})", keys)}
+
+    def commit(self, alerted, cursor):
+        """Record a batch in one transaction: its alerted keys and the new cursor."""
+        now = time.time()
+        self.db.execute("BEGIN")
         try:
-            r = requests.get(f"{FIREBASE_URL}/events.json", timeout=10)
-            data = r.json() if r.ok else {}
+            self.db.executemany("INSERT OR IGNORE INTO processed (key, processed_at) VALUES (?, ?)",
+                                [(key, now) for key in alerted])
+            self.db.execute("INSERT OR REPLACE INTO checkpoint (name, value) VALUES ('events', ?)", (cursor,))
+            # Keep only the newest max_keys (rowids grow with insertion order)
+            self.db.execute("DELETE FROM processed WHERE rowid <= (SELECT MAX(rowid) FROM processed) - ?",
+                            (self.max_keys,))
+            self.db.execute("COMMIT")
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+
+def process_batch(state, events, cursor=None, history=None):
+    """
+    Alert on the new SOS events in one fetched batch and append every
+    event to the local history (an EventStore). Returns the alert count.
+    """
+    keys = sorted(events)
+    seen = state.seen(keys)
+    alerted = []
+    for key in keys:
+        # startAt is inclusive, so the cursor event comes back every time
+        if key == cursor or key in seen:
+            continue
+        ev = events[key]
+        if not isinstance(ev, dict):
+            continue
+
+        event_type = ev.get("event_type")
+        if event_type not in ALERT_EVENTS:
+            continue
 
-            for key, ev in (data or {}).items():
-                if key in PROCESSED:
-                    continue
-                if not isinstance(ev, dict):
-                    continue
+        lat = ev.get("latitude")
+        lon = ev.get("longitude")
 
-                event_type = ev.get("event_type")
-                if event_type not in ["USER_SOS", "AUTO_UNUSUAL_ACTIVITY"]:
-                    continue
+        if lat and lon:
+            print(f"🚨 SOS detected → sending SMS: {lat},{lon}")
+            # The event key doubles as the idempotency key, so a replayed batch is not re-sent
+            alert_outbox.enqueue_alert(ev.get("device_id", firebase.DEVICE_ID), lat, lon, event_type,
+                                       idem_key=f"event:{key}")
+            alerted.append(key)
 
-                lat = ev.get("latitude")
-                lon = ev.get("longitude")
+    if history is not None:
+        try:
+            # The store skips keys it already has, so a replayed batch is not stored twice
+            history.append(events)
+        except Exception as e:
+            print(f"⚠️ Event history append failed: {e}")
+
+    # A crash before this commit replays the batch; the outbox drops the duplicates
+    state.commit(alerted, keys[-1] if keys else cursor)
+    return len(alerted)
+
+def ingest(state, history=None):
+    """Read every event after the checkpoint. Cost scales with new events, not history."""
+    read = 0
+    while True:
+        cursor = state.cursor()
+        if cursor is None:
+            events = firebase.fetch_events(limit_last=max(BACKFILL, 1)) or {}
+            if not BACKFILL:
+                # Start after the newest event without alerting on it
+                state.commit([], max(events) if events else None)
+                return read
+        else:
+            events = firebase.fetch_events(start_at=cursor, limit_first=BATCH_SIZE + 1) or {}
 
-                if lat and lon:
-                    print(f"🚨 SOS detected → sending SMS: {lat},{lon}")
-                    send_sms_alert(lat, lon, event_type)
-                    PROCESSED.add(key)
+        process_batch(state, events, cursor, history)
+        read += len(events)
+        if cursor is None or len(events) <= BATCH_SIZE:
+            return read
 
+def listen_sos():
+    print("🔥 Firebase SOS Listener started...")
+    state = ListenerState()
+    alert_outbox.resume()
+    history = event_store.EventStore(event_store.STORE_DIR, writable=True)
+    print(f"✅ Resuming after event {state.cursor()} ({history.stats()['events']} events in history)")
+    while True:
+        try:
+            ingest(state, history)
         except Exception as e:
             print("Listener error:", e)
 
@@ -0,0 +1,28 @@
+"""
+Great-circle helpers shared by the spatial indexes.
+
+Points are indexed as unit vectors on the sphere: the straight-line
+(chord) distance between two unit vectors grows monotonically with the
+great-circle distance, so a plain cKDTree over them returns exactly the
+haversine nearest neighbours.
+"""
+import numpy as np
+
+EARTH_RADIUS_M = 6371009.0
+
+def to_unit_xyz(lats, lons):
+    lat = np.radians(np.asarray(lats, dtype=float))
+    lon = np.radians(np.asarray(lons, dtype=float))
+    cos_lat = np.cos(lat)
+    return np.column_stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)])
+
+def chord_to_m(chord):
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.minimum(np.asarray(chord) / 2, 1.0))
+
+def m_to_chord(metres):
+    return 2 * np.sin(np.minimum(np.asarray(metres) / (2 * EARTH_RADIUS_M), np.pi / 2))
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
@@ -0,0 +1,239 @@
+"""
+Geofence risk monitor: escalates when a device enters, or stays in, a
+Critical-risk cell at night.
+
+    python geofence.py                           follow latest_events for every device
+    python geofence.py --record trace.jsonl      ... and append each fix it sees to a trace
+    python geofence.py --replay trace.jsonl      run a recorded trace, print the escalations
+
+Fixes are snapped to GEOFENCE_CELL_DEG cells and each (cell, weekday,
+hour) is scored once with ml_engine.predict_many, in one call for all
+the cells a batch needs; a device that stays in a known cell costs a
+dict lookup. Hysteresis: a device is inside after ENTER_FIXES
+consecutive Critical fixes and outside again after EXIT_FIXES
+non-Critical ones, so it does not flap on a cell edge. While inside at
+night it is escalated through the outbox exactly like /escalate, and
+again every LINGER_S it stays. Run it as a single process, like
+firebase_sos_listener.py; escalations carry idempotency keys, so a
+restart that replays fixes does not alert twice.
+"""
+import os
+import json
+import time
+import datetime
+import argparse
+import numpy as np
+
+import ml_engine
+import alert_outbox
+
+CELL_DEG = float(os.getenv("GEOFENCE_CELL_DEG", "0.002"))   # ~220 m, the risk grid's step
+ENTER_FIXES = int(os.getenv("GEOFENCE_ENTER_FIXES", "2"))
+EXIT_FIXES = int(os.getenv("GEOFENCE_EXIT_FIXES", "3"))
+LINGER_S = float(os.getenv("GEOFENCE_LINGER_S", "300"))
+NIGHT_START = int(os.getenv("GEOFENCE_NIGHT_START", "20"))
+NIGHT_END = int(os.getenv("GEOFENCE_NIGHT_END", "6"))
+TICK_S = float(os.getenv("GEOFENCE_TICK_S", "1"))
+CACHE_MAX_CELLS = int(os.getenv("GEOFENCE_CACHE_MAX_CELLS", "200000"))
+ESCALATE_LEVEL = "Critical"
+EVENT_TYPE = "AUTO_GEOFENCE_CRITICAL"
+REFERENCE_MONDAY = datetime.datetime(2024, 1, 1)
+
+def is_night(hour):
+    return hour >= NIGHT_START or hour < NIGHT_END
+
+def local_time_buckets(timestamps_ms):
+    """(weekday, hour) arrays in server local time, Monday = 0, like ml_engine's datetime.now()."""
+    local_s = np.asarray(timestamps_ms, dtype=np.int64) // 1000 + time.localtime().tm_gmtoff
+    # 1970-01-01 was a Thursday
+    return (local_s // 86400 + 3) % 7, (local_s // 3600) % 24
+
+def enqueue_escalation(alert):
+    """The /escalate path: journal the alert in the outbox, ack the device once sent."""
+    alert_outbox.enqueue_alert(alert["device_id"], alert["latitude"], alert["longitude"], EVENT_TYPE,
+                               ack={"acknowledged": True}, idem_key=alert["idem_key"])
+
+class DeviceTrack:
+    __slots__ = ("cell", "level", "streak", "inside", "last_ts", "escalated_ts")
+
+    def __init__(self):
+        self.cell = None
+        self.level = None
+        self.streak = 0          # consecutive fixes disagreeing with `inside`
+        self.inside = False
+        self.last_ts = -1
+        self.escalated_ts = None
+
+class GeofenceMonitor:
+    def __init__(self, escalate=enqueue_escalation, score=None, cell_deg=CELL_DEG):
+        self.escalate = escalate
+        self.score = score or ml_engine.predict_many
+        self.cell_deg = cell_deg
+        self.tracks = {}       # device id -> DeviceTrack
+        self.cache = {}        # (row, col, weekday, hour) -> risk label
+        self.counters = {"fixes": 0, "stale": 0, "cached": 0, "scored": 0, "entered": 0, "left": 0,
+                         "escalations": 0}
+
+    def _score_missing(self, keys):
+        """
+        Score every uncached cell key, one predict_many call per (weekday,
+        hour). Returns key -> label; a full cache is cleared first, so the
+        caller must not count on keys it looked up earlier still being there.
+        """
+        if len(self.cache) + len(keys) > CACHE_MAX_CELLS:
+            self.cache.clear()
+        scored = {}
+        by_bucket = {}
+        for key in keys:
+            by_bucket.setdefault(key[2:], []).append(key)
+        for (weekday, hour), cells in by_bucket.items():
+            rows = np.array([c[0] for c in cells], dtype=float)
+            cols = np.array([c[1] for c in cells], dtype=float)
+            when = REFERENCE_MONDAY + datetime.timedelta(days=int(weekday), hours=int(hour))
+            results = self.score((rows + 0.5) * self.cell_deg, (cols + 0.5) * self.cell_deg, when=when)
+            for key, (label, _, _) in zip(cells, results):
+                scored[key] = label
+        self.cache.update(scored)
+        self.counters["scored"] += len(keys)
+        return scored
+
+    def process(self, device_ids, lats, lons, timestamps_ms):
+        """Feed one batch of fixes (at most one per device is typical). Returns the escalations sent."""
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        timestamps_ms = np.asarray(timestamps_ms, dtype=np.int64)
+        rows = np.floor(lats / self.cell_deg).astype(np.int64).tolist()
+        cols = np.floor(lons / self.cell_deg).astype(np.int64).tolist()
+        weekdays, hours = (a.tolist() for a in local_time_buckets(timestamps_ms))
+        keys = list(zip(rows, cols, weekdays, hours))
+        self.counters["fixes"] += len(keys)
+
+        # The batch's own labels: scoring may clear the cache under cells looked up here
+        levels = {key: self.cache[key] for key in set(keys) if key in self.cache}
+        missing = {key for key in keys if key not in levels}
+        if missing:
+            levels.update(self._score_missing(missing))
+        self.counters["cached"] += len(keys) - len(missing)
+
+        alerts = []
+        for device_id, key, lat, lon, ts in zip(device_ids, keys, lats.tolist(), lons.tolist(),
+                                                timestamps_ms.tolist()):
+            track = self.tracks.get(device_id)
+            if track is None:
+                track = self.tracks[device_id] = DeviceTrack()
+            if ts <= track.last_ts:
+                # Same fix again (e.g. only the ack flag changed) or out of order
+                self.counters["stale"] += 1
+                continue
+            track.last_ts = ts
+            track.cell = key
+            track.level = levels[key]
+
+            # Hysteresis: only a run of agreeing fixes flips inside/outside
+            critical = track.level == ESCALATE_LEVEL
+            if critical == track.inside:
+                track.streak = 0
+            else:
+                track.streak += 1
+                if track.streak >= (ENTER_FIXES if critical else EXIT_FIXES):
+                    track.inside, track.streak = critical, 0
+                    track.escalated_ts = None
+                    self.counters["entered" if critical else "left"] += 1
+
+            if track.inside and is_night(key[3]) and (
+                    track.escalated_ts is None or ts - track.escalated_ts >= LINGER_S * 1000):
+                alert = {"device_id": device_id, "latitude": lat, "longitude": lon, "timestamp_ms": ts,
+                         "level": track.level, "idem_key": f"geofence:{device_id}:{ts}"}
+                try:
+                    self.escalate(alert)
+                except Exception as e:
+                    # escalated_ts stays as it was, so the next fix tries again
+                    print(f"⚠️ Geofence escalation for {device_id} failed: {e}")
+                    continue
+                track.escalated_ts = ts
+                self.counters["escalations"] += 1
+                alerts.append(alert)
+        return alerts
+
+    def stats(self):
+        return dict(self.counters, devices=len(self.tracks), cached_cells=len(self.cache),
+                    inside=sum(1 for t in self.tracks.values() if t.inside))
+
+# --- TRACES ---
+def read_trace(path):
+    """JSON lines of {device_id, latitude, longitude, timestamp_ms}, in time order."""
+    with open(path) as f:
+        fixes = [json.loads(line) for line in f if line.strip()]
+    fixes.sort(key=lambda fix: fix["timestamp_ms"])
+    return fixes
+
+def replay(fixes, monitor, tick_s=TICK_S):
+    """
+    Run fixes through the monitor in tick_s windows of trace time,
+    keeping each device's latest fix per window as the live store does.
+    Returns the escalations.
+    """
+    alerts, window, window_end = [], {}, None
+
+    def flush():
+        if window:
+            batch = list(window.values())
+            alerts.extend(monitor.process([f["device_id"] for f in batch], [f["latitude"] for f in batch],
+                                          [f["longitude"] for f in batch], [f["timestamp_ms"] for f in batch]))
+            window.clear()
+
+    for fix in fixes:
+        if window_end is None or fix["timestamp_ms"] >= window_end:
+            flush()
+            window_end = fix["timestamp_ms"] + tick_s * 1000
+        window[fix["device_id"]] = fix
+    flush()
+    return alerts
+
+# --- LIVE ---
+def follow(monitor, record=None, tick_s=TICK_S):
+    import device_store
+
+    fleet = device_store.get_fleet()
+    alert_outbox.resume()
+    print(f"🔥 Geofence monitor started ({len(fleet.store)} devices)")
+    trace = open(record, "a") if record else None
+    last_report = time.monotonic()
+    while True:
+        try:
+            device_ids, lats, lons, timestamps_ms = fleet.store.changes()
+            if device_ids:
+                if trace:
+                    for fix in zip(device_ids, lats.tolist(), lons.tolist(), timestamps_ms.tolist()):
+                        trace.write(json.dumps(dict(zip(("device_id", "latitude", "longitude", "timestamp_ms"),
+                                                        fix))) + "\n")
+                    trace.flush()
+                for alert in monitor.process(device_ids, lats, lons, timestamps_ms):
+                    print(f"🚨 {alert['device_id']} in {alert['level']} cell at night → escalated")
+        except Exception as e:
+            print("Geofence error:", e)
+        if time.monotonic() - last_report >= 60:
+            print(f"⏱ Geofence: {monitor.stats()}")
+            last_report = time.monotonic()
+        time.sleep(tick_s)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--replay", help="recorded trace (JSON lines) to run instead of following Firebase")
+    parser.add_argument("--record", help="append every live fix to this trace")
+    parser.add_argument("--send", action="store_true", help="with --replay, really enqueue the escalations")
+    parser.add_argument("--tick", type=float, default=TICK_S, help="batch window in seconds")
+    args = parser.parse_args()
+
+    if args.replay:
+        monitor = GeofenceMonitor(escalate=enqueue_escalation if args.send else (lambda alert: None))
+        fixes = read_trace(args.replay)
+        t0 = time.perf_counter()
+        alerts = replay(fixes, monitor, args.tick)
+        elapsed = time.perf_counter() - t0
+        for alert in alerts:
+            print(json.dumps(alert))
+        print(f"⏱ {len(fixes)} fixes in {elapsed:.2f} s ({len(fixes) / max(elapsed, 1e-9):.0f} fixes/s): "
+              f"{monitor.stats()}")
+    else:
+        follow(GeofenceMonitor(), args.record, args.tick)
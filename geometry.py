@@ -0,0 +1,88 @@
+"""
+Compact route geometry: Douglas-Peucker simplification and Google
+encoded polylines for the /route payload.
+"""
+import numpy as np
+
+from geo import EARTH_RADIUS_M
+
+def zoom_tolerance_m(zoom, lat=21.15):
+    """Ground size of one map pixel (256 px tiles) at a zoom level."""
+    return 2 * np.pi * EARTH_RADIUS_M * np.cos(np.radians(lat)) / (256 * 2 ** float(zoom))
+
+def simplify(coords, tolerance_m):
+    """
+    Douglas-Peucker on [[lat, lon], ...]: keep only the vertices that
+    move the line by more than tolerance_m. End points are always kept.
+    """
+    pts = np.asarray(coords, dtype=float)
+    if len(pts) < 3 or tolerance_m <= 0:
+        return pts.tolist()
+
+    # Local equirectangular projection in metres
+    lat0 = np.radians(pts[:, 0].mean())
+    xy = np.column_stack([
+        np.radians(pts[:, 1]) * np.cos(lat0) * EARTH_RADIUS_M,
+        np.radians(pts[:, 0]) * EARTH_RADIUS_M,
+    ])
+
+    keep = np.zeros(len(pts), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(pts) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        a, b = xy[start], xy[end]
+        seg = b - a
+        seg_len2 = seg @ seg
+        inner = xy[start + 1:end] - a
+        if seg_len2 == 0:
+            dist = np.hypot(inner[:, 0], inner[:, 1])
+        else:
+            t = np.clip(inner @ seg / seg_len2, 0, 1)
+            dist = np.hypot(*(inner - np.outer(t, seg)).T)
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance_m:
+            mid = start + 1 + i
+            keep[mid] = True
+            stack.append((start, mid))
+            stack.append((mid, end))
+    return pts[keep].tolist()
+
+def encode_polyline(coords, precision=5):
+    """Google encoded polyline of [[lat, lon], ...]."""
+    if len(coords) == 0:
+        return ""
+    scaled = np.floor(np.asarray(coords, dtype=float) * 10 ** precision + 0.5).astype(np.int64)
+    deltas = np.diff(scaled, axis=0, prepend=[[0, 0]]).ravel()
+    values = np.where(deltas < 0, ~(deltas << 1), deltas << 1).tolist()
+
+    out = []
+    for value in values:
+        while value >= 0x20:
+            out.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        out.append(chr(value + 63))
+    return "".join(out)
+
+def decode_polyline(encoded, precision=5):
+    coords, index, lat, lon = [], 0, 0, 0
+    factor = 10 ** precision
+    while index < len(encoded):
+        for axis in (0, 1):
+            shift = result = 0
+            while True:
+                b = ord(encoded[index]) - 63
+                index += 1
+                result |= (b & 0x1f) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            delta = ~(result >> 1) if result & 1 else result >> 1
+            if axis == 0:
+                lat += delta
+            else:
+                lon += delta
+        coords.append([lat / factor, lon / factor])
+    return coords
@@ -0,0 +1,167 @@
+"""
+Binary snapshot of the road graph.
+
+`python graph_snapshot.py` converts data/nagpur_graph.graphml once into a
+directory of .npy arrays:
+
+    node_ids, node_lat, node_lon        one entry per node
+    indptr, indices                     CSR adjacency (row = from-node)
+    safety_weight, length               float32, one entry per CSR edge
+    geom_offsets, geom_coords           flat [lat, lon] buffer per edge
+
+load_snapshot() maps them with np.load(mmap_mode="r"), so gunicorn
+workers share the same pages and start in milliseconds.
+"""
+import os
+import json
+import time
+import datetime
+import numpy as np
+
+GRAPH_FILE = "data/nagpur_graph.graphml"
+SNAPSHOT_DIR = "data/nagpur_graph_snapshot"
+
+ARRAYS = [
+    "node_ids", "node_lat", "node_lon",
+    "indptr", "indices", "safety_weight", "length",
+    "geom_offsets", "geom_coords",
+]
+# Written only when every edge in the GraphML carries the attribute
+OPTIONAL_ARRAYS = ["travel_time"]
+
+# --- 1. CONVERTER ---
+def build_snapshot(graph_file=GRAPH_FILE, out_dir=SNAPSHOT_DIR):
+    import osmnx as ox
+
+    t0 = time.time()
+    Gp = ox.load_graphml(graph_file, edge_dtypes={"safety_weight": float})
+    G_latlon = ox.project_graph(Gp, to_crs="EPSG:4326")
+    print(f"GraphML loaded in {time.time() - t0:.1f}s")
+
+    node_ids = np.array(list(G_latlon.nodes), dtype=np.int64)
+    position = {node: i for i, node in enumerate(node_ids.tolist())}
+    node_lat = np.array([G_latlon.nodes[n]["y"] for n in node_ids.tolist()])
+    node_lon = np.array([G_latlon.nodes[n]["x"] for n in node_ids.tolist()])
+
+    # Keep the cheapest of any parallel edges, like shortest_path does
+    best = {}
+    for u, v, key, data in Gp.edges(keys=True, data=True):
+        weight = float(data.get("safety_weight", data.get("length", 1.0)))
+        pair = (position[u], position[v])
+        if pair not in best or weight < best[pair][0]:
+            best[pair] = (weight, float(data.get("length", 0.0)), u, v, key)
+
+    pairs = sorted(best)
+    n_edges = len(pairs)
+    src = np.array([p[0] for p in pairs], dtype=np.int64)
+    indptr = np.zeros(len(node_ids) + 1, dtype=np.int64)
+    np.add.at(indptr, src + 1, 1)
+    indptr = np.cumsum(indptr)
+    indices = np.array([p[1] for p in pairs], dtype=np.int32)
+    safety_weight = np.array([best[p][0] for p in pairs], dtype=np.float32)
+    length = np.array([best[p][1] for p in pairs], dtype=np.float32)
+    optional = {}
+    for name in OPTIONAL_ARRAYS:
+        values = [Gp.edges[best[p][2], best[p][3], best[p][4]].get(name) for p in pairs]
+        if values and all(v is not None for v in values):
+            optional[name] = np.array(values, dtype=np.float32)
+
+    # Per-edge coordinates exactly as get_safe_route emits them: the curve
+    # when the edge has one, otherwise just the start node
+    geom_offsets = np.zeros(n_edges + 1, dtype=np.int64)
+    chunks = []
+    for e, pair in enumerate(pairs):
+        weight, _, u, v, key = best[pair]
+        data = G_latlon.get_edge_data(u, v)[key]
+        if "geometry" in data:
+            chunk = [(lat, lon) for lon, lat in data["geometry"].coords]
+        else:
+            chunk = [(node_lat[pair[0]], node_lon[pair[0]])]
+        chunks.append(chunk)
+        geom_offsets[e + 1] = geom_offsets[e] + len(chunk)
+    geom_coords = np.array([c for chunk in chunks for c in chunk], dtype=np.float64).reshape(-1, 2)
+
+    os.makedirs(out_dir, exist_ok=True)
+    arrays = {
+        "node_ids": node_ids, "node_lat": node_lat, "node_lon": node_lon,
+        "indptr": indptr, "indices": indices,
+        "safety_weight": safety_weight, "length": length,
+        "geom_offsets": geom_offsets, "geom_coords": geom_coords,
+        **optional,
+    }
+    for name, arr in arrays.items():
+        np.save(os.path.join(out_dir, f"{name}.npy"), arr)
+
+    meta = {
+        "source": graph_file,
+        "source_mtime": os.path.getmtime(graph_file),
+        "nodes": len(node_ids),
+        "edges": n_edges,
+        "built_at": datetime.datetime.now().isoformat(timespec="seconds"),
+    }
+    with open(os.path.join(out_dir, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    print(f"✅ Snapshot written to {out_dir}: {meta['nodes']} nodes, {meta['edges']} edges "
+          f"in {time.time() - t0:.1f}s")
+    return meta
+
+# --- 2. LOADER ---
+def load_snapshot(snapshot_dir=SNAPSHOT_DIR):
+    """Map every array read-only and build the CSR matrix used for search."""
+    snap = {name: np.load(os.path.join(snapshot_dir, f"{name}.npy"), mmap_mode="r") for name in ARRAYS}
+    with open(os.path.join(snapshot_dir, "meta.json")) as f:
+        snap["meta"] = json.load(f)
+
+    for name in OPTIONAL_ARRAYS:
+        path = os.path.join(snapshot_dir, f"{name}.npy")
+        if os.path.exists(path):
+            snap[name] = np.load(path, mmap_mode="r")
+
+    snap["csr"] = {"safety_weight": weight_matrix(snap, snap["safety_weight"])}
+    snap["node_index"] = {int(node): i for i, node in enumerate(snap["node_ids"])}
+    return snap
+
+# --- 3. QUERIES ---
+def weight_matrix(snap, weights):
+    from scipy.sparse import csr_matrix
+
+    n = len(snap["node_ids"])
+    return csr_matrix((weights, snap["indices"], snap["indptr"]), shape=(n, n))
+
+def shortest_path(snap, orig, dest, weight="safety_weight"):
+    """Node indices of the lowest-weight path, or None if unreachable."""
+    from scipy.sparse.csgraph import dijkstra
+
+    if weight not in snap["csr"]:
+        # e.g. "travel_time" on a snapshot built without it: fall back to length
+        source = weight if weight in snap else "length"
+        snap["csr"][weight] = weight_matrix(snap, snap[source])
+
+    dist, pred = dijkstra(snap["csr"][weight], indices=orig, return_predecessors=True)
+    if not np.isfinite(dist[dest]):
+        return None
+    path = [dest]
+    while path[-1] != orig:
+        path.append(int(pred[path[-1]]))
+    return path[::-1]
+
+def edge_ids(snap, path):
+    """CSR edge index for each consecutive (u, v) in a node path."""
+    indptr, indices = snap["indptr"], snap["indices"]
+    ids = []
+    for u, v in zip(path[:-1], path[1:]):
+        start, end = indptr[u], indptr[u + 1]
+        ids.append(start + int(np.searchsorted(indices[start:end], v)))
+    return ids
+
+def path_coords(snap, path):
+    """[[lat, lon], ...] for a node path, walking the per-edge buffers."""
+    offsets, coords = snap["geom_offsets"], snap["geom_coords"]
+    parts = [coords[offsets[e]:offsets[e + 1]] for e in edge_ids(snap, path)]
+    last = path[-1]
+    parts.append(np.array([[snap["node_lat"][last], snap["node_lon"][last]]]))
+    return np.concatenate(parts).tolist()
+
+if __name__ == "__main__":
+    build_snapshot()
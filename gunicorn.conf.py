@@ -0,0 +1,40 @@
+"""
+Gunicorn settings (`gunicorn -c gunicorn.conf.py app:app`, see Procfile).
+
+GUNICORN_PRELOAD=1  import the app and warm it up in the master, then fork;
+                    workers share the models and graph copy-on-write
+WARM_UP=1           without preload, warm up each worker before it takes traffic
+STARTUP_MODE=lazy   defer heavy imports to first use (see startup.py)
+"""
+import os
+import gc
+import time
+
+import startup
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", "256"))
+# Loading the graph can take a while on a cold worker
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+preload_app = os.getenv("GUNICORN_PRELOAD", "0") == "1"
+
+started_at = time.time()
+
+def when_ready(server):
+    if preload_app:
+        startup.warm_up()
+        # Move everything loaded so far out of the GC's reach, so collections
+        # in the workers do not touch (and copy) the shared pages
+        gc.freeze()
+    startup.report("Master ready", since=started_at)
+
+def post_worker_init(worker):
+    # Each worker drains the alert outbox; start it now rather than on the first alert,
+    # so alerts journaled before a crash or redeploy are sent at once
+    import alert_outbox
+    alert_outbox.resume()
+    if startup.WARM_UP and not preload_app:
+        startup.warm_up()
+    startup.report(f"Worker {worker.age} ready", since=started_at)
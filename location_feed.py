@@ -0,0 +1,229 @@
+"""
+Live device location, shared by every viewer.
+
+One background subscriber per device holds a Firebase REST stream
+(Accept: text/event-stream) on latest_events/<device> and keeps the
+latest value in memory. /location answers from it while it is fresh
+(the stream is connected, or the last sync is within
+LOCATION_MAX_STALENESS_S) and otherwise refreshes it with one
+conditional GET, shared by all concurrent callers. /location/stream
+fans each update out to any number of SSE clients from a single
+pre-encoded message, so upstream traffic does not grow with viewers.
+
+Each SSE viewer holds one gthread worker thread for as long as it is
+connected, so viewers are capped at LOCATION_MAX_VIEWERS per worker
+(viewer_slots) and past that /location/stream answers 503 with
+Retry-After; the threads left over keep /sos and /escalate responsive.
+More viewers take more workers (WEB_CONCURRENCY), not more threads.
+"""
+import os
+import copy
+import json
+import time
+import threading
+
+import firebase
+
+MAX_STALENESS_S = float(os.getenv("LOCATION_MAX_STALENESS_S", "2"))
+SSE_KEEPALIVE_S = float(os.getenv("LOCATION_SSE_KEEPALIVE_S", "15"))
+# Firebase sends a keep-alive every 30 s; a silent stream is dead after this
+STREAM_READ_TIMEOUT_S = float(os.getenv("FIREBASE_STREAM_READ_TIMEOUT_S", "45"))
+MAX_BACKOFF_S = 30
+# Keep well under gunicorn's WEB_THREADS: every viewer pins a thread
+MAX_VIEWERS = int(os.getenv("LOCATION_MAX_VIEWERS", "64"))
+viewer_slots = threading.BoundedSemaphore(MAX_VIEWERS)
+
+def location_payload(data):
+    """The /location response body for a latest_events node."""
+    if not data:
+        return {
+            "latitude": 0.0,
+            "longitude": 0.0,
+            "event_type": "WAITING_FOR_DATA",
+            "acknowledged": True,
+            "timestamp": 0
+        }
+    return {
+        "latitude": data.get("latitude"),
+        "longitude": data.get("longitude"),
+        "event_type": data.get("event_type", "NORMAL"),
+        "acknowledged": data.get("acknowledged", False),
+        "timestamp": data.get("timestamp_ms")
+    }
+
+def _set_path(root, parts, value):
+    # Copy-on-write so readers holding the old value never see it change
+    if not parts:
+        return value
+    root = copy.deepcopy(root) if isinstance(root, dict) else {}
+    node = root
+    for part in parts[:-1]:
+        if not isinstance(node.get(part), dict):
+            node[part] = {}
+        node = node[part]
+    if value is None:
+        node.pop(parts[-1], None)
+    else:
+        node[parts[-1]] = value
+    return root
+
+def sse_events(response):
+    """Parse a text/event-stream body into (event, data) pairs."""
+    event, data = None, []
+    for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+        if not line:
+            if event:
+                yield event, "\n".join(data)
+            event, data = None, []
+        elif line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            data.append(line[5:].strip())
+
+class DeviceFeed:
+    def __init__(self, device_id):
+        self.device_id = device_id
+        self.path = f"latest_events/{device_id}"
+        self.value = None
+        self.version = 0
+        self.message = self._encode()
+        self.synced_at = 0.0          # time.monotonic() of the last confirmed state
+        self.connected = False
+        self.viewers = 0
+        self.cond = threading.Condition()
+        self.refresh_lock = threading.Lock()
+        self.counters = {"stream_events": 0, "reconnects": 0, "refreshes": 0}
+        self.thread = threading.Thread(target=self.run, name=f"feed-{device_id}", daemon=True)
+
+    def _encode(self):
+        body = json.dumps(location_payload(self.value))
+        return f"id: {self.version}\ndata: {body}\n\n".encode()
+
+    def _publish(self, value):
+        # Caller holds self.cond
+        self.synced_at = time.monotonic()
+        if value == self.value:
+            return
+        self.value = value
+        self.version += 1
+        self.message = self._encode()
+        self.cond.notify_all()
+
+    # --- 1. UPSTREAM SUBSCRIBER ---
+    def run(self):
+        backoff = 1
+        while True:
+            with self.cond:
+                seen = self.counters["stream_events"]
+            try:
+                self._stream()
+            except Exception as e:
+                print(f"⚠️ Location stream for {self.device_id} dropped: {e}")
+            with self.cond:
+                # Streams nearly always end in an error; one that delivered events was
+                # healthy, so reconnect quickly instead of continuing the backoff
+                if self.counters["stream_events"] > seen:
+                    backoff = 1
+                self.connected = False
+                self.counters["reconnects"] += 1
+            # Keep viewers updated by polling until the stream is back
+            try:
+                self.refresh()
+            except Exception:
+                pass
+            time.sleep(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF_S)
+
+    def _stream(self):
+        with firebase.session.get(firebase.url_for(self.path), headers={"Accept": "text/event-stream"},
+                                  stream=True, timeout=(firebase.CONNECT_TIMEOUT_S, STREAM_READ_TIMEOUT_S)) as r:
+            r.raise_for_status()
+            for event, data in sse_events(r):
+                self._apply(event, data)
+
+    def _apply(self, event, data):
+        if event in ("cancel", "auth_revoked"):
+            raise RuntimeError(f"stream {event}: {data}")
+        with self.cond:
+            self.connected = True
+            self.counters["stream_events"] += 1
+            if event == "keep-alive":
+                self.synced_at = time.monotonic()
+                return
+            if event not in ("put", "patch"):
+                return
+            msg = json.loads(data)
+            parts = [p for p in msg["path"].split("/") if p]
+            if event == "put":
+                value = _set_path(self.value, parts, msg["data"])
+            else:
+                value = self.value
+                for key, child in (msg["data"] or {}).items():
+                    value = _set_path(value, parts + [p for p in key.split("/") if p], child)
+            self._publish(value)
+
+    # --- 2. READERS ---
+    def latest(self, max_age=MAX_STALENESS_S):
+        """Returns (fresh, value)."""
+        with self.cond:
+            fresh = self.connected or time.monotonic() - self.synced_at <= max_age
+            return fresh, self.value
+
+    def refresh(self):
+        """One conditional GET; concurrent callers share it."""
+        with self.refresh_lock:
+            fresh, value = self.latest()
+            if fresh:
+                return value
+            value = firebase.fetch_latest_device(self.device_id)
+            with self.cond:
+                self.counters["refreshes"] += 1
+                self._publish(value)
+            return value
+
+    def get(self, max_age=MAX_STALENESS_S):
+        fresh, value = self.latest(max_age)
+        return value if fresh else self.refresh()
+
+    def sse(self, keepalive_s=SSE_KEEPALIVE_S):
+        """Generator of SSE messages for one viewer: every new version, or a keep-alive comment."""
+        version = -1
+        with self.cond:
+            self.viewers += 1
+        try:
+            while True:
+                with self.cond:
+                    changed = self.cond.wait_for(lambda: self.version != version, keepalive_s)
+                    version, message = self.version, self.message
+                yield message if changed else b": keep-alive\n\n"
+        finally:
+            with self.cond:
+                self.viewers -= 1
+
+    def stats(self):
+        with self.cond:
+            return dict(self.counters, device_id=self.device_id, version=self.version,
+                        connected=self.connected, viewers=self.viewers,
+                        age_s=round(time.monotonic() - self.synced_at, 3) if self.synced_at else None)
+
+# --- 3. FEED REGISTRY ---
+feeds = {}
+_feeds_lock = threading.Lock()
+
+def get_feed(device_id):
+    """The device's feed, starting its subscriber on first use."""
+    with _feeds_lock:
+        feed = feeds.get(device_id)
+        if feed is None:
+            feed = feeds[device_id] = DeviceFeed(device_id)
+            feed.thread.start()
+        return feed
+
+def _after_fork():
+    # Subscriber threads do not survive a fork; children start their own
+    global _feeds_lock, viewer_slots
+    feeds.clear()
+    _feeds_lock = threading.Lock()
+    viewer_slots = threading.BoundedSemaphore(MAX_VIEWERS)
+
+os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,142 @@
+"""
+In-process latency spans, counters and a Prometheus text exporter.
+
+    with metrics.span("route_stage_seconds", route="safe", stage="path"):
+        ...
+
+records the block's wall time into a summary (count, sum and a
+reservoir of the latest RESERVOIR_SIZE samples for p50/p95/p99).
+inc() bumps a counter; register_collector() adds gauges or counters
+read from other modules (cache stats, queue depth) at scrape time.
+render() returns everything in the Prometheus text format for
+/metrics. Recording costs two clock reads and one short lock; with
+METRICS_ENABLED=0 span() returns a shared no-op context and nothing
+is recorded. Metrics are per process: each gunicorn worker reports its
+own.
+"""
+import os
+import time
+import threading
+from collections import deque
+from contextlib import nullcontext
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+PREFIX = "safebag_"
+RESERVOIR_SIZE = 1024
+QUANTILES = (0.5, 0.95, 0.99)
+
+_lock = threading.Lock()
+_summaries = {}    # (name, labels) -> [count, sum, deque of samples]
+_counters = {}     # (name, labels) -> value
+_collectors = []
+_NOOP = nullcontext()
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def observe(name, seconds, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        summary = _summaries.get(key)
+        if summary is None:
+            summary = _summaries[key] = [0, 0.0, deque(maxlen=RESERVOIR_SIZE)]
+        summary[0] += 1
+        summary[1] += seconds
+        summary[2].append(seconds)
+
+def inc(name, value=1, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+class _Span:
+    __slots__ = ("name", "labels", "t0")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.name, time.perf_counter() - self.t0, **self.labels)
+        if exc_type is not None:
+            inc(self.name.replace("_seconds", "") + "_errors", **self.labels)
+        return False
+
+def span(name, **labels):
+    """Context manager timing a block into the `name` summary."""
+    if not METRICS_ENABLED:
+        return _NOOP
+    return _Span(name, labels)
+
+def register_collector(fn):
+    """fn() -> [(name, type, labels dict, value)], called on every scrape."""
+    _collectors.append(fn)
+
+# --- Prometheus text format ---
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+def _quantile(sorted_samples, q):
+    return sorted_samples[min(int(q * len(sorted_samples)), len(sorted_samples) - 1)]
+
+def render():
+    with _lock:
+        summaries = {k: (v[0], v[1], sorted(v[2])) for k, v in _summaries.items()}
+        counters = dict(_counters)
+
+    lines = []
+    for family in sorted({name for name, _ in summaries}):
+        lines.append(f"# TYPE {PREFIX}{family} summary")
+        for (name, labels), (count, total, samples) in sorted(summaries.items()):
+            if name != family:
+                continue
+            for q in QUANTILES:
+                lines.append(f"{PREFIX}{name}{_labels(labels + (('quantile', q),))} {_quantile(samples, q):.6f}")
+            lines.append(f"{PREFIX}{name}_sum{_labels(labels)} {total:.6f}")
+            lines.append(f"{PREFIX}{name}_count{_labels(labels)} {count}")
+
+    for family in sorted({name for name, _ in counters}):
+        lines.append(f"# TYPE {PREFIX}{family}_total counter")
+        for (name, labels), value in sorted(counters.items()):
+            if name == family:
+                lines.append(f"{PREFIX}{name}_total{_labels(labels)} {value}")
+
+    collected = {}
+    for fn in _collectors:
+        try:
+            for name, kind, labels, value in fn():
+                collected.setdefault((name, kind), []).append((tuple(sorted(labels.items())), value))
+        except Exception as e:
+            print(f"Metrics collector error: {e}")
+    for (name, kind), samples in sorted(collected.items()):
+        lines.append(f"# TYPE {PREFIX}{name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{PREFIX}{name}{_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+def reset():
+    with _lock:
+        _summaries.clear()
+        _counters.clear()
+
+def _after_fork():
+    # Workers start from zero (and with an unheld lock), not the master's warm-up samples
+    global _lock
+    _lock = threading.Lock()
+    _summaries.clear()
+    _counters.clear()
+
+os.register_at_fork(after_in_child=_after_fork)
@@ -4,6 +4,14 @@ import numpy as np
 import pandas as pd
 from scipy.spatial import cKDTree
 import os
+from risk_grid import load_risk_grid, risk_grid_lookup
+from poi_index import PoiIndex, load_pois, POI_FILE
+import metrics
+
+# "live" runs the model on every call, "grid" answers from the
+# precomputed table built by `python risk_grid.py`
+PREDICT_MODE = os.getenv("PREDICT_MODE", "live")
+RISK_GRID_FILE = os.getenv("RISK_GRID_FILE", "data/risk_grid.bin")
 
 # --- 1. SETUP: Load Data & Models ---
 try:
@@ -28,12 +36,31 @@ try:
 except Exception as e:
     print(f"⚠️ Error loading CSV: {e}")
 
+# Precomputed Risk Grid (only needed in grid mode)
+risk_grid = None
+if PREDICT_MODE == "grid":
+    try:
+        risk_grid = load_risk_grid(RISK_GRID_FILE)
+        print("✅ Risk Grid Loaded.")
+    except Exception as e:
+        print(f"⚠️ Risk grid unavailable, using live model: {e}")
+
 # --- 2. CONFIGURATION: Safe Havens ---
+# Police stations, hospitals etc. come from POI_FILE; this list is the fallback
 SAFE_HAVENS = [
     {"name": "Sitabuldi Police Station", "lat": 21.1498, "lon": 79.0806},
     {"name": "Sadar Police Station", "lat": 21.1610, "lon": 79.0880},
     {"name": "Government Medical College", "lat": 21.1450, "lon": 79.0900},
 ]
+SAFE_HAVEN_RADIUS_M = float(os.getenv("SAFE_HAVEN_RADIUS_M", "200"))
+
+try:
+    poi_index = load_pois(POI_FILE)
+    print(f"✅ Safe Havens Loaded ({len(poi_index)} POIs).")
+except Exception as e:
+    print(f"⚠️ POI file unavailable, using built-in safe havens: {e}")
+    poi_index = PoiIndex([h["name"] for h in SAFE_HAVENS], ["haven"] * len(SAFE_HAVENS),
+                         [h["lat"] for h in SAFE_HAVENS], [h["lon"] for h in SAFE_HAVENS])
 
 def get_timeslot(hour):
     if 0 <= hour <= 5: return "Night"
@@ -46,139 +73,260 @@ def get_time_multiplier(hour):
     if 19 <= hour < 23: return 1.0  # Evening (Normal)
     return 1.5                      # Late Night (Riskier)
 
-def is_near_safe_haven(lat, lon, threshold_km=0.2):
-    for haven in SAFE_HAVENS:
-        dist_deg = np.sqrt((lat - haven['lat'])**2 + (lon - haven['lon'])**2)
-        if (dist_deg * 111.0) < threshold_km:
-            return True, haven['name']
+def is_near_safe_haven(lat, lon, threshold_km=SAFE_HAVEN_RADIUS_M / 1000.0):
+    near, idx = poi_index.any_within([lat], [lon], threshold_km * 1000.0)
+    if near[0]:
+        return True, poi_index.names[idx[0]]
     return False, None
 
 # --- 3. HELPER: Calculate Safety Probability ---
+def _find_class_index(classes, label, le_risk):
+    if label in classes:
+        return classes.index(label)
+    if le_risk:
+        try:
+            # Try to encode the string "Low" to the integer expected by model
+            enc_label = le_risk.transform([label])[0]
+            if enc_label in classes:
+                return classes.index(enc_label)
+        except: pass
+    return -1
+
+def compile_scorer(model, le_risk):
+    """
+    Resolve the label lookups once for a model, so scoring is a dot
+    product of the probability matrix with a fixed weight vector.
+    Handles both Integer classes (0,1,2) and String classes ('Low','High').
+    """
+    classes = list(model.classes_)
+    weights = np.zeros(len(classes))
+    found = False
+
+    # Strategy 1: "Low" counts fully, "Moderate" counts half
+    for label, weight in (("Low", 1.0), ("Moderate", 0.5)):
+        idx = _find_class_index(classes, label, le_risk)
+        if idx != -1:
+            weights[idx] += weight
+            found = True
+
+    return {
+        "model": model,
+        "le_risk": le_risk,
+        "weights": weights,
+        "found": found,
+        # Strategy 2: 1.0 - "Critical" (-1 means Strategy 3: max probability)
+        "crit_idx": _find_class_index(classes, "Critical", le_risk),
+    }
+
+def score_probas(scorer, probas):
+    """Safety score (0.0 to 1.0) for each row of a predict_proba matrix."""
+    if scorer["found"]:
+        safe_prob = probas @ scorer["weights"]
+        fallback = safe_prob == 0.0
+    else:
+        safe_prob = np.zeros(len(probas))
+        fallback = np.ones(len(probas), dtype=bool)
+
+    if fallback.any():
+        if scorer["crit_idx"] != -1:
+            safe_prob[fallback] = 1.0 - probas[fallback, scorer["crit_idx"]]
+        else:
+            safe_prob[fallback] = np.max(probas[fallback], axis=1)
+    return safe_prob
+
+_scorer_cache = {}
+
+def get_scorer(model, le_risk):
+    scorer = _scorer_cache.get(id(model))
+    if scorer is None or scorer["model"] is not model or scorer["le_risk"] is not le_risk:
+        scorer = compile_scorer(model, le_risk)
+        _scorer_cache[id(model)] = scorer
+    return scorer
+
 def get_safety_score_for_features(model, features, le_risk):
     """
     Robust function to get 'Safety Score' (0.0 to 1.0).
     Handles both Integer classes (0,1,2) and String classes ('Low','High').
     """
     try:
-        probas = model.predict_proba([features])[0]
-        classes = list(model.classes_)
-        
-        safe_prob = 0.0
-        
-        # Strategy 1: Look for explicit "Low" or "Moderate" labels
-        targets = ["Low", "Moderate"]
-        found = False
-        
-        for label in targets:
-            idx = -1
-            if label in classes:
-                idx = classes.index(label)
-            elif le_risk:
-                try:
-                    # Try to encode the string "Low" to the integer expected by model
-                    enc_label = le_risk.transform([label])[0]
-                    if enc_label in classes:
-                        idx = classes.index(enc_label)
-                except: pass
-            
-            if idx != -1:
-                weight = 1.0 if label == "Low" else 0.5
-                safe_prob += probas[idx] * weight
-                found = True
-
-        # Strategy 2: If we couldn't find "Low", calculate 1.0 - "Critical"
-        if not found or safe_prob == 0.0:
-            crit_idx = -1
-            if "Critical" in classes:
-                crit_idx = classes.index("Critical")
-            elif le_risk:
-                try:
-                    enc_crit = le_risk.transform(["Critical"])[0]
-                    if enc_crit in classes:
-                        crit_idx = classes.index(enc_crit)
-                except: pass
-            
-            if crit_idx != -1:
-                safe_prob = 1.0 - probas[crit_idx]
-            else:
-                # Strategy 3: Fallback (Just take the max probability if nothing else works)
-                safe_prob = np.max(probas)
-
-        return safe_prob
+        return get_safety_scores(model, [features], le_risk)[0]
     except Exception as e:
         print(f"Error calculating score: {e}")
         return 0.5 # Default to moderate if math fails
 
+def get_safety_scores(model, X, le_risk):
+    """
+    Batch version of get_safety_score_for_features.
+    X is a 2D feature matrix; returns one safety score per row.
+    """
+    try:
+        probas = model.predict_proba(X)
+        return score_probas(get_scorer(model, le_risk), probas)
+    except Exception as e:
+        print(f"Error calculating scores: {e}")
+        return np.full(len(X), 0.5)
+
+def get_risk_label(safety):
+    if safety > 0.75: return "Low"
+    if safety > 0.40: return "Moderate"
+    if safety > 0.20: return "High"
+    return "Critical"
+
 # --- 4. MAIN PREDICTION FUNCTION ---
-def predict(lat, lon):
-    # A. Check Safe Haven
-    is_safe, haven_name = is_near_safe_haven(lat, lon)
-    if is_safe:
-        return "Low", "None", 0.99
+def predict_many(lats, lons, when=None, mode=None, use_havens=True):
+    """
+    Score many points in one pass: one KD-tree query, one predict_proba
+    call and one crime predict call for the whole batch.
+    mode="grid" answers points inside the precomputed risk grid from the
+    table and only runs the live model for the rest.
+    Returns a list of (risk_label, crime_label, safety) tuples.
+    """
+    lats = np.asarray(lats, dtype=float).ravel()
+    lons = np.asarray(lons, dtype=float).ravel()
+    if len(lats) != len(lons):
+        raise ValueError("lats and lons must have the same length")
+    n = len(lats)
+    if n == 0:
+        return []
+
+    results = [None] * n
+    metrics.inc("predict_points", n)
+
+    # A. Check Safe Havens (one tree query for the batch)
+    near = np.zeros(n, dtype=bool)
+    if use_havens:
+        with metrics.span("predict_stage_seconds", stage="havens"):
+            near, _ = poi_index.any_within(lats, lons, SAFE_HAVEN_RADIUS_M)
+    for i in np.flatnonzero(near):
+        results[i] = ("Low", "None", 0.99)
+    pending = np.flatnonzero(~near).tolist()
+    if not pending:
+        return results
+
+    now = when or datetime.datetime.now()
+
+    # Grid mode: O(1) table lookup, live model only outside the grid
+    if (mode or PREDICT_MODE) == "grid" and risk_grid is not None:
+        pending = np.array(pending)
+        with metrics.span("predict_stage_seconds", stage="grid"):
+            inside, safety, crime_labels = risk_grid_lookup(risk_grid, lats[pending], lons[pending], now)
+        for i, score, crime_label in zip(pending[inside], safety, crime_labels):
+            score = float(score)
+            results[i] = (get_risk_label(score), crime_label, score)
+        pending = list(pending[~inside])
+        if not pending:
+            return results
 
     # B. Prepare Features
-    now = datetime.datetime.now()
     hour = now.hour
     day = now.strftime("%A")
     slot = get_timeslot(hour)
 
     if risk_artifact:
         model = risk_artifact["model"]
-        le_day = risk_artifact.get("le_day")
-        le_slot = risk_artifact.get("le_slot")
         le_risk = risk_artifact.get("le_risk") # Vital for decoding
-        
-        try:
-            day_enc = int(le_day.transform([day])[0]) if le_day else 0
-            slot_enc = int(le_slot.transform([slot])[0]) if le_slot else 0
-        except:
-            day_enc, slot_enc = 0, 0
+        day_enc, slot_enc = encode_time(day, slot)
     else:
-        return "Unknown", "Unknown", 0.0
+        for i in pending:
+            results[i] = ("Unknown", "Unknown", 0.0)
+        return results
+
+    pending = np.array(pending)
+    p_lats = lats[pending]
+    p_lons = lons[pending]
+    m = len(pending)
 
     # C. Interpolation (3-Ward Average)
     if tree is not None:
-        distances, indices = tree.query([lat, lon], k=3)
+        with metrics.span("predict_stage_seconds", stage="kdtree"):
+            distances, indices = tree.query(np.column_stack([p_lats, p_lons]), k=3)
         weights = 1 / (distances + 0.0001)
-        norm_weights = weights / np.sum(weights)
-        
-        total_safety = 0.0
-        
-        for i, idx in enumerate(indices):
-            ward_enc = 0
-            if 'Ward_Encoded' in ward_df.columns:
-                ward_enc = ward_df.iloc[idx]['Ward_Encoded']
-            
-            features = [ward_enc, float(lat), float(lon), int(hour), day_enc, slot_enc]
-            
-            # Get score for this specific ward point
-            score = get_safety_score_for_features(model, features, le_risk)
-            total_safety += score * norm_weights[i]
-            
-        final_safety = total_safety
+        norm_weights = weights / np.sum(weights, axis=1, keepdims=True)
+
+        if 'Ward_Encoded' in ward_df.columns:
+            ward_enc = ward_df['Ward_Encoded'].values[indices]
+        else:
+            ward_enc = np.zeros(indices.shape)
+
+        X = np.empty((m * 3, 6))
+        X[:, 0] = ward_enc.ravel()
+        X[:, 1] = np.repeat(p_lats, 3)
+        X[:, 2] = np.repeat(p_lons, 3)
+        X[:, 3] = hour
+        X[:, 4] = day_enc
+        X[:, 5] = slot_enc
+
+        with metrics.span("predict_stage_seconds", stage="risk_model"):
+            scores = get_safety_scores(model, X, le_risk).reshape(m, 3)
+        final_safety = np.zeros(m)
+        for i in range(3):
+            final_safety += scores[:, i] * norm_weights[:, i]
     else:
         # Fallback Single Point
-        features = [0, float(lat), float(lon), int(hour), day_enc, slot_enc]
-        final_safety = get_safety_score_for_features(model, features, le_risk)
+        X = np.column_stack([np.zeros(m), p_lats, p_lons,
+                             np.full(m, hour), np.full(m, day_enc), np.full(m, slot_enc)])
+        with metrics.span("predict_stage_seconds", stage="risk_model"):
+            final_safety = get_safety_scores(model, X, le_risk)
 
     # D. Time Adjustment
     time_mult = get_time_multiplier(hour)
-    adjusted_safety = final_safety / time_mult
-    adjusted_safety = max(0.0, min(1.0, adjusted_safety))
-
-    # E. Labels
-    if adjusted_safety > 0.75: risk_label = "Low"
-    elif adjusted_safety > 0.40: risk_label = "Moderate"
-    elif adjusted_safety > 0.20: risk_label = "High"
-    else: risk_label = "Critical"
+    adjusted_safety = np.clip(final_safety / time_mult, 0.0, 1.0)
 
     # F. Crime Prediction
     crime_model = crime_artifact["model"]
-    base_features = [0, float(lat), float(lon), int(hour), day_enc, slot_enc]
-    crime_pred = crime_model.predict([base_features])[0]
+    base_features = np.column_stack([np.zeros(m), p_lats, p_lons,
+                                     np.full(m, hour), np.full(m, day_enc), np.full(m, slot_enc)])
+    with metrics.span("predict_stage_seconds", stage="crime_model"):
+        crime_preds = crime_model.predict(base_features)
+        try:
+            crime_labels = list(crime_artifact["le_target"].inverse_transform(crime_preds))
+        except:
+            crime_labels = [str(c) for c in crime_preds]
+
+    # E. Labels
+    for j, i in enumerate(pending):
+        safety = float(adjusted_safety[j])
+        results[i] = (get_risk_label(safety), crime_labels[j], safety)
+
+    return results
+
+def predict(lat, lon, when=None, mode=None):
+    return predict_many([lat], [lon], when=when, mode=mode)[0]
+
+# --- 5. COMPILED LOOKUPS (built once when the artifact loads) ---
+def compile_time_encodings(artifact):
+    """(day, slot) -> (day_enc, slot_enc) for every weekday and time slot."""
+    le_day = artifact.get("le_day")
+    le_slot = artifact.get("le_slot")
+    monday = datetime.date(2024, 1, 1)
+    days = [(monday + datetime.timedelta(days=i)).strftime("%A") for i in range(7)]
+    slots = sorted({get_timeslot(h) for h in range(24)})
+
+    table = {}
+    for day in days:
+        for slot in slots:
+            try:
+                day_enc = int(le_day.transform([day])[0]) if le_day else 0
+                slot_enc = int(le_slot.transform([slot])[0]) if le_slot else 0
+            except:
+                day_enc, slot_enc = 0, 0
+            table[(day, slot)] = (day_enc, slot_enc)
+    return table
+
+TIME_ENCODINGS = {}
+if risk_artifact:
+    TIME_ENCODINGS = compile_time_encodings(risk_artifact)
+    get_scorer(risk_artifact["model"], risk_artifact.get("le_risk"))
+
+def encode_time(day, slot):
+    enc = TIME_ENCODINGS.get((day, slot))
+    if enc is not None:
+        return enc
+    le_day = risk_artifact.get("le_day")
+    le_slot = risk_artifact.get("le_slot")
     try:
-        crime_label = crime_artifact["le_target"].inverse_transform([crime_pred])[0]
+        day_enc = int(le_day.transform([day])[0]) if le_day else 0
+        slot_enc = int(le_slot.transform([slot])[0]) if le_slot else 0
     except:
-        crime_label = str(crime_pred)
-
-    return risk_label, crime_label, adjusted_safety
+        day_enc, slot_enc = 0, 0
+    return day_enc, slot_enc
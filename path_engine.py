@@ -0,0 +1,433 @@
+"""
+Shortest-path engines over the array-backed graph snapshot.
+
+    dijkstra   scipy csgraph, one full search from the origin
+    astar      bidirectional A* with a haversine lower bound
+    ch         contraction hierarchy built offline (`python path_engine.py build-ch`)
+
+All engines return node indices into the snapshot arrays and the path
+cost, which matches nx.shortest_path on the same weights.
+
+The query loops index the snapshot's memory-mapped arrays through
+memoryviews (a Python int or float per item, like a list) instead of
+copying them into lists, so every weight and every worker shares the
+same pages; only the reverse adjacency, built once per graph, is extra.
+
+`python path_engine.py verify` compares every engine with NetworkX on
+random origin/destination pairs; tests/test_path_engine.py runs the
+same check on a synthetic grid.
+"""
+import os
+import json
+import math
+import time
+import heapq
+import argparse
+import datetime
+import numpy as np
+
+import graph_snapshot
+from geo import EARTH_RADIUS_M, haversine_m
+
+def path_cost(snap, path, weights=None):
+    weights = snap["safety_weight"] if weights is None else weights
+    return float(sum(float(weights[e]) for e in graph_snapshot.edge_ids(snap, path)))
+
+# --- 1. BIDIRECTIONAL A* ---
+def _view(array):
+    return memoryview(np.ascontiguousarray(array))
+
+def build_topology(snap):
+    """
+    The weight-independent half of A*, built once per graph: both
+    adjacency directions as (indptr, neighbour, edge id) and the node
+    coordinates for the heuristic.
+    """
+    indptr = np.asarray(snap["indptr"])
+    indices = np.asarray(snap["indices"])
+    n = len(indptr) - 1
+    src = np.repeat(np.arange(n), np.diff(indptr))
+
+    order = np.argsort(indices, kind="stable")
+    rev_indptr = np.zeros(n + 1, dtype=np.int64)
+    np.add.at(rev_indptr, indices.astype(np.int64) + 1, 1)
+    rev_indptr = np.cumsum(rev_indptr)
+
+    lat = np.asarray(snap["node_lat"])
+    lon = np.asarray(snap["node_lon"])
+    return {
+        "fwd": (_view(indptr), _view(indices), _view(np.arange(len(indices)))),
+        "rev": (_view(rev_indptr), _view(src[order]), _view(order)),
+        "lat": _view(np.radians(lat)),
+        "lon": _view(np.radians(lon)),
+        "cos_lat": _view(np.cos(np.radians(lat))),
+        "straight": haversine_m(lat[src], lon[src], lat[indices], lon[indices]),
+    }
+
+def build_astar(snap, weights=None, topology=None):
+    """
+    A* over one weight array: the shared topology, the weights as they
+    are mapped, and the heuristic scale: the smallest weight per metre
+    of straight-line distance over all edges, so weight >= scale *
+    haversine holds on every edge.
+    """
+    topology = topology or build_topology(snap)
+    weights = snap["safety_weight"] if weights is None else weights
+    straight = topology["straight"]
+    positive = straight > 0
+    scale = float(np.min(np.asarray(weights, dtype=np.float64)[positive] / straight[positive])) \
+        if positive.any() else 0.0
+    # Small slack keeps the bound admissible under floating-point rounding
+    scale = max(0.0, scale * (1 - 1e-9))
+    return dict(topology, weights=_view(weights), scale=scale)
+
+def astar_path(engine, orig, dest):
+    """(node path, cost) by bidirectional A*, or (None, inf) if unreachable."""
+    if orig == dest:
+        return [orig], 0.0
+
+    lat, lon, cos_lat = engine["lat"], engine["lon"], engine["cos_lat"]
+    k = engine["scale"] * 2 * EARTH_RADIUS_M
+    asin, sin, sqrt = math.asin, math.sin, math.sqrt
+
+    def h(a, b):
+        s = sin((lat[b] - lat[a]) / 2) ** 2 + cos_lat[a] * cos_lat[b] * sin((lon[b] - lon[a]) / 2) ** 2
+        return k * asin(sqrt(min(s, 1.0)))
+
+    # Average potential: consistent for both directions at once
+    potential = {}
+    def p(v):
+        value = potential.get(v)
+        if value is None:
+            value = potential[v] = 0.5 * (h(v, dest) - h(orig, v))
+        return value
+
+    dist = ({orig: 0.0}, {dest: 0.0})
+    pred = ({orig: -1}, {dest: -1})
+    settled = (set(), set())
+    heaps = ([(p(orig), orig)], [(-p(dest), dest)])
+    sign = (1.0, -1.0)
+    adj = (engine["fwd"], engine["rev"])
+    weights = engine["weights"]
+
+    best, meet = math.inf, -1
+    while heaps[0] and heaps[1]:
+        if heaps[0][0][0] + heaps[1][0][0] >= best:
+            break
+        side = 0 if heaps[0][0][0] <= heaps[1][0][0] else 1
+        _, u = heapq.heappop(heaps[side])
+        if u in settled[side]:
+            continue
+        settled[side].add(u)
+
+        d_u = dist[side][u]
+        here, there = dist[side], dist[1 - side]
+        indptr, indices, edge_ids = adj[side]
+        for e in range(indptr[u], indptr[u + 1]):
+            v = indices[e]
+            nd = d_u + weights[edge_ids[e]]
+            if nd < here.get(v, math.inf):
+                here[v] = nd
+                pred[side][v] = u
+                heapq.heappush(heaps[side], (nd + sign[side] * p(v), v))
+                if v in there and nd + there[v] < best:
+                    best, meet = nd + there[v], v
+
+    if meet == -1:
+        return None, math.inf
+
+    path = [meet]
+    while pred[0][path[-1]] != -1:
+        path.append(pred[0][path[-1]])
+    path.reverse()
+    while pred[1][path[-1]] != -1:
+        path.append(pred[1][path[-1]])
+    return path, best
+
+# --- 2. CONTRACTION HIERARCHY ---
+CH_ARRAYS = [
+    "rank",
+    "fwd_indptr", "fwd_indices", "fwd_weights", "fwd_mid",
+    "bwd_indptr", "bwd_indices", "bwd_weights", "bwd_mid",
+]
+
+def _witness_cost(out_adj, contracted, source, skip, targets, limit, max_settled=500):
+    """Cheapest known cost from source to each target, avoiding `skip`."""
+    dist = {source: 0.0}
+    heap = [(0.0, source)]
+    found = {}
+    settled = 0
+    while heap and settled < max_settled:
+        d, u = heapq.heappop(heap)
+        if d > dist[u]:
+            continue
+        if d > limit:
+            break
+        settled += 1
+        if u in targets:
+            found[u] = d
+            if len(found) == len(targets):
+                break
+        for v, (w, _) in out_adj[u].items():
+            if v == skip or contracted[v]:
+                continue
+            nd = d + w
+            if nd < dist.get(v, math.inf):
+                dist[v] = nd
+                heapq.heappush(heap, (nd, v))
+    return found
+
+def _shortcuts_for(out_adj, in_adj, contracted, v):
+    shortcuts = []
+    outs = {x: w for x, (w, _) in out_adj[v].items() if not contracted[x]}
+    if not outs:
+        return shortcuts
+    max_out = max(outs.values())
+    for u, (w_in, _) in in_adj[v].items():
+        if contracted[u]:
+            continue
+        targets = {x for x in outs if x != u}
+        if not targets:
+            continue
+        witness = _witness_cost(out_adj, contracted, u, v, targets, w_in + max_out)
+        for x in targets:
+            cost = w_in + outs[x]
+            if witness.get(x, math.inf) > cost:
+                shortcuts.append((u, x, cost))
+    return shortcuts
+
+def _priority(out_adj, in_adj, contracted, deleted, v):
+    n_shortcuts = len(_shortcuts_for(out_adj, in_adj, contracted, v))
+    degree = sum(not contracted[x] for x in out_adj[v]) + sum(not contracted[u] for u in in_adj[v])
+    # Edge difference, weighted towards fewer shortcuts
+    return 2 * n_shortcuts - degree + deleted[v]
+
+def build_ch(snap, weights=None):
+    """Contract every node in edge-difference order; returns the CH arrays."""
+    weights = np.asarray(snap["safety_weight"] if weights is None else weights, dtype=np.float64)
+    indptr = np.asarray(snap["indptr"])
+    indices = np.asarray(snap["indices"])
+    n = len(indptr) - 1
+
+    out_adj = [dict() for _ in range(n)]
+    in_adj = [dict() for _ in range(n)]
+    for u in range(n):
+        for e in range(indptr[u], indptr[u + 1]):
+            v, w = int(indices[e]), float(weights[e])
+            if u == v:
+                continue
+            out_adj[u][v] = (w, -1)
+            in_adj[v][u] = (w, -1)
+
+    contracted = [False] * n
+    deleted = [0] * n
+    rank = np.zeros(n, dtype=np.int64)
+    heap = [(_priority(out_adj, in_adj, contracted, deleted, v), v) for v in range(n)]
+    heapq.heapify(heap)
+
+    order = 0
+    while heap:
+        prio, v = heapq.heappop(heap)
+        if contracted[v]:
+            continue
+        # Lazy update: re-evaluate, and put back if no longer the cheapest
+        prio = _priority(out_adj, in_adj, contracted, deleted, v)
+        if heap and prio > heap[0][0]:
+            heapq.heappush(heap, (prio, v))
+            continue
+
+        for u, x, cost in _shortcuts_for(out_adj, in_adj, contracted, v):
+            if cost < out_adj[u].get(x, (math.inf, -1))[0]:
+                out_adj[u][x] = (cost, v)
+                in_adj[x][u] = (cost, v)
+
+        contracted[v] = True
+        rank[v] = order
+        order += 1
+        for x in list(out_adj[v]) + list(in_adj[v]):
+            deleted[x] += 1
+
+    # Upward forward edges u->x (rank x > rank u), and upward backward
+    # edges stored at x as "reached from u" (rank u > rank x)
+    fwd = [[] for _ in range(n)]
+    bwd = [[] for _ in range(n)]
+    for u in range(n):
+        for x, (w, mid) in out_adj[u].items():
+            if rank[x] > rank[u]:
+                fwd[u].append((x, w, mid))
+            else:
+                bwd[x].append((u, w, mid))
+
+    def to_csr(rows):
+        row_ptr = np.zeros(n + 1, dtype=np.int64)
+        row_ptr[1:] = np.cumsum([len(r) for r in rows])
+        flat = [edge for r in rows for edge in sorted(r)]
+        return (row_ptr,
+                np.array([e[0] for e in flat], dtype=np.int32),
+                np.array([e[1] for e in flat], dtype=np.float64),
+                np.array([e[2] for e in flat], dtype=np.int32))
+
+    ch = {"rank": rank}
+    for prefix, rows in (("fwd", fwd), ("bwd", bwd)):
+        ch[f"{prefix}_indptr"], ch[f"{prefix}_indices"], ch[f"{prefix}_weights"], ch[f"{prefix}_mid"] = to_csr(rows)
+    return ch
+
+def save_ch(ch, snapshot_dir, weight_name="safety_weight"):
+    for name in CH_ARRAYS:
+        np.save(os.path.join(snapshot_dir, f"ch_{weight_name}_{name}.npy"), ch[name])
+    meta = {
+        "weight": weight_name,
+        "shortcuts": int(len(ch["fwd_indices"]) + len(ch["bwd_indices"])),
+        "built_at": datetime.datetime.now().isoformat(timespec="seconds"),
+    }
+    with open(os.path.join(snapshot_dir, f"ch_{weight_name}_meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+def load_ch(snapshot_dir, weight_name="safety_weight"):
+    """CH arrays mapped read-only, as memoryviews for the query loop, or None if not built."""
+    if not os.path.exists(os.path.join(snapshot_dir, f"ch_{weight_name}_meta.json")):
+        return None
+    ch = {}
+    for name in CH_ARRAYS:
+        ch[name] = _view(np.load(os.path.join(snapshot_dir, f"ch_{weight_name}_{name}.npy"), mmap_mode="r"))
+    return ch
+
+def _ch_mid(ch, u, x):
+    """Middle node of edge u->x in the hierarchy (-1 for an original edge)."""
+    if ch["rank"][x] > ch["rank"][u]:
+        prefix, row, key = "fwd", u, x
+    else:
+        prefix, row, key = "bwd", x, u
+    indptr, indices = ch[f"{prefix}_indptr"], ch[f"{prefix}_indices"]
+    for e in range(indptr[row], indptr[row + 1]):
+        if indices[e] == key:
+            return ch[f"{prefix}_mid"][e]
+    raise KeyError(f"edge {u}->{x} not in hierarchy")
+
+def ch_path(ch, orig, dest):
+    """(node path, cost) by an upward search from both ends."""
+    if orig == dest:
+        return [orig], 0.0
+
+    dist = ({orig: 0.0}, {dest: 0.0})
+    pred = ({orig: -1}, {dest: -1})
+    heaps = ([(0.0, orig)], [(0.0, dest)])
+    adj = (
+        (ch["fwd_indptr"], ch["fwd_indices"], ch["fwd_weights"]),
+        (ch["bwd_indptr"], ch["bwd_indices"], ch["bwd_weights"]),
+    )
+
+    best, meet = math.inf, -1
+    while heaps[0] or heaps[1]:
+        for side in (0, 1):
+            if not heaps[side]:
+                continue
+            d, u = heapq.heappop(heaps[side])
+            if d >= best:
+                heaps[side].clear()
+                continue
+            if d > dist[side][u]:
+                continue
+            if u in dist[1 - side] and d + dist[1 - side][u] < best:
+                best, meet = d + dist[1 - side][u], u
+            indptr, indices, weights = adj[side]
+            for e in range(indptr[u], indptr[u + 1]):
+                v = indices[e]
+                nd = d + weights[e]
+                if nd < dist[side].get(v, math.inf):
+                    dist[side][v] = nd
+                    pred[side][v] = u
+                    heapq.heappush(heaps[side], (nd, v))
+
+    if meet == -1:
+        return None, math.inf
+
+    # Hierarchy path: orig .. meet .. dest
+    up = [meet]
+    while pred[0][up[-1]] != -1:
+        up.append(pred[0][up[-1]])
+    up.reverse()
+    while pred[1][up[-1]] != -1:
+        up.append(pred[1][up[-1]])
+
+    # Unpack shortcuts into original edges
+    path = [up[0]]
+    stack = [(u, x) for u, x in reversed(list(zip(up[:-1], up[1:])))]
+    while stack:
+        u, x = stack.pop()
+        mid = _ch_mid(ch, u, x)
+        if mid == -1:
+            path.append(x)
+        else:
+            stack.append((mid, x))
+            stack.append((u, mid))
+    return path, best
+
+# --- 3. OFFLINE TOOLS ---
+def verify(snapshot_dir, pairs=100, seed=0):
+    """Compare every engine with nx.shortest_path on random pairs."""
+    import networkx as nx
+    import osmnx as ox
+
+    snap = graph_snapshot.load_snapshot(snapshot_dir)
+    Gp = ox.load_graphml(snap["meta"]["source"], edge_dtypes={"safety_weight": float})
+    node_ids = snap["node_ids"]
+    engines = {
+        "dijkstra": lambda o, d: graph_snapshot.shortest_path(snap, o, d),
+        "astar": (lambda eng: lambda o, d: astar_path(eng, o, d)[0])(build_astar(snap)),
+    }
+    ch = load_ch(snapshot_dir)
+    if ch is not None:
+        engines["ch"] = lambda o, d: ch_path(ch, o, d)[0]
+    else:
+        print("No contraction hierarchy built, skipping ch")
+
+    rng = np.random.default_rng(seed)
+    n = len(node_ids)
+    timings = {name: 0.0 for name in ["networkx"] + list(engines)}
+    failures = 0
+    for _ in range(pairs):
+        o, d = (int(x) for x in rng.integers(0, n, 2))
+        t0 = time.perf_counter()
+        try:
+            ref = nx.shortest_path_length(Gp, int(node_ids[o]), int(node_ids[d]), weight="safety_weight")
+        except nx.NetworkXNoPath:
+            ref = None
+        timings["networkx"] += time.perf_counter() - t0
+
+        for name, engine in engines.items():
+            t0 = time.perf_counter()
+            path = engine(o, d)
+            timings[name] += time.perf_counter() - t0
+            cost = None if path is None else path_cost(snap, path)
+            # Snapshot weights are float32, NetworkX keeps float64
+            ok = (cost is None) == (ref is None) and (ref is None or math.isclose(cost, ref, rel_tol=1e-6, abs_tol=1e-6))
+            if not ok:
+                failures += 1
+                print(f"❌ {name}: {node_ids[o]} -> {node_ids[d]} cost {cost} vs networkx {ref}")
+
+    for name, total in timings.items():
+        print(f"  {name}: {total / pairs * 1000:.2f} ms/query")
+    print("✅ All engines match NetworkX" if not failures else f"❌ {failures} mismatches")
+    return failures == 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shortest-path engine tools")
+    parser.add_argument("command", choices=["build-ch", "verify"])
+    parser.add_argument("--snapshot", default=graph_snapshot.SNAPSHOT_DIR)
+    parser.add_argument("--pairs", type=int, default=100)
+    parser.add_argument("--weight", default="safety_weight",
+                        help="safety_weight, or risk_<slot> from edge_risk.py")
+    args = parser.parse_args()
+
+    if args.command == "build-ch":
+        t0 = time.time()
+        snap = graph_snapshot.load_snapshot(args.snapshot)
+        if args.weight.startswith("risk_"):
+            import edge_risk
+            edge_risk.load_edge_weights(snap, args.snapshot)
+        ch = build_ch(snap, snap[args.weight])
+        save_ch(ch, args.snapshot, args.weight)
+        print(f"✅ Contraction hierarchy built in {time.time() - t0:.1f}s")
+    else:
+        raise SystemExit(0 if verify(args.snapshot, args.pairs) else 1)
@@ -0,0 +1,83 @@
+"""
+Points of interest (police stations, hospitals and other safe havens).
+
+Loaded from a CSV (name,category,lat,lon; POI_FILE) into a cKDTree over
+unit-sphere vectors, so every query is a haversine-exact tree lookup
+instead of a scan: k-nearest and radius queries, each with a batch
+variant that answers many points in one call. A tree per category
+serves filtered queries such as police-only.
+"""
+import os
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from geo import to_unit_xyz, chord_to_m, m_to_chord, haversine_m
+
+POI_FILE = os.getenv("POI_FILE", "data/safe_havens.csv")
+
+class PoiIndex:
+    def __init__(self, names, categories, lats, lons):
+        self.names = np.asarray(names, dtype=object)
+        self.categories = np.asarray(categories, dtype=object)
+        self.lats = np.asarray(lats, dtype=float)
+        self.lons = np.asarray(lons, dtype=float)
+        self.trees = {None: (cKDTree(to_unit_xyz(self.lats, self.lons)), np.arange(len(self.lats)))}
+        for category in np.unique(self.categories):
+            ids = np.flatnonzero(self.categories == category)
+            self.trees[category] = (cKDTree(to_unit_xyz(self.lats[ids], self.lons[ids])), ids)
+
+    def __len__(self):
+        return len(self.lats)
+
+    def _tree(self, category):
+        return self.trees.get(category, (None, None))
+
+    def record(self, i, distance_m=None):
+        poi = {"name": self.names[i], "category": self.categories[i],
+               "lat": float(self.lats[i]), "lon": float(self.lons[i])}
+        if distance_m is not None:
+            poi["distance_m"] = round(float(distance_m), 1)
+        return poi
+
+    # --- k-nearest ---
+    def nearest_many(self, lats, lons, k=1, category=None):
+        """(distance_m, poi index), each shaped (n, k); missing neighbours are inf / -1."""
+        tree, ids = self._tree(category)
+        n = len(np.atleast_1d(lats))
+        if tree is None or k <= 0:
+            return np.full((n, max(k, 0)), np.inf), np.full((n, max(k, 0)), -1)
+        chord, idx = tree.query(to_unit_xyz(np.atleast_1d(lats), np.atleast_1d(lons)), k=k)
+        chord, idx = chord.reshape(n, k), idx.reshape(n, k)
+        found = idx < len(ids)
+        dist = np.where(found, chord_to_m(np.where(found, chord, 0)), np.inf)
+        return dist, np.where(found, ids[np.minimum(idx, len(ids) - 1)], -1)
+
+    def nearest(self, lat, lon, k=5, category=None):
+        dist, idx = self.nearest_many([lat], [lon], k, category)
+        return [self.record(i, d) for d, i in zip(dist[0], idx[0]) if i >= 0]
+
+    # --- radius ---
+    def within_many(self, lats, lons, radius_m, category=None):
+        """POI indexes within radius_m of each point, one list per point."""
+        tree, ids = self._tree(category)
+        n = len(np.atleast_1d(lats))
+        if tree is None:
+            return [[] for _ in range(n)]
+        hits = tree.query_ball_point(to_unit_xyz(np.atleast_1d(lats), np.atleast_1d(lons)), m_to_chord(radius_m))
+        return [list(ids[h]) for h in hits]
+
+    def within(self, lat, lon, radius_m, category=None):
+        ids = np.array(self.within_many([lat], [lon], radius_m, category)[0], dtype=int)
+        dist = haversine_m(lat, lon, self.lats[ids], self.lons[ids])
+        order = np.argsort(dist)
+        return [self.record(i, d) for i, d in zip(ids[order], dist[order])]
+
+    def any_within(self, lats, lons, radius_m, category=None):
+        """(mask, nearest poi index) for a batch: is any POI within radius_m?"""
+        dist, idx = self.nearest_many(lats, lons, 1, category)
+        return dist[:, 0] <= radius_m, idx[:, 0]
+
+def load_pois(path=POI_FILE):
+    df = pd.read_csv(path)
+    return PoiIndex(df["name"], df["category"].str.lower(), df["lat"], df["lon"])
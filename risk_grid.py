@@ -0,0 +1,200 @@
+"""
+Precomputed spatio-temporal risk grid.
+
+`python risk_grid.py` runs the full predict pipeline over a lat/lon grid
+around the ward centroids for every weekday and hour, and writes the
+result as one memory-mappable file:
+
+    magic (8 bytes) | header length (uint32) | JSON header | padding
+    safety  uint8[7, 24, ny, nx]   (safety * 255, rounded)
+    crime   uint8[7, 24, ny, nx]   (index into header["crime_labels"])
+
+ml_engine answers /predict from this table when PREDICT_MODE=grid.
+"""
+import os
+import json
+import time
+import argparse
+import datetime
+import numpy as np
+
+MAGIC = b"SBRGRID1"
+ALIGN = 64
+
+RISK_GRID_FILE = "data/risk_grid.bin"
+WARD_FILE = "data/nagpur_ward_centroids.csv"
+RISK_MODEL_FILE = "models/risk_model.pkl"
+
+DEFAULT_STEP = 0.002    # degrees (~220 m)
+DEFAULT_MARGIN = 0.02   # degrees around the outermost ward centroids
+
+# Any Monday: day index 0..6 follows datetime.weekday()
+REFERENCE_MONDAY = datetime.datetime(2024, 1, 1)
+
+def _data_offset(header_len):
+    start = len(MAGIC) + 4 + header_len
+    return (start + ALIGN - 1) // ALIGN * ALIGN
+
+def _model_stamp():
+    try:
+        return os.path.getmtime(RISK_MODEL_FILE)
+    except OSError:
+        return None
+
+# --- 1. LOOKUP ---
+def load_risk_grid(path=RISK_GRID_FILE):
+    """Memory-map a grid file. Pages are shared between gunicorn workers."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a risk grid file")
+        header_len = int.from_bytes(f.read(4), "little")
+        header = json.loads(f.read(header_len))
+
+    shape = (7, 24, header["ny"], header["nx"])
+    offset = _data_offset(header_len)
+    size = int(np.prod(shape))
+    safety = np.memmap(path, dtype=np.uint8, mode="r", offset=offset, shape=shape)
+    crime = np.memmap(path, dtype=np.uint8, mode="r", offset=offset + size, shape=shape)
+
+    stamp = _model_stamp()
+    if stamp is not None and header.get("model_stamp") not in (None, stamp):
+        print("⚠️ Warning: risk grid was built from an older risk model.")
+
+    return {"header": header, "safety": safety, "crime": crime}
+
+def risk_grid_lookup(grid, lats, lons, when):
+    """
+    Bilinear safety and nearest-cell crime label for each point.
+    Returns (inside, safety, crime_labels); points outside the grid have
+    inside=False and must be scored by the live model.
+    """
+    h = grid["header"]
+    ny, nx = h["ny"], h["nx"]
+    fy = (np.asarray(lats, dtype=float) - h["lat_min"]) / h["lat_step"]
+    fx = (np.asarray(lons, dtype=float) - h["lon_min"]) / h["lon_step"]
+    inside = (fy >= 0) & (fy <= ny - 1) & (fx >= 0) & (fx <= nx - 1)
+
+    fy, fx = fy[inside], fx[inside]
+    y0 = np.minimum(fy.astype(int), ny - 2)
+    x0 = np.minimum(fx.astype(int), nx - 2)
+    ty = fy - y0
+    tx = fx - x0
+
+    layer = grid["safety"][when.weekday(), when.hour]
+    q = (layer[y0, x0] * (1 - ty) * (1 - tx) + layer[y0, x0 + 1] * (1 - ty) * tx +
+         layer[y0 + 1, x0] * ty * (1 - tx) + layer[y0 + 1, x0 + 1] * ty * tx)
+    safety = q / 255.0
+
+    crime_idx = grid["crime"][when.weekday(), when.hour][np.rint(fy).astype(int), np.rint(fx).astype(int)]
+    labels = h["crime_labels"]
+    crime_labels = [labels[c] for c in crime_idx]
+
+    return inside, safety, crime_labels
+
+# --- 2. OFFLINE BUILD ---
+def compare_to_live(grid, samples=2000, seed=0):
+    """Score random in-grid points both ways and summarise the difference."""
+    import ml_engine
+
+    h = grid["header"]
+    rng = np.random.default_rng(seed)
+    lats = h["lat_min"] + rng.uniform(0, (h["ny"] - 1) * h["lat_step"], samples)
+    lons = h["lon_min"] + rng.uniform(0, (h["nx"] - 1) * h["lon_step"], samples)
+    slots = rng.integers(0, 7 * 24, samples)
+
+    errors, same_label, same_crime = [], 0, 0
+    for t in np.unique(slots):
+        sel = slots == t
+        when = REFERENCE_MONDAY + datetime.timedelta(hours=int(t))
+        live = ml_engine.predict_many(lats[sel], lons[sel], when=when, mode="live", use_havens=False)
+        inside, safety, crimes = risk_grid_lookup(grid, lats[sel], lons[sel], when)
+        for (risk, crime, live_safety), grid_safety, grid_crime in zip(live, safety, crimes):
+            errors.append(abs(live_safety - grid_safety))
+            same_label += risk == ml_engine.get_risk_label(grid_safety)
+            same_crime += str(crime) == grid_crime
+
+    errors = np.array(errors)
+    return {
+        "samples": samples,
+        "safety_mae": round(float(errors.mean()), 5),
+        "safety_p95_error": round(float(np.percentile(errors, 95)), 5),
+        "safety_max_error": round(float(errors.max()), 5),
+        "risk_label_agreement": round(same_label / samples, 4),
+        "crime_label_agreement": round(same_crime / samples, 4),
+    }
+
+def build_risk_grid(out_file=RISK_GRID_FILE, step=DEFAULT_STEP, margin=DEFAULT_MARGIN, samples=2000):
+    import pandas as pd
+    import ml_engine
+
+    if not ml_engine.risk_artifact:
+        raise RuntimeError("Risk model not loaded; cannot build grid")
+
+    wards = pd.read_csv(WARD_FILE)
+    lat_min = float(wards["Latitude"].min()) - margin
+    lon_min = float(wards["Longitude"].min()) - margin
+    ny = int(np.ceil((wards["Latitude"].max() + margin - lat_min) / step)) + 1
+    nx = int(np.ceil((wards["Longitude"].max() + margin - lon_min) / step)) + 1
+
+    grid_lat, grid_lon = np.meshgrid(lat_min + step * np.arange(ny),
+                                     lon_min + step * np.arange(nx), indexing="ij")
+    grid_lat, grid_lon = grid_lat.ravel(), grid_lon.ravel()
+
+    print(f"Building risk grid: {ny} x {nx} cells x 7 days x 24 hours")
+    safety = np.zeros((7, 24, ny, nx), dtype=np.uint8)
+    crime = np.zeros((7, 24, ny, nx), dtype=np.uint8)
+    crime_index = {}
+
+    for day in range(7):
+        t0 = time.time()
+        for hour in range(24):
+            when = REFERENCE_MONDAY + datetime.timedelta(days=day, hours=hour)
+            # Havens are checked live before the grid, so leave them out here
+            results = ml_engine.predict_many(grid_lat, grid_lon, when=when, mode="live", use_havens=False)
+            scores = np.array([r[2] for r in results])
+            safety[day, hour] = np.rint(scores * 255).reshape(ny, nx)
+            crime[day, hour] = np.array(
+                [crime_index.setdefault(str(r[1]), len(crime_index)) for r in results]
+            ).reshape(ny, nx)
+        print(f"  {when.strftime('%A')}: {time.time() - t0:.1f}s")
+
+    if len(crime_index) > 256:
+        raise RuntimeError("Too many crime labels for a uint8 index")
+
+    header = {
+        "lat_min": lat_min, "lon_min": lon_min,
+        "lat_step": step, "lon_step": step,
+        "ny": ny, "nx": nx,
+        "crime_labels": sorted(crime_index, key=crime_index.get),
+        "model_stamp": _model_stamp(),
+        "built_at": datetime.datetime.now().isoformat(timespec="seconds"),
+    }
+
+    accuracy = compare_to_live({"header": header, "safety": safety, "crime": crime}, samples)
+    header["accuracy"] = accuracy
+    print("Accuracy vs live model:")
+    for key, value in accuracy.items():
+        print(f"  {key}: {value}")
+
+    # Write to a temp file and swap, so running workers keep their mapping
+    header_bytes = json.dumps(header).encode()
+    tmp_file = out_file + ".tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(header_bytes).to_bytes(4, "little"))
+        f.write(header_bytes)
+        f.write(b"\0" * (_data_offset(len(header_bytes)) - f.tell()))
+        f.write(safety.tobytes())
+        f.write(crime.tobytes())
+    os.replace(tmp_file, out_file)
+    print(f"✅ Risk grid written to {out_file} ({os.path.getsize(out_file) / 1e6:.1f} MB)")
+    return header
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the precomputed risk grid")
+    parser.add_argument("--out", default=RISK_GRID_FILE)
+    parser.add_argument("--step", type=float, default=DEFAULT_STEP, help="cell size in degrees")
+    parser.add_argument("--margin", type=float, default=DEFAULT_MARGIN, help="padding around wards in degrees")
+    parser.add_argument("--samples", type=int, default=2000, help="points used for the accuracy report")
+    args = parser.parse_args()
+    build_risk_grid(args.out, args.step, args.margin, args.samples)
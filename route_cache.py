@@ -0,0 +1,135 @@
+"""
+In-process LRU/TTL cache for route results.
+
+Entries are keyed by the caller (routing uses the snapped node pair and
+time slot) plus a version stamp, so a new graph or model makes every
+old entry unreachable. Memory use is bounded by the JSON size of the
+cached values. An optional SQLite file shared by all gunicorn workers
+acts as a second level, so one worker's result warms the others.
+"""
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+class RouteCache:
+    def __init__(self, max_bytes=32 * 1024 * 1024, ttl_s=3600, store_path=None, version=""):
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self.version = version
+        self.entries = OrderedDict()   # key -> (value, size, stored_at)
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "store_hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+        self.store_path = store_path
+        self.db = None
+        if store_path:
+            self._open_store()
+
+    def _open_store(self):
+        self.db = sqlite3.connect(self.store_path, timeout=1.0, check_same_thread=False,
+                                  isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS routes ("
+            "key TEXT PRIMARY KEY, version TEXT, value TEXT, stored_at REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS routes_stored_at ON routes (stored_at)")
+
+    def reopen(self):
+        """After a fork: fresh lock and store connection, cached entries kept."""
+        self.lock = threading.Lock()
+        if self.store_path:
+            self._open_store()
+
+    def set_version(self, version):
+        """
+        New graph/model stamp: drop this worker's entries. Shared-store rows
+        of other versions are left to age out, since during a deploy old
+        and new workers both still write to the store.
+        """
+        with self.lock:
+            if version == self.version:
+                return
+            self.version = version
+            self.entries.clear()
+            self.bytes = 0
+
+    def _full_key(self, key):
+        return json.dumps([self.version] + list(key))
+
+    def get(self, key):
+        full_key = self._full_key(key)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(full_key)
+            if entry is not None:
+                if now - entry[2] <= self.ttl_s:
+                    self.entries.move_to_end(full_key)
+                    self.counters["hits"] += 1
+                    return entry[0]
+                self._remove(full_key)
+                self.counters["expired"] += 1
+
+            if self.db is not None:
+                row = self._db_execute(
+                    "SELECT value, stored_at FROM routes WHERE key = ? AND version = ?",
+                    (full_key, self.version)).fetchone()
+                if row is not None and now - row[1] <= self.ttl_s:
+                    value = json.loads(row[0])
+                    self._insert(full_key, value, len(row[0]), row[1])
+                    self.counters["store_hits"] += 1
+                    return value
+
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, key, value):
+        full_key = self._full_key(key)
+        encoded = json.dumps(value)
+        now = time.time()
+        with self.lock:
+            self._insert(full_key, value, len(encoded), now)
+            if self.db is not None:
+                self._db_execute(
+                    "INSERT OR REPLACE INTO routes (key, version, value, stored_at) VALUES (?, ?, ?, ?)",
+                    (full_key, self.version, encoded, now))
+                self._db_execute("DELETE FROM routes WHERE stored_at < ?", (now - self.ttl_s,))
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, entries=len(self.entries), bytes=self.bytes,
+                        max_bytes=self.max_bytes, version=self.version)
+
+    # --- internals (caller holds the lock) ---
+    def _insert(self, full_key, value, size, stored_at):
+        if size > self.max_bytes:
+            return
+        if full_key in self.entries:
+            self._remove(full_key)
+        self.entries[full_key] = (value, size, stored_at)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            oldest = next(iter(self.entries))
+            self._remove(oldest)
+            self.counters["evictions"] += 1
+
+    def _remove(self, full_key):
+        value, size, _ = self.entries.pop(full_key)
+        self.bytes -= size
+
+    def _db_execute(self, sql, params):
+        # The shared store is an optimisation; never fail a route over it
+        try:
+            return self.db.execute(sql, params)
+        except sqlite3.Error as e:
+            print(f"Route cache store error: {e}")
+            return _EMPTY_CURSOR
+
+class _EmptyCursor:
+    def fetchone(self):
+        return None
+
+_EMPTY_CURSOR = _EmptyCursor()
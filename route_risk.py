@@ -0,0 +1,96 @@
+"""
+Risk profile of a route polyline.
+
+The line is resampled every spacing_m metres along its length and every
+sample (the midpoint of its stretch) is scored with
+ml_engine.predict_many, so a whole route, or several routes at once,
+costs one KD-tree query and one model call however many vertices it
+has. The profile reports runs of equal risk along the route, the
+distance-weighted mean risk, the point of maximum exposure, and the
+distance and time spent in "High"/"Critical" zones.
+"""
+import numpy as np
+
+from geo import haversine_m
+from ml_engine import predict_many
+
+DEFAULT_SPACING_M = 50.0
+WALKING_SPEED_MPS = 1.4
+DANGER_LABELS = ("High", "Critical")
+
+def resample(coords, spacing_m=DEFAULT_SPACING_M):
+    """
+    Cut the line into stretches of spacing_m (the last one shorter).
+    Returns (mid_lats, mid_lons, start_m, length_m) per stretch.
+    """
+    pts = np.asarray(coords, dtype=float).reshape(-1, 2)
+    if len(pts) < 2:
+        return np.empty(0), np.empty(0), np.empty(0), np.empty(0)
+    along = np.concatenate([[0.0], np.cumsum(haversine_m(pts[:-1, 0], pts[:-1, 1], pts[1:, 0], pts[1:, 1]))])
+    total = along[-1]
+    if total <= 0:
+        return np.empty(0), np.empty(0), np.empty(0), np.empty(0)
+
+    edges = np.append(np.arange(0.0, total, spacing_m), total)
+    start, length = edges[:-1], np.diff(edges)
+    mid = start + length / 2
+    # Linear interpolation in degrees is fine at this spacing
+    return np.interp(mid, along, pts[:, 0]), np.interp(mid, along, pts[:, 1]), start, length
+
+def _profile(results, lats, lons, start, length, speed_mps):
+    labels = [r[0] for r in results]
+    safety = np.array([r[2] for r in results], dtype=float)
+    risk = 1.0 - safety
+    total = float(length.sum())
+
+    # Runs of equal risk label
+    segments = []
+    run = 0
+    for i in range(1, len(labels) + 1):
+        if i == len(labels) or labels[i] != labels[run]:
+            segments.append({
+                "from_m": round(float(start[run]), 1),
+                "to_m": round(float(start[i - 1] + length[i - 1]), 1),
+                "risk": labels[run],
+                "mean_safety": round(float(np.average(safety[run:i], weights=length[run:i])), 4),
+                "crime": results[run][1],
+            })
+            run = i
+
+    worst = int(np.argmax(risk))
+    danger = np.isin(labels, DANGER_LABELS)
+    danger_m = float(length[danger].sum())
+    return {
+        "distance_m": round(total, 1),
+        "samples": len(labels),
+        "mean_risk": round(float(np.average(risk, weights=length)), 4),
+        "max_exposure": {
+            "risk": round(float(risk[worst]), 4),
+            "label": labels[worst],
+            "at_m": round(float(start[worst] + length[worst] / 2), 1),
+            "lat": round(float(lats[worst]), 6),
+            "lon": round(float(lons[worst]), 6),
+        },
+        "danger_distance_m": round(danger_m, 1),
+        "danger_time_s": round(danger_m / speed_mps, 1),
+        "danger_share": round(danger_m / total, 4),
+        "segments": segments,
+    }
+
+def score_routes(routes, spacing_m=DEFAULT_SPACING_M, when=None, speed_mps=WALKING_SPEED_MPS):
+    """Profile several polylines with a single predict_many call. Returns one profile (or None) per route."""
+    sampled = [resample(coords, spacing_m) for coords in routes]
+    lats = np.concatenate([s[0] for s in sampled]) if sampled else np.empty(0)
+    lons = np.concatenate([s[1] for s in sampled]) if sampled else np.empty(0)
+    results = predict_many(lats, lons, when=when)
+
+    profiles = []
+    offset = 0
+    for s_lats, s_lons, start, length in sampled:
+        n = len(s_lats)
+        profiles.append(_profile(results[offset:offset + n], s_lats, s_lons, start, length, speed_mps) if n else None)
+        offset += n
+    return profiles
+
+def score_route(coords, spacing_m=DEFAULT_SPACING_M, when=None, speed_mps=WALKING_SPEED_MPS):
+    return score_routes([coords], spacing_m, when, speed_mps)[0]
@@ -1,29 +1,253 @@
 import os
+import time
+import datetime
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 import networkx as nx
+import numpy as np
 import osmnx as ox
+from scipy.spatial import cKDTree
 from dotenv import load_dotenv
+import graph_snapshot
+import path_engine
+import edge_risk
+from geo import to_unit_xyz, chord_to_m
+from ml_engine import get_timeslot
+from route_cache import RouteCache
+import metrics
 
 load_dotenv()
 GH_API_KEY = os.getenv("GH_API_KEY")
+GH_API_URL = os.getenv("GH_API_URL", "https://graphhopper.com/api/1/route")
+GH_TIMEOUT_S = float(os.getenv("GH_TIMEOUT_S", "10"))
 GRAPH_FILE = "data/nagpur_graph.graphml"
+SNAPSHOT_DIR = os.getenv("GRAPH_SNAPSHOT_DIR", graph_snapshot.SNAPSHOT_DIR)
+
+# "snapshot" maps the arrays written by `python graph_snapshot.py`;
+# "networkx" parses the GraphML (reference backend)
+ROUTING_BACKEND = os.getenv("ROUTING_BACKEND", "networkx")
+
+# Search engine for the snapshot backend: "dijkstra", "astar" or "ch"
+# ("ch" needs `python path_engine.py build-ch`, else falls back to astar)
+ROUTE_ENGINE = os.getenv("ROUTE_ENGINE", "dijkstra")
+
+# Use the per-slot weights from `python edge_risk.py` when they exist, so
+# the safe route follows the risk at the requested departure time
+TIME_DEPENDENT_WEIGHTS = os.getenv("TIME_DEPENDENT_WEIGHTS", "1") == "1"
+
+# Fast (Blue Line) route: "graphhopper" falls back to the local graph when
+# GraphHopper fails or is too slow, "local" never calls GraphHopper
+FAST_ROUTE_BACKEND = os.getenv("FAST_ROUTE_BACKEND", "graphhopper")
+FAST_ROUTE_WEIGHT = os.getenv("FAST_ROUTE_WEIGHT", "length")  # or "travel_time"
+
+# /route computes both routes concurrently within one budget; GraphHopper
+# calls run on their own bounded pool so a slow GraphHopper cannot hold
+# the workers the safe route and the local fallback need
+ROUTE_WORKERS = int(os.getenv("ROUTE_WORKERS", "4"))
+GH_WORKERS = int(os.getenv("GH_WORKERS", "4"))
+ROUTE_BUDGET_S = float(os.getenv("ROUTE_BUDGET_S", "8"))
+
+# Route results are cached per snapped (orig, dest) node pair and time slot
+ROUTE_CACHE_MAX_BYTES = int(os.getenv("ROUTE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+ROUTE_CACHE_TTL_S = float(os.getenv("ROUTE_CACHE_TTL_S", "3600"))
+ROUTE_CACHE_DB = os.getenv("ROUTE_CACHE_DB")  # e.g. /tmp/safebag_routes.sqlite, shared by workers
+RISK_MODEL_FILE = "models/risk_model.pkl"
+
+# Reject start/end points further than this from any road node (0 = off)
+MAX_SNAP_DISTANCE_M = float(os.getenv("MAX_SNAP_DISTANCE_M", "0"))
 
 # Global cache
 G_latlon = None
 Gp = None
+snapshot = None
+astar_engines = {}   # weight name -> bidirectional A* over the mapped weights
+ch_engines = {}      # weight name -> contraction hierarchy (None if not built)
+risk_weights = {}    # time bucket ("Night" or "Monday_Night") -> weight name
+node_tree = None
+node_keys = None
+edge_geom_index = None   # (u, v) -> (start, end) rows of edge_geom_coords
+edge_geom_coords = None
+snapshot_failed = False   # no usable snapshot: GraphML for the rest of this process
+cache_stamped_for = None   # graph the route cache version was computed for
+graph_lock = threading.Lock()
+route_executor = ThreadPoolExecutor(max_workers=ROUTE_WORKERS, thread_name_prefix="route")
+graphhopper_executor = ThreadPoolExecutor(max_workers=GH_WORKERS, thread_name_prefix="graphhopper")
+route_cache = RouteCache(ROUTE_CACHE_MAX_BYTES, ROUTE_CACHE_TTL_S, ROUTE_CACHE_DB)
+
+def _after_fork():
+    # Preloaded graph and indexes stay shared; threads and locks are per process
+    global graph_lock, route_executor, graphhopper_executor
+    graph_lock = threading.Lock()
+    route_executor = ThreadPoolExecutor(max_workers=ROUTE_WORKERS, thread_name_prefix="route")
+    graphhopper_executor = ThreadPoolExecutor(max_workers=GH_WORKERS, thread_name_prefix="graphhopper")
+    route_cache.reopen()
+
+os.register_at_fork(after_in_child=_after_fork)
+
+def load_snapshot_if_needed():
+    global snapshot, risk_weights, snapshot_failed
+    if snapshot is not None:
+        return True
+    if snapshot_failed:
+        return False
+    if not os.path.exists(os.path.join(SNAPSHOT_DIR, "meta.json")):
+        print(f"Graph snapshot not found at: {SNAPSHOT_DIR}, falling back to GraphML")
+        snapshot_failed = True
+        return False
+    try:
+        snapshot = graph_snapshot.load_snapshot(SNAPSHOT_DIR)
+        build_node_index(snapshot["node_lat"], snapshot["node_lon"],
+                         np.arange(len(snapshot["node_ids"])))
+        if TIME_DEPENDENT_WEIGHTS:
+            risk_weights = edge_risk.load_edge_weights(snapshot, SNAPSHOT_DIR)
+            if risk_weights:
+                print(f"Time-dependent weights loaded: {', '.join(sorted(risk_weights))}")
+        print("Graph snapshot mapped successfully.")
+        load_engines(ROUTE_ENGINE)
+        return True
+    except Exception as e:
+        print(f"CRITICAL SNAPSHOT ERROR: {e}")
+        snapshot = None
+        snapshot_failed = True
+        return False
+
+def load_engines(engine):
+    """
+    Search structures for every weight, once per graph load (the caller
+    holds graph_lock). They index the mapped arrays, so the static and
+    all time-dependent weights share one reverse adjacency and no copies.
+    """
+    if engine not in ("astar", "ch"):
+        return
+    topology = path_engine.build_topology(snapshot)
+    for weight in ["safety_weight"] + sorted(set(risk_weights.values())):
+        if engine == "ch":
+            ch_engines[weight] = path_engine.load_ch(SNAPSHOT_DIR, weight)
+            if ch_engines[weight] is None:
+                print(f"Contraction hierarchy for {weight} not built, using astar")
+        astar_engines[weight] = path_engine.build_astar(snapshot, snapshot[weight], topology)
+
+def snapshot_path(orig, dest, engine=None, weight="safety_weight"):
+    """Node indices of the lowest-weight path, or None if unreachable."""
+    engine = engine or ROUTE_ENGINE
+    if engine == "ch" and ch_engines.get(weight) is not None:
+        return path_engine.ch_path(ch_engines[weight], orig, dest)[0]
+    if engine in ("astar", "ch") and weight in astar_engines:
+        return path_engine.astar_path(astar_engines[weight], orig, dest)[0]
+    return graph_snapshot.shortest_path(snapshot, orig, dest, weight=weight)
+
+def time_bucket(when=None):
+    """Departure-time bucket used for weights and cache keys."""
+    when = when or datetime.datetime.now()
+    per_day = edge_risk.weight_key(when, per_day=True)
+    return per_day if per_day in risk_weights else get_timeslot(when.hour)
+
+def safety_weight_for(when=None):
+    """Weight array for a departure time: the slot's risk weights, else static."""
+    return risk_weights.get(time_bucket(when), "safety_weight")
+
+def build_node_index(lats, lons, keys):
+    """KD-tree over node unit vectors, built once when the graph loads."""
+    global node_tree, node_keys
+    node_tree = cKDTree(to_unit_xyz(lats, lons))
+    node_keys = keys
+
+def build_edge_geometry():
+    """
+    Flatten the coordinates each edge contributes to a route into one
+    array, so routes are assembled by slicing instead of walking shapely
+    geometries. Like the original loop, the first edge (key 0) of a pair
+    supplies the geometry.
+    """
+    global edge_geom_index, edge_geom_coords
+    index, chunks, offset = {}, [], 0
+    for u, v, key, data in G_latlon.edges(keys=True, data=True):
+        if key != 0:
+            continue
+        if "geometry" in data:
+            # .coords returns list of (lon, lat) tuples
+            chunk = [(lat, lon) for lon, lat in data["geometry"].coords]
+        else:
+            # Straight road segment: just the start node
+            chunk = [(G_latlon.nodes[u]["y"], G_latlon.nodes[u]["x"])]
+        index[(u, v)] = (offset, offset + len(chunk))
+        chunks.append(chunk)
+        offset += len(chunk)
+    edge_geom_coords = np.array([c for chunk in chunks for c in chunk], dtype=np.float64).reshape(-1, 2)
+    edge_geom_index = index
+
+def snap_points(lats, lons):
+    """
+    Nearest graph node (great-circle) for each point in one vectorized
+    query. Returns (node keys, distances in metres).
+    """
+    chord, idx = node_tree.query(to_unit_xyz(lats, lons))
+    return node_keys[idx], chord_to_m(chord)
+
+def snap_pairs(pairs):
+    """
+    Snap many (start_lat, start_lon, end_lat, end_lon) pairs at once.
+    Returns (orig keys, dest keys, orig distances, dest distances).
+    """
+    pairs = np.asarray(pairs, dtype=float).reshape(-1, 4)
+    keys, dist = snap_points(np.concatenate([pairs[:, 0], pairs[:, 2]]),
+                             np.concatenate([pairs[:, 1], pairs[:, 3]]))
+    n = len(pairs)
+    return keys[:n], keys[n:], dist[:n], dist[n:]
+
+def snap_route_ends(start_lat, start_lon, end_lat, end_lon):
+    """(orig, dest) node keys, or None if either end is too far off the road network."""
+    keys, dist = snap_points([start_lat, end_lat], [start_lon, end_lon])
+    if MAX_SNAP_DISTANCE_M > 0 and dist.max() > MAX_SNAP_DISTANCE_M:
+        print(f"Snap Error: point {dist.max():.0f} m from the road network "
+              f"(limit {MAX_SNAP_DISTANCE_M:.0f} m)")
+        return None
+    return keys[0].item(), keys[1].item()
 
 def load_graph_if_needed():
+    global cache_stamped_for
+    # Both routes may ask for the graph at once from the route executor
+    with graph_lock:
+        _load_graph()
+        graph = snapshot if snapshot is not None else G_latlon
+        # Stamp the cache once per loaded graph, not on every route
+        if graph is not None and graph is not cache_stamped_for:
+            route_cache.set_version(data_version())
+            cache_stamped_for = graph
+
+def data_version():
+    """Stamp of the graph, risk model and edge weights the cached routes were built from."""
+    if snapshot is not None:
+        graph = snapshot["meta"]["built_at"]
+    else:
+        graph = os.path.getmtime(GRAPH_FILE)
+    model = os.path.getmtime(RISK_MODEL_FILE) if os.path.exists(RISK_MODEL_FILE) else None
+    weights_manifest = os.path.join(SNAPSHOT_DIR, edge_risk.WEIGHTS_SUBDIR, "manifest.json")
+    weights = os.path.getmtime(weights_manifest) if risk_weights and os.path.exists(weights_manifest) else None
+    return f"{graph}|{model}|{weights}"
+
+def route_cache_key(kind, orig, dest, when=None):
+    return (kind, orig, dest, time_bucket(when))
+
+def _load_graph():
     global G_latlon, Gp
+    if ROUTING_BACKEND == "snapshot" and load_snapshot_if_needed():
+        return
     if G_latlon is not None: 
         return
 
     print("Loading GraphML... this may take a moment.")
     if os.path.exists(GRAPH_FILE):
         try:
-            # Load the graph
-            Gp = ox.load_graphml(GRAPH_FILE)
+            # Load the graph (GraphML stores custom attributes as strings)
+            Gp = ox.load_graphml(GRAPH_FILE, edge_dtypes={"safety_weight": float})
             # Project to Lat/Lon (EPSG:4326) so coordinates are correct for the map
             G_latlon = ox.project_graph(Gp, to_crs="EPSG:4326")
+            nodes = list(G_latlon.nodes(data=True))
+            build_node_index([d["y"] for _, d in nodes], [d["x"] for _, d in nodes],
+                             np.array([n for n, _ in nodes]))
+            build_edge_geometry()
             print("Graph loaded successfully.")
         except Exception as e:
             print(f"CRITICAL GRAPH ERROR: {e}")
@@ -32,10 +256,53 @@ def load_graph_if_needed():
     else:
         print(f"Graph file not found at: {GRAPH_FILE}")
 
-def get_fast_route(start_lat, start_lon, end_lat, end_lon):
-    """Get Shortest Path via GraphHopper (Blue Line)"""
+def get_fast_route(start_lat, start_lon, end_lat, end_lon, timeout=None, when=None, fallback=True):
+    """
+    Get Shortest Path via GraphHopper, or the local graph as fallback
+    (Blue Line). With fallback=False a GraphHopper failure returns [].
+    """
+    with metrics.span("route_stage_seconds", route="fast", stage="load_graph"):
+        load_graph_if_needed()
+    key = None
+    if node_tree is not None:
+        with metrics.span("route_stage_seconds", route="fast", stage="snap"):
+            ends = snap_route_ends(start_lat, start_lon, end_lat, end_lon)
+        if ends is None:
+            return []
+        key = route_cache_key("fast", *ends, when=when)
+        cached = route_cache.get(key)
+        if cached is not None:
+            return cached
+
+    if FAST_ROUTE_BACKEND == "local":
+        coords = get_local_fast_route(start_lat, start_lon, end_lat, end_lon)
+    else:
+        with metrics.span("route_stage_seconds", route="fast", stage="graphhopper"):
+            coords = get_graphhopper_route(start_lat, start_lon, end_lat, end_lon, timeout)
+        if coords:
+            if key is not None:
+                route_cache.put(key, coords)
+            return coords
+        if not fallback:
+            return []
+        print("GraphHopper unavailable, using local fast route")
+        return get_local_fast_fallback(start_lat, start_lon, end_lat, end_lon)
+
+    if coords and key is not None:
+        route_cache.put(key, coords)
+    return coords
+
+def get_local_fast_fallback(start_lat, start_lon, end_lat, end_lon):
+    """
+    The local fast route standing in for GraphHopper. Not cached under the
+    fast key, so GraphHopper is asked again as soon as it recovers.
+    """
+    metrics.inc("graphhopper_fallbacks")
+    return get_local_fast_route(start_lat, start_lon, end_lat, end_lon)
+
+def get_graphhopper_route(start_lat, start_lon, end_lat, end_lon, timeout=None):
+    """Get Shortest Path via GraphHopper"""
     try:
-        url = "https://graphhopper.com/api/1/route"
         params = [
             ("point", f"{start_lat},{start_lon}"),
             ("point", f"{end_lat},{end_lon}"),
@@ -44,7 +311,7 @@ def get_fast_route(start_lat, start_lon, end_lat, end_lon):
             ("key", GH_API_KEY)
         ]
         # Short timeout to prevent backend hanging
-        resp = requests.get(url, params=params, timeout=10)
+        resp = requests.get(GH_API_URL, params=params, timeout=timeout or GH_TIMEOUT_S)
         
         if resp.status_code == 200:
             data = resp.json()
@@ -56,46 +323,131 @@ def get_fast_route(start_lat, start_lon, end_lat, end_lon):
         print(f"GraphHopper Error: {e}")
     return []
 
-def get_safe_route(start_lat, start_lon, end_lat, end_lon):
-    """Get Safest Path via NetworkX (Green Line)"""
+def get_local_fast_route(start_lat, start_lon, end_lat, end_lon):
+    """Get Shortest Path by length (or travel time) on the loaded Nagpur graph"""
     load_graph_if_needed()
+    if snapshot is None and (Gp is None or G_latlon is None):
+        return []
+
+    try:
+        ends = snap_route_ends(start_lat, start_lon, end_lat, end_lon)
+        if ends is None:
+            return []
+        orig, dest = ends
+
+        if snapshot is not None:
+            with metrics.span("route_stage_seconds", route="fast", stage="path"):
+                route_nodes = graph_snapshot.shortest_path(snapshot, orig, dest, weight=FAST_ROUTE_WEIGHT)
+            if route_nodes is None:
+                return []
+            with metrics.span("route_stage_seconds", route="fast", stage="geometry"):
+                return graph_snapshot.path_coords(snapshot, route_nodes)
+
+        with metrics.span("route_stage_seconds", route="fast", stage="path"):
+            route_nodes = nx.shortest_path(Gp, orig, dest, weight=FAST_ROUTE_WEIGHT)
+        with metrics.span("route_stage_seconds", route="fast", stage="geometry"):
+            return route_coords_networkx(route_nodes)
+
+    except Exception as e:
+        print(f"Local Fast Route Error: {e}")
+        return []
+
+def _result_by(future, deadline, label):
+    """The future's result, or [] if it is not done by the deadline (time.monotonic())."""
+    try:
+        return future.result(timeout=max(deadline - time.monotonic(), 0))
+    except FutureTimeout:
+        print(f"{label} over the route budget")
+        return []
+
+def get_dual_routes(start_lat, start_lon, end_lat, end_lon, budget=None, when=None):
+    """
+    Compute the fast and safe routes concurrently, both within one
+    `budget` seconds. GraphHopper gets the first half of it on its own
+    pool; if it has no route by then, the local fast route runs on the
+    route executor against what is left. A route that misses the
+    deadline comes back empty. `when` is the departure time (default: now).
+    """
+    budget = budget or ROUTE_BUDGET_S
+    deadline = time.monotonic() + budget
+    args = (start_lat, start_lon, end_lat, end_lon)
+    safe_future = route_executor.submit(get_safe_route, *args, when=when)
+
+    if FAST_ROUTE_BACKEND == "local":
+        fast = _result_by(route_executor.submit(get_fast_route, *args, when=when), deadline, "Fast route")
+    else:
+        gh_deadline = deadline - budget / 2
+        fast_future = graphhopper_executor.submit(get_fast_route, *args, timeout=budget / 2, when=when,
+                                                  fallback=False)
+        fast = _result_by(fast_future, gh_deadline, "GraphHopper")
+        if not fast:
+            # Still queued behind slow GraphHopper calls: never start it
+            fast_future.cancel()
+            print("GraphHopper unavailable, using local fast route")
+            fast = _result_by(route_executor.submit(get_local_fast_fallback, *args), deadline, "Local fast route")
+
+    safe = _result_by(safe_future, deadline, "Safe route")
+    return fast, safe
+
+def get_safe_route(start_lat, start_lon, end_lat, end_lon, when=None):
+    """Get Safest Path via NetworkX (Green Line) for a departure time (default: now)"""
+    with metrics.span("route_stage_seconds", route="safe", stage="load_graph"):
+        load_graph_if_needed()
     
     # If graph failed to load (e.g. Memory Error on Render), return empty
-    if Gp is None or G_latlon is None:
+    if snapshot is None and (Gp is None or G_latlon is None):
         return []
 
     try:
         # 1. Find the nearest graph nodes to the user's start/end points
-        orig = ox.distance.nearest_nodes(G_latlon, X=start_lon, Y=start_lat)
-        dest = ox.distance.nearest_nodes(G_latlon, X=end_lon, Y=end_lat)
+        with metrics.span("route_stage_seconds", route="safe", stage="snap"):
+            ends = snap_route_ends(start_lat, start_lon, end_lat, end_lon)
+        if ends is None:
+            return []
+        orig, dest = ends
 
-        # 2. Calculate the path of Node IDs based on 'safety_weight'
-        route_nodes = nx.shortest_path(Gp, orig, dest, weight="safety_weight")
+        key = route_cache_key("safe", orig, dest, when)
+        coords = route_cache.get(key)
+        if coords is not None:
+            return coords
 
-        # 3. Extract the REAL curved road geometry
-        coords = []
-        
-        # Iterate through pairs of nodes (u, v) in the path
-        for u, v in zip(route_nodes[:-1], route_nodes[1:]):
-            # Get edge data. [0] gets the first edge between these nodes
-            edge_data = G_latlon.get_edge_data(u, v)[0]
-            
-            if "geometry" in edge_data:
-                # If the road has detailed curve data, use it
-                # .coords returns list of (lon, lat) tuples
-                for lon, lat in edge_data["geometry"].coords:
-                    coords.append([lat, lon])
-            else:
-                # If straight road segment, just use the node coordinates
-                node_u = G_latlon.nodes[u]
-                coords.append([node_u['y'], node_u['x']])
-
-        # Append the coordinate of the final node to close the loop
-        last_node = G_latlon.nodes[route_nodes[-1]]
-        coords.append([last_node['y'], last_node['x']])
-        
+        if snapshot is not None:
+            coords = get_safe_route_snapshot(orig, dest, safety_weight_for(when))
+        else:
+            # 2. Calculate the path of Node IDs based on 'safety_weight'
+            with metrics.span("route_stage_seconds", route="safe", stage="path"):
+                route_nodes = nx.shortest_path(Gp, orig, dest, weight="safety_weight")
+
+            # 3. Extract the REAL curved road geometry
+            with metrics.span("route_stage_seconds", route="safe", stage="geometry"):
+                coords = route_coords_networkx(route_nodes)
+
+        if coords:
+            route_cache.put(key, coords)
         return coords
 
     except Exception as e:
         print(f"Safe Route Error: {e}")
         return []
+
+def route_coords_networkx(route_nodes):
+    """[[lat, lon], ...] for a node path: every edge's curve, then the final node"""
+    parts = []
+    for u, v in zip(route_nodes[:-1], route_nodes[1:]):
+        start, end = edge_geom_index[(u, v)]
+        parts.append(edge_geom_coords[start:end])
+
+    # Append the coordinate of the final node to close the loop
+    last_node = G_latlon.nodes[route_nodes[-1]]
+    parts.append(np.array([[last_node['y'], last_node['x']]]))
+    return np.concatenate(parts).tolist()
+
+def get_safe_route_snapshot(orig, dest, weight="safety_weight"):
+    """Get Safest Path between snapped nodes of the graph snapshot (Green Line)"""
+    with metrics.span("route_stage_seconds", route="safe", stage="path"):
+        route_nodes = snapshot_path(orig, dest, weight=weight)
+    if route_nodes is None:
+        print("Safe Route Error: no path between the snapped nodes")
+        return []
+    with metrics.span("route_stage_seconds", route="safe", stage="geometry"):
+        return graph_snapshot.path_coords(snapshot, route_nodes)
@@ -1,44 +1,581 @@
+"""
+Load generator: simulated handbags and phones against a local Firebase.
+
+    python simulator.py [--devices 50,100,200] [--duration 60] [--workers 1]
+        [--rate 0.5] [--sos-per-min 6] [--burst 5] [--poll-s 5] [--json]
+
+Starts fake_firebase.py, the app under gunicorn and firebase_sos_listener.py
+as separate processes, with a throwaway outbox, listener checkpoint and
+event history, and ALERT_PROVIDER=fake so nothing is really sent. Then
+for each device count in turn it runs that many devices for --duration
+seconds:
+
+- each bag walks shortest routes between random road graph nodes and,
+  --rate times a second, PUTs latest_events/<id> and pushes to events;
+- SOS bursts start --sos-per-min times a minute across the fleet: the
+  phone POSTs /sos and the bag sends --burst USER_SOS events;
+- every --poll-s seconds each phone asks the app for its location
+  (/locations?ids=) and the risk where it stands (/predict).
+
+For each stage it reports:
+- the event rate achieved against the target;
+- latency and error rate per request type;
+- alert latency from the device timestamp to delivery in the outbox
+  journal, split at the point where the listener or /sos journaled it.
+  Alerts folded into an open burst are counted as coalesced and left
+  out of the latency: they reach no contact until the burst's
+  escalation does.
+
+A stage is sustained when all of these hold:
+- the achieved rate is within 5% of the target;
+- every error rate is under 1%;
+- every alert was delivered or coalesced;
+- the p95s are under --slo-http-ms and --slo-alert-s.
+
+The largest sustained count divided by --workers is what one worker
+carries. If send lag is high while the request latencies stay low, the
+generator is the bottleneck: give it more --threads.
+Run from a directory with models/ and data/ (or point --cwd at one).
+By default it uses the synthetic fixtures from benchmarks/fixtures.py.
+"""
+import os
+import sys
+import json
 import time
-import random
+import uuid
+import heapq
+import shutil
+import socket
+import sqlite3
+import argparse
+import tempfile
+import threading
+import subprocess
+import numpy as np
 import requests
 
-FIREBASE_URL = "https://smart-safety-handbag-default-rtdb.asia-southeast1.firebasedatabase.app"
-DEVICE_ID = "handbag_001"
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+EARTH_M_PER_DEG = 111_320
+SOS_EVENT = "USER_SOS"
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def percentile_ms(values, q):
+    return round(float(np.percentile(values, q)) * 1000, 1) if values else None
+
+def percentile_s(values, q):
+    return round(float(np.percentile(values, q)), 2) if values else None
+
+# --- 1. DEVICES ON THE ROAD GRAPH ---
+class RoadGraph:
+    """The routing graph in lat/lon, with shortest-length routes between its nodes."""
+    def __init__(self, graph_file, rng):
+        import osmnx as ox
+
+        self.G = ox.project_graph(ox.load_graphml(graph_file), to_crs="EPSG:4326")
+        self.nodes = list(self.G.nodes)
+        self.index = {node: i for i, node in enumerate(self.nodes)}
+        self.lat = np.array([self.G.nodes[n]["y"] for n in self.nodes])
+        self.lon = np.array([self.G.nodes[n]["x"] for n in self.nodes])
+        self.rng = rng
+        self.lock = threading.Lock()
+
+    def route(self, start, trip_m):
+        """Node indices from `start` to a random node up to trip_m away (at least a third of that)."""
+        import networkx as nx
+
+        dy = (self.lat - self.lat[start]) * EARTH_M_PER_DEG
+        dx = (self.lon - self.lon[start]) * EARTH_M_PER_DEG * np.cos(np.radians(self.lat[start]))
+        dist = np.hypot(dx, dy)
+        candidates = np.flatnonzero((dist > trip_m / 3) & (dist < trip_m))
+        if not len(candidates):
+            candidates = np.flatnonzero(dist > 0)
+        with self.lock:
+            ends = self.rng.choice(candidates, size=min(5, len(candidates)), replace=False).tolist()
+        for end in ends:
+            try:
+                path = nx.shortest_path(self.G, self.nodes[start], self.nodes[end], weight="length")
+            except nx.NetworkXNoPath:
+                continue
+            return np.array([self.index[node] for node in path])
+        return np.array([start])
+
+class Device:
+    """One handbag walking route after route, its position a function of time."""
+    def __init__(self, device_id, graph, node, speed_mps, trip_m):
+        self.device_id = device_id
+        self.graph = graph
+        self.speed_mps = speed_mps
+        self.trip_m = trip_m
+        self.lock = threading.Lock()
+        self.walked_at = time.monotonic()
+        self._start_route(node)
+        self.lat, self.lon = float(self.path_lat[0]), float(self.path_lon[0])
+
+    def _start_route(self, node):
+        path = self.graph.route(node, self.trip_m)
+        self.end_node = int(path[-1])
+        self.path_lat = self.graph.lat[path]
+        self.path_lon = self.graph.lon[path]
+        step = np.hypot(np.diff(self.path_lat) * EARTH_M_PER_DEG,
+                        np.diff(self.path_lon) * EARTH_M_PER_DEG * np.cos(np.radians(self.path_lat[:-1])))
+        self.cumulative_m = np.concatenate([[0.0], np.cumsum(step)])
+        self.along_m = 0.0
+
+    def position(self):
+        """Walk to now and return (lat, lon)."""
+        with self.lock:
+            now = time.monotonic()
+            self.along_m += self.speed_mps * (now - self.walked_at)
+            self.walked_at = now
+            # At the end of a route, carry on along a new one from where it ended
+            while self.along_m > self.cumulative_m[-1] > 0:
+                left = self.along_m - self.cumulative_m[-1]
+                self._start_route(self.end_node)
+                self.along_m = left
+            self.lat = float(np.interp(self.along_m, self.cumulative_m, self.path_lat))
+            self.lon = float(np.interp(self.along_m, self.cumulative_m, self.path_lon))
+            return self.lat, self.lon
+
+# --- 2. LOAD ---
+_local = threading.local()
+
+def session():
+    """One keep-alive session per client thread, like one connection per phone or bag."""
+    s = getattr(_local, "session", None)
+    if s is None:
+        s = _local.session = requests.Session()
+    return s
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = {}      # request kind -> seconds of each successful request
+        self.errors = {}       # request kind -> failed requests
+        self.lag = []          # seconds each task started after it was due
+        self.events = 0        # bag events fully written (fix and push)
+        self.dropped = 0       # tasks still queued when the stage ended
+        self.alerts = {}       # outbox idem_key -> (path, device timestamp ms)
+
+    def request(self, kind, seconds, ok):
+        with self.lock:
+            if ok:
+                self.latency.setdefault(kind, []).append(seconds)
+            else:
+                self.latency.setdefault(kind, [])
+                self.errors[kind] = self.errors.get(kind, 0) + 1
+
+class LoadGenerator:
+    def __init__(self, firebase_url, app_url, threads, rate, poll_s, sos_per_min, burst, burst_gap_s, rng):
+        self.firebase_url = firebase_url
+        self.app_url = app_url
+        self.threads = threads
+        self.rate = rate
+        self.poll_s = poll_s
+        self.sos_per_min = sos_per_min
+        self.burst = burst
+        self.burst_gap_s = burst_gap_s
+        self.rng = rng
+        self.rec = Recorder()
+        self.end = 0.0
+
+    def call(self, kind, method, url, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            r = session().request(method, url, timeout=10, **kwargs)
+            ok = r.status_code < 400
+        except requests.RequestException:
+            r, ok = None, False
+        self.rec.request(kind, time.perf_counter() - t0, ok)
+        return r if ok else None
 
-BASE_LAT = 21.1458
-BASE_LON = 79.0882
+    # Bag: the latest fix for the app, and the same event pushed for the listener
+    def send_event(self, device, event_type="NORMAL"):
+        lat, lon = device.position()
+        payload = {
+            "latitude": round(lat, 6),
+            "longitude": round(lon, 6),
+            "event_type": event_type,
+            "gps_real": False,
+            "timestamp_ms": int(time.time() * 1000),
+            "acknowledged": False
+        }
+        fix = self.call("firebase_put", "PUT", f"{self.firebase_url}/latest_events/{device.device_id}.json",
+                        json=payload)
+        pushed = self.call("firebase_push", "POST", f"{self.firebase_url}/events.json",
+                           json=dict(payload, device_id=device.device_id))
+        with self.rec.lock:
+            if fix is not None and pushed is not None and event_type != SOS_EVENT:
+                self.rec.events += 1
+            if pushed is not None and event_type == SOS_EVENT:
+                self.rec.alerts[f"event:{pushed.json()['name']}"] = ("listener", payload["timestamp_ms"])
 
-def push_event(event_type="NORMAL"):
-    lat = BASE_LAT
-    lon = BASE_LON
+    # Phone: where is my bag, and how risky is it there
+    def poll_app(self, device):
+        self.call("app_locations", "GET", f"{self.app_url}/locations", params={"ids": device.device_id})
+        self.call("app_predict", "GET", f"{self.app_url}/predict",
+                  params={"lat": round(device.lat, 6), "lon": round(device.lon, 6)})
 
-    payload = {
-        "latitude": round(lat, 6),
-        "longitude": round(lon, 6),
-        "event_type": event_type,
-        "gps_real": False,
-        "timestamp_ms": int(time.time() * 1000),
-        "acknowledged": False
+    def app_sos(self, device):
+        key = f"sim:{uuid.uuid4().hex}"
+        sent_ms = int(time.time() * 1000)
+        r = self.call("app_sos", "POST", f"{self.app_url}/sos", headers={"Idempotency-Key": key},
+                      json={"device_id": device.device_id, "latitude": round(device.lat, 6),
+                            "longitude": round(device.lon, 6)})
+        if r is not None:
+            with self.rec.lock:
+                self.rec.alerts[key] = ("app", sent_ms)
+
+    def _task(self, kind, device, due):
+        now = time.monotonic()
+        with self.rec.lock:
+            self.rec.lag.append(now - due)
+            # A bag does not queue up missed fixes: what the stage could not send in time is dropped
+            if now >= self.end:
+                self.rec.dropped += 1
+                return
+        try:
+            if kind == "fix":
+                self.send_event(device)
+            elif kind == "poll":
+                self.poll_app(device)
+            elif kind == "sos":
+                self.send_event(device, SOS_EVENT)
+            elif kind == "app_sos":
+                self.app_sos(device)
+        except Exception as e:
+            print(f"⚠️ {kind} for {device.device_id} failed: {e}", file=sys.stderr)
+
+    def run(self, devices, duration_s):
+        """Drive the devices for duration_s; returns the seconds until every request finished."""
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.rec = Recorder()
+        start = time.monotonic()
+        end = self.end = start + duration_s
+        heap, seq = [], 0
+        # Spread the first event and poll of each device over one period
+        for device in devices:
+            for kind, period in (("fix", 1 / self.rate), ("poll", self.poll_s)):
+                heap.append((start + self.rng.uniform(0, period), seq, kind, device))
+                seq += 1
+        heapq.heapify(heap)
+        next_sos = start + self.rng.exponential(60 / self.sos_per_min) if self.sos_per_min > 0 else end
+
+        with ThreadPoolExecutor(self.threads, thread_name_prefix="device") as pool:
+            while True:
+                now = time.monotonic()
+                if now >= end:
+                    break
+                if now >= next_sos:
+                    # A burst: the phone's SOS now, the bag's SOS events every burst_gap_s
+                    device = devices[int(self.rng.integers(len(devices)))]
+                    heapq.heappush(heap, (now, seq, "app_sos", device))
+                    for i in range(self.burst):
+                        heapq.heappush(heap, (now + i * self.burst_gap_s, seq + 1 + i, "sos", device))
+                    seq += 1 + self.burst
+                    next_sos += self.rng.exponential(60 / self.sos_per_min)
+                while heap and heap[0][0] <= now:
+                    due, _, kind, device = heapq.heappop(heap)
+                    if due >= end:
+                        continue
+                    pool.submit(self._task, kind, device, due)
+                    if kind in ("fix", "poll"):
+                        heapq.heappush(heap, (due + (1 / self.rate if kind == "fix" else self.poll_s), seq,
+                                              kind, device))
+                        seq += 1
+                wait = min(heap[0][0] if heap else end, next_sos, end) - time.monotonic()
+                if wait > 0:
+                    time.sleep(min(wait, 0.01))
+        return time.monotonic() - start
+
+# --- 3. ALERTS IN THE OUTBOX JOURNAL ---
+def read_alerts(outbox_db, keys):
+    """idem_key -> (status, created_at, delivered_at) for the keys already journaled."""
+    if not keys or not os.path.exists(outbox_db):
+        return {}
+    rows = {}
+    db = sqlite3.connect(f"file:{outbox_db}?mode=ro", uri=True, timeout=10)
+    try:
+        keys = list(keys)
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            for key, status, created_at, delivered_at in db.execute(
+                    f"SELECT idem_key, status, created_at, delivered_at FROM alerts WHERE idem_key IN ({marks})",
+                    chunk):
+                rows[key] = (status, created_at, delivered_at)
+    finally:
+        db.close()
+    return rows
+
+def wait_for_alerts(outbox_db, expected, timeout_s):
+    """Poll the journal until every expected alert is delivered, coalesced or dead, or timeout_s passes."""
+    deadline = time.monotonic() + timeout_s
+    while True:
+        rows = read_alerts(outbox_db, expected)
+        settled = sum(1 for status, _, _ in rows.values() if status in ("done", "coalesced", "dead"))
+        if settled == len(expected) or time.monotonic() >= deadline:
+            return rows
+        time.sleep(0.5)
+
+def alert_report(expected, rows):
+    """Per path (listener, app): delivery counts, and latency from the device to the journal and on to delivery."""
+    report = {}
+    for path in ("listener", "app"):
+        keys = [key for key, (p, _) in expected.items() if p == path]
+        e2e, journal, dispatch = [], [], []
+        counts = {"expected": len(keys), "delivered": 0, "coalesced": 0, "pending": 0, "dead": 0, "missing": 0}
+        for key in keys:
+            sent_s = expected[key][1] / 1000
+            row = rows.get(key)
+            if row is None:
+                counts["missing"] += 1
+                continue
+            status, created_at, delivered_at = row
+            if status == "done":
+                counts["delivered"] += 1
+                e2e.append(delivered_at - sent_s)
+                journal.append(created_at - sent_s)
+                dispatch.append(delivered_at - created_at)
+            elif status in ("coalesced", "dead"):
+                counts[status] += 1
+            else:
+                counts["pending"] += 1
+        report[path] = dict(counts, e2e_p50_s=percentile_s(e2e, 50), e2e_p95_s=percentile_s(e2e, 95),
+                            e2e_max_s=round(max(e2e), 2) if e2e else None,
+                            journal_p95_s=percentile_s(journal, 95), dispatch_p95_s=percentile_s(dispatch, 95))
+    return report
+
+# --- 4. THE STACK UNDER TEST ---
+class Stack:
+    """fake_firebase.py, gunicorn app:app and firebase_sos_listener.py, sharing one scratch directory."""
+    def __init__(self, cwd, run_dir, workers, web_threads, listener_interval_s, firebase_latency_ms,
+                 alert_latency_ms):
+        self.cwd = cwd
+        self.run_dir = run_dir
+        self.workers = workers
+        self.procs = {}
+        self.firebase_url = f"http://127.0.0.1:{free_port()}"
+        self.app_port = free_port()
+        self.app_url = f"http://127.0.0.1:{self.app_port}"
+        self.outbox_db = os.path.join(run_dir, "alert_outbox.db")
+        self.listener_db = os.path.join(run_dir, "listener_state.db")
+        self.firebase_latency_ms = firebase_latency_ms
+        self.env = dict(os.environ, FIREBASE_URL=self.firebase_url, OUTBOX_DB=self.outbox_db,
+                        LISTENER_STATE_DB=self.listener_db, EVENT_STORE_DIR=os.path.join(run_dir, "events"),
+                        LISTENER_INTERVAL_S=str(listener_interval_s),
+                        # Never a real SMS, whatever .env says
+                        ALERT_PROVIDER="fake", ALERT_FAKE_LATENCY_MS=str(alert_latency_ms),
+                        FAST_ROUTE_BACKEND="local", PYTHONPATH=ROOT, PYTHONUNBUFFERED="1",
+                        PORT=str(self.app_port), WEB_CONCURRENCY=str(workers))
+        if web_threads:
+            self.env["WEB_THREADS"] = str(web_threads)
+
+    def _spawn(self, name, cmd):
+        log = open(os.path.join(self.run_dir, f"{name}.log"), "w")
+        self.procs[name] = subprocess.Popen(cmd, cwd=self.cwd, env=self.env, stdout=log, stderr=subprocess.STDOUT)
+
+    def _wait(self, name, ready, timeout_s=600):
+        t0 = time.monotonic()
+        while not ready():
+            if self.procs[name].poll() is not None:
+                raise RuntimeError(f"{name} exited; see {os.path.join(self.run_dir, name + '.log')}")
+            if time.monotonic() - t0 > timeout_s:
+                raise RuntimeError(f"{name} did not come up in {timeout_s} s")
+            time.sleep(0.1)
+        return time.monotonic() - t0
+
+    def _answers(self, url):
+        try:
+            return requests.get(url, timeout=1).status_code == 200
+        except requests.RequestException:
+            return False
+
+    def _checkpointed(self):
+        try:
+            db = sqlite3.connect(f"file:{self.listener_db}?mode=ro", uri=True)
+            try:
+                row = db.execute("SELECT value FROM checkpoint WHERE name = 'events'").fetchone()
+            finally:
+                db.close()
+            return bool(row and row[0])
+        except sqlite3.Error:
+            return False
+
+    def start(self):
+        port = self.firebase_url.rsplit(":", 1)[1]
+        self._spawn("firebase", [sys.executable, os.path.join(ROOT, "fake_firebase.py"), "--port", port,
+                                 "--latency-ms", str(self.firebase_latency_ms)])
+        self._wait("firebase", lambda: self._answers(f"{self.firebase_url}/__stats"))
+
+        self._spawn("app", [sys.executable, "-m", "gunicorn", "-c", os.path.join(ROOT, "gunicorn.conf.py"),
+                            "app:app"])
+        ready_s = self._wait("app", lambda: self._answers(f"{self.app_url}/status"))
+        # Load the models and open the fleet stream in (most likely) every worker before timing anything
+        for _ in range(4 * self.workers):
+            requests.get(f"{self.app_url}/predict", params={"lat": 21.1458, "lon": 79.0882}, timeout=300)
+            requests.get(f"{self.app_url}/locations", params={"ids": "sim_warmup"}, timeout=300)
+        print(f"✅ App up in {ready_s:.1f} s ({self.workers} worker(s))", file=sys.stderr)
+
+        # The listener only backfills the newest events on its first pass, so give it a
+        # checkpoint before the load starts
+        requests.post(f"{self.firebase_url}/events.json", timeout=5,
+                      json={"device_id": "sim_warmup", "event_type": "NORMAL", "latitude": 21.1458,
+                            "longitude": 79.0882, "timestamp_ms": int(time.time() * 1000)})
+        self._spawn("listener", [sys.executable, os.path.join(ROOT, "firebase_sos_listener.py")])
+        self._wait("listener", self._checkpointed)
+        print("✅ Listener checkpointed", file=sys.stderr)
+
+    def firebase_requests(self):
+        return requests.get(f"{self.firebase_url}/__stats", timeout=5).json()["requests"]
+
+    def stop(self):
+        for name in reversed(list(self.procs)):
+            self.procs[name].terminate()
+        for proc in self.procs.values():
+            try:
+                proc.wait(30)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+# --- 5. STAGES ---
+def request_report(rec, seconds):
+    report = {}
+    for kind in sorted(rec.latency):
+        ok, failed = rec.latency[kind], rec.errors.get(kind, 0)
+        total = len(ok) + failed
+        report[kind] = {"count": total, "per_s": round(total / seconds, 1),
+                        "p50_ms": percentile_ms(ok, 50), "p95_ms": percentile_ms(ok, 95),
+                        "error_rate": round(failed / total, 4) if total else 0.0}
+    return report
+
+def run_stage(stack, generator, devices, args):
+    print(f"⏱ {len(devices)} devices for {args.duration} s ...", file=sys.stderr)
+    firebase_before = stack.firebase_requests()
+    seconds = generator.run(devices, args.duration)
+    firebase_after = stack.firebase_requests()
+    rec = generator.rec
+
+    alerts = alert_report(rec.alerts, wait_for_alerts(stack.outbox_db, rec.alerts,
+                                                      args.drain_s + args.listener_interval))
+    target = len(devices) * args.rate
+    result = {
+        "devices": len(devices),
+        "seconds": round(seconds, 1),
+        "target_events_per_s": round(target, 1),
+        "events_per_s": round(rec.events / seconds, 1),
+        "send_lag_p95_ms": percentile_ms(rec.lag, 95),
+        "dropped": rec.dropped,
+        "firebase_requests_per_s": round((firebase_after - firebase_before) / seconds, 1),
+        "requests": request_report(rec, seconds),
+        "alerts": alerts,
     }
 
-    url = f"{FIREBASE_URL}/latest_events/{DEVICE_ID}.json"
-    requests.put(url, json=payload, timeout=5)
-    print(f"SENT → {event_type} @ {payload['latitude']},{payload['longitude']}")
+    limits = []
+    if result["events_per_s"] < 0.95 * target:
+        limits.append(f"event rate {result['events_per_s']}/s of {result['target_events_per_s']}/s")
+    if result["send_lag_p95_ms"] is not None and result["send_lag_p95_ms"] > 1000 / args.rate:
+        limits.append(f"send lag p95 {result['send_lag_p95_ms']} ms")
+    for kind, r in result["requests"].items():
+        if r["error_rate"] >= 0.01:
+            limits.append(f"{kind} errors {r['error_rate']:.1%}")
+        if kind.startswith("app_") and r["p95_ms"] is not None and r["p95_ms"] > args.slo_http_ms:
+            limits.append(f"{kind} p95 {r['p95_ms']} ms")
+    for path, a in alerts.items():
+        undelivered = a["expected"] - a["delivered"] - a["coalesced"]
+        if undelivered:
+            limits.append(f"{undelivered} {path} alerts undelivered")
+        if a["e2e_p95_s"] is not None and a["e2e_p95_s"] > args.slo_alert_s:
+            limits.append(f"{path} alert p95 {a['e2e_p95_s']} s")
+    result["sustained"] = not limits
+    result["limits"] = limits
+    return result
+
+def print_table(results):
+    print(f"{'devices':>8}{'ev/s':>8}{'target':>8}{'lag p95':>9}{'put p95':>9}{'push p95':>9}"
+          f"{'loc p95':>9}{'pred p95':>9}{'sos p95':>9}{'alerts':>8}{'folded':>8}{'alert p95':>10}  sustained")
+    for r in results:
+        req = r["requests"]
+        p95 = lambda kind: req.get(kind, {}).get("p95_ms")
+        listener = r["alerts"]["listener"]
+        delivered = listener["delivered"] + r["alerts"]["app"]["delivered"]
+        coalesced = listener["coalesced"] + r["alerts"]["app"]["coalesced"]
+        expected = listener["expected"] + r["alerts"]["app"]["expected"]
+        cells = [p95("firebase_put"), p95("firebase_push"), p95("app_locations"), p95("app_predict"),
+                 p95("app_sos")]
+        print(f"{r['devices']:>8}{r['events_per_s']:>8}{r['target_events_per_s']:>8}{str(r['send_lag_p95_ms']):>9}"
+              + "".join(f"{str(c):>9}" for c in cells)
+              + f"{f'{delivered}/{expected}':>8}{coalesced:>8}{str(listener['e2e_p95_s']):>10}  "
+              + ("yes" if r["sustained"] else "no: " + "; ".join(r["limits"])))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--devices", default="25,50,100", help="comma-separated device counts, one stage each")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per stage")
+    parser.add_argument("--rate", type=float, default=0.5, help="events per device per second")
+    parser.add_argument("--sos-per-min", type=float, default=6, help="SOS bursts per minute across the fleet")
+    parser.add_argument("--burst", type=int, default=3, help="USER_SOS events per burst")
+    parser.add_argument("--burst-gap-s", type=float, default=2)
+    parser.add_argument("--poll-s", type=float, default=5, help="seconds between each phone's app requests")
+    parser.add_argument("--speed", type=float, default=1.4, help="walking speed, m/s")
+    parser.add_argument("--trip-m", type=float, default=1500, help="longest straight-line distance of one route")
+    parser.add_argument("--threads", type=int, default=64, help="client threads issuing requests")
+    parser.add_argument("--workers", type=int, default=1, help="gunicorn workers")
+    parser.add_argument("--web-threads", type=int, help="threads per gunicorn worker (default gunicorn.conf.py's)")
+    parser.add_argument("--listener-interval", type=float, default=1, help="LISTENER_INTERVAL_S for the listener")
+    parser.add_argument("--firebase-latency-ms", type=float, default=0, help="added to every Firebase request")
+    parser.add_argument("--alert-latency-ms", type=float, default=200, help="fake SMS provider latency")
+    parser.add_argument("--slo-http-ms", type=float, default=500, help="p95 bound on each app request")
+    parser.add_argument("--slo-alert-s", type=float, default=10, help="p95 bound from SOS event to delivered alert")
+    parser.add_argument("--drain-s", type=float, default=30, help="how long to wait for the last alerts")
+    parser.add_argument("--cwd", help="directory with models/ and data/ (default: the synthetic fixtures)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="keep the logs and journals of the run")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
 
-while True:
+    counts = sorted(int(n) for n in args.devices.split(","))
+    if args.cwd:
+        cwd = os.path.abspath(args.cwd)
+    else:
+        sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+        from fixtures import make_fixtures
+        cwd = make_fixtures(os.path.join(tempfile.gettempdir(), "safebag_bench_grid60"))
 
-    # continuous movement every 2 sec
-    #push_event("NORMAL")
-    #time.sleep(29)
+    rng = np.random.default_rng(args.seed)
+    graph = RoadGraph(os.path.join(cwd, "data", "nagpur_graph.graphml"), rng)
+    starts = rng.integers(len(graph.nodes), size=counts[-1]).tolist()
+    devices = [Device(f"sim_{i:05d}", graph, node, args.speed, args.trip_m) for i, node in enumerate(starts)]
+    print(f"✅ {len(devices)} devices on a {len(graph.nodes)}-node road graph", file=sys.stderr)
 
-    # unusual activity every ~20 sec
-    if random.randint(1, 10) == 5:
-        for _ in range(3):
-            push_event("AUTO_UNUSUAL_ACTIVITY")
-            time.sleep(10)
+    run_dir = tempfile.mkdtemp(prefix="safebag_sim_")
+    stack = Stack(cwd, run_dir, args.workers, args.web_threads, args.listener_interval,
+                  args.firebase_latency_ms, args.alert_latency_ms)
+    results = []
+    try:
+        stack.start()
+        generator = LoadGenerator(stack.firebase_url, stack.app_url, args.threads, args.rate, args.poll_s,
+                                  args.sos_per_min, args.burst, args.burst_gap_s, rng)
+        for count in counts:
+            results.append(run_stage(stack, generator, devices[:count], args))
+    finally:
+        stack.stop()
+        if args.keep:
+            print(f"📁 Logs and journals kept in {run_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(run_dir, ignore_errors=True)
 
-    # SOS every ~40 sec
-    if random.randint(1, 20) == 7:
-        for _ in range(5):
-            push_event("USER_SOS")
-            time.sleep(10)
+    sustained = [r["devices"] for r in results if r["sustained"]]
+    summary = {"workers": args.workers, "max_sustained_devices": max(sustained) if sustained else 0}
+    summary["devices_per_worker"] = summary["max_sustained_devices"] // args.workers
+    if args.json:
+        print(json.dumps({"stages": results, "summary": summary}, indent=2))
+    else:
+        print_table(results)
+        print(f"Sustained up to {summary['max_sustained_devices']} devices on {args.workers} worker(s): "
+              f"{summary['devices_per_worker']} per worker")
@@ -0,0 +1,84 @@
+"""
+Startup modes for the web app.
+
+STARTUP_MODE=eager (default) imports ml_engine / routing when app.py is
+imported, as before. STARTUP_MODE=lazy hands app.py module proxies that
+import on first attribute access, so a worker boots without pandas,
+scipy, sklearn or osmnx, and /status or /location never pay for them.
+
+GUNICORN_PRELOAD=1 (see gunicorn.conf.py) imports the app in the
+gunicorn master and runs warm_up() there before forking, so the models
+and the road graph are loaded once and shared copy-on-write by every
+worker. WARM_UP=1 runs the same warm-up in each worker before it takes
+traffic when not preloading.
+"""
+import os
+import sys
+import time
+import threading
+import importlib
+
+STARTUP_MODE = os.getenv("STARTUP_MODE", "eager")
+WARM_UP = os.getenv("WARM_UP", "0") == "1"
+
+# Sitabuldi -> Sadar: short, central, inside any Nagpur graph
+WARM_UP_ROUTE = (21.1498, 79.0806, 21.1610, 79.0880)
+
+class LazyModule:
+    """Stands in for a module; the real import happens on first attribute access."""
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._module is None:
+                t0 = time.time()
+                self._module = importlib.import_module(self._name)
+                print(f"⏱ Lazy import {self._name}: {time.time() - t0:.2f}s")
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._module or self._load(), attr)
+
+def module(name):
+    """The module itself in eager mode (or if already imported), else a LazyModule."""
+    if STARTUP_MODE != "lazy" or name in sys.modules:
+        return importlib.import_module(name)
+    return LazyModule(name)
+
+def warm_up():
+    """Load the models and graph and run one predict and one safe route."""
+    t0 = time.time()
+    try:
+        import ml_engine
+        ml_engine.predict(WARM_UP_ROUTE[0], WARM_UP_ROUTE[1])
+        import routing
+        routing.load_graph_if_needed()
+        # The safe route only: warm-up must not call GraphHopper
+        routing.get_safe_route(*WARM_UP_ROUTE)
+        print(f"✅ Warm-up done in {time.time() - t0:.2f}s")
+    except Exception as e:
+        print(f"⚠️ Warm-up failed after {time.time() - t0:.2f}s: {e}")
+
+def memory_mb():
+    """(RSS, PSS) of this process in MB; PSS splits shared pages between sharers."""
+    rss = pss = None
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Rss:"):
+                    rss = int(line.split()[1]) / 1024
+                elif line.startswith("Pss:"):
+                    pss = int(line.split()[1]) / 1024
+    except OSError:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return rss, pss
+
+def report(label, since=None):
+    rss, pss = memory_mb()
+    elapsed = f" in {time.time() - since:.2f}s" if since else ""
+    pss = f", PSS {pss:.0f} MB" if pss is not None else ""
+    print(f"⏱ {label}{elapsed} (pid {os.getpid()}, RSS {rss:.0f} MB{pss})")
@@ -0,0 +1,12 @@
+"""
+Import path for the tests: the app's modules live at the repo root and
+the synthetic artifacts in benchmarks/fixtures.py.
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
@@ -0,0 +1,40 @@
+"""
+Readers of the columnar event store against a writer expiring segments.
+
+    python -m pytest tests/test_event_store.py
+"""
+import time
+
+import event_store
+from event_store import EventStore
+
+DAY_MS = 86400 * 1000
+
+def events(start_key, timestamps_ms):
+    return {f"{start_key}{i:04d}": {"device_id": "bag_1", "event_type": "USER_SOS", "latitude": 21.1,
+                                    "longitude": 79.0, "timestamp_ms": ts}
+            for i, ts in enumerate(timestamps_ms)}
+
+def test_read_retries_after_segment_expired_under_it(tmp_path, monkeypatch):
+    now_ms = int(time.time() * 1000)
+    writer = EventStore(str(tmp_path), writable=True)
+    writer.append(events("a", [now_ms - 3 * DAY_MS]))
+    reader = EventStore(str(tmp_path))
+    assert reader.stats()["segments"] == 1
+
+    # The writer expires the old segment and deletes its files ...
+    monkeypatch.setattr(event_store, "RETENTION_DAYS", 1)
+    writer.append(events("b", [now_ms]))
+
+    # ... while the reader still holds the manifest that lists it
+    refreshes = []
+    def stale_refresh():
+        refreshes.append(1)
+        if len(refreshes) > 1:
+            EventStore._refresh(reader)
+    monkeypatch.setattr(reader, "_refresh", stale_refresh)
+
+    records = reader.last(10)
+    assert [r["timestamp_ms"] for r in records] == [now_ms]
+    assert len(refreshes) == 2
+    assert list(reader.maps) == list(writer.manifest["segments"])
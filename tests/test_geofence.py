@@ -0,0 +1,61 @@
+"""
+Escalation retry in the geofence monitor, on a replayed trace with a stub scorer.
+
+    python -m pytest tests/test_geofence.py
+"""
+import datetime
+
+import geofence
+
+NIGHT = int(datetime.datetime(2024, 1, 1, 22, 0).timestamp() * 1000)
+
+def critical_everywhere(lats, lons, when=None):
+    return [("Critical", 10, "Theft")] * len(lats)
+
+def trace(fixes, start_ms=NIGHT):
+    """One device standing still, one fix a second."""
+    return [{"device_id": "bag_1", "latitude": 21.1458, "longitude": 79.0882, "timestamp_ms": start_ms + i * 1000}
+            for i in range(fixes)]
+
+def test_failed_escalation_is_retried_on_next_fix():
+    sent, calls = [], []
+
+    def escalate(alert):
+        calls.append(alert["timestamp_ms"])
+        if len(calls) == 1:
+            raise RuntimeError("outbox unavailable")
+        sent.append(alert)
+
+    monitor = geofence.GeofenceMonitor(escalate=escalate, score=critical_everywhere)
+    alerts = geofence.replay(trace(geofence.ENTER_FIXES + 3), monitor, tick_s=1)
+
+    # Inside after ENTER_FIXES fixes: that escalation fails, the very next fix sends it
+    first = NIGHT + (geofence.ENTER_FIXES - 1) * 1000
+    assert calls == [first, first + 1000]
+    assert [a["timestamp_ms"] for a in alerts] == [first + 1000]
+    assert sent == alerts
+    assert monitor.stats()["escalations"] == 1
+
+def test_sent_escalation_waits_for_linger():
+    sent = []
+    monitor = geofence.GeofenceMonitor(escalate=sent.append, score=critical_everywhere)
+    geofence.replay(trace(geofence.ENTER_FIXES + 10), monitor, tick_s=1)
+    assert len(sent) == 1
+
+def test_no_escalation_in_daytime():
+    sent = []
+    monitor = geofence.GeofenceMonitor(escalate=sent.append, score=critical_everywhere)
+    noon = int(datetime.datetime(2024, 1, 1, 12, 0).timestamp() * 1000)
+    geofence.replay(trace(geofence.ENTER_FIXES + 3, noon), monitor, tick_s=1)
+    assert sent == []
+
+def test_cache_overflow_keeps_the_batch_scored(monkeypatch):
+    # Two cached cells, then a batch with one of them and two new ones: scoring clears the cache
+    monkeypatch.setattr(geofence, "CACHE_MAX_CELLS", 2)
+    monitor = geofence.GeofenceMonitor(escalate=lambda alert: None, score=critical_everywhere)
+    step = geofence.CELL_DEG
+    monitor.process(["bag_1", "bag_2"], [21.1, 21.1 + step], [79.0, 79.0], [NIGHT, NIGHT])
+    monitor.process(["bag_1", "bag_2", "bag_3"], [21.1, 21.1 + 2 * step, 21.1 + 3 * step],
+                    [79.0, 79.0, 79.0], [NIGHT + 1000] * 3)
+    assert {t.level for t in monitor.tracks.values()} == {"Critical"}
+    assert monitor.stats()["cached_cells"] == 2
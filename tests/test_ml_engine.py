@@ -0,0 +1,86 @@
+"""
+The compiled scorer and time encodings in ml_engine against the
+original per-row code, on small synthetic artifacts from fixtures.py.
+
+    python -m pytest tests/test_ml_engine.py
+"""
+import numpy as np
+import pytest
+
+import ml_engine
+from fixtures import make_risk_artifact, risk_samples, DAYS, SLOTS, RISKS
+
+def reference_score(model, features, le_risk):
+    """get_safety_score_for_features as it was before compile_scorer."""
+    probas = model.predict_proba([features])[0]
+    classes = list(model.classes_)
+
+    safe_prob = 0.0
+    found = False
+    for label in ["Low", "Moderate"]:
+        idx = -1
+        if label in classes:
+            idx = classes.index(label)
+        elif le_risk:
+            try:
+                enc_label = le_risk.transform([label])[0]
+                if enc_label in classes:
+                    idx = classes.index(enc_label)
+            except: pass
+        if idx != -1:
+            weight = 1.0 if label == "Low" else 0.5
+            safe_prob += probas[idx] * weight
+            found = True
+
+    if not found or safe_prob == 0.0:
+        crit_idx = -1
+        if "Critical" in classes:
+            crit_idx = classes.index("Critical")
+        elif le_risk:
+            try:
+                enc_crit = le_risk.transform(["Critical"])[0]
+                if enc_crit in classes:
+                    crit_idx = classes.index(enc_crit)
+            except: pass
+        if crit_idx != -1:
+            safe_prob = 1.0 - probas[crit_idx]
+        else:
+            safe_prob = np.max(probas)
+    return safe_prob
+
+def feature_rows(n=300, seed=7):
+    return risk_samples(np.random.default_rng(seed), n)[0]
+
+# Low counted, only Moderate counted (rows where it is 0 fall back), only Critical
+CASES = [(kind, labels) for labels in (RISKS, ["Moderate", "High", "Critical"], ["High", "Critical"])
+         for kind in ("int", "str")]
+
+@pytest.mark.parametrize("kind,labels", CASES)
+def test_scores_match_reference(kind, labels):
+    artifact = make_risk_artifact(string_classes=kind == "str", labels=labels)
+    model, le_risk = artifact["model"], artifact.get("le_risk")
+    X = feature_rows()
+
+    expected = np.array([reference_score(model, row, le_risk) for row in X])
+    np.testing.assert_allclose(ml_engine.get_safety_scores(model, X, le_risk), expected, rtol=0, atol=1e-12)
+    for row, want in zip(X[:20], expected[:20]):
+        assert ml_engine.get_safety_score_for_features(model, row, le_risk) == pytest.approx(want, abs=1e-12)
+
+def test_integer_classes_without_encoder_use_max_probability():
+    # No label can be resolved: the max-probability fallback
+    artifact = make_risk_artifact()
+    model = artifact["model"]
+    X = feature_rows()
+    expected = np.array([reference_score(model, row, None) for row in X])
+    np.testing.assert_allclose(ml_engine.get_safety_scores(model, X, None), expected, rtol=0, atol=1e-12)
+    np.testing.assert_allclose(expected, model.predict_proba(X).max(axis=1))
+
+@pytest.mark.parametrize("kind", ["int", "str"])
+def test_time_encodings_match_encoders(kind):
+    artifact = make_risk_artifact(string_classes=kind == "str")
+    table = ml_engine.compile_time_encodings(artifact)
+    assert len(table) == len(DAYS) * len(SLOTS)
+    for day in DAYS:
+        for slot in SLOTS:
+            assert table[(day, slot)] == (int(artifact["le_day"].transform([day])[0]),
+                                          int(artifact["le_slot"].transform([slot])[0]))
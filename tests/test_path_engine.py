@@ -0,0 +1,58 @@
+"""
+Bidirectional A* and the contraction hierarchy against Dijkstra (and
+NetworkX) on random pairs of a small synthetic grid from fixtures.py.
+
+    python -m pytest tests/test_path_engine.py
+"""
+import os
+import math
+import numpy as np
+import pytest
+
+import graph_snapshot
+import path_engine
+from fixtures import make_grid_graph
+
+@pytest.fixture(scope="module")
+def snapshot_dir(tmp_path_factory):
+    root = str(tmp_path_factory.mktemp("grid"))
+    make_grid_graph(root, n=15)
+    snapshot_dir = os.path.join(root, "data", "graph_snapshot")
+    graph_snapshot.build_snapshot(os.path.join(root, "data", "nagpur_graph.graphml"), snapshot_dir)
+    snap = graph_snapshot.load_snapshot(snapshot_dir)
+    path_engine.save_ch(path_engine.build_ch(snap), snapshot_dir)
+    return snapshot_dir
+
+def same_cost(a, b):
+    if a is None or b is None:
+        return a is b
+    # Snapshot weights are float32; sums may differ in the last bits between search orders
+    return math.isclose(a, b, rel_tol=1e-6, abs_tol=1e-6)
+
+def test_astar_and_ch_match_dijkstra(snapshot_dir):
+    snap = graph_snapshot.load_snapshot(snapshot_dir)
+    astar = path_engine.build_astar(snap)
+    ch = path_engine.load_ch(snapshot_dir)
+    assert ch is not None
+
+    rng = np.random.default_rng(0)
+    n = len(snap["node_ids"])
+    reachable = 0
+    for _ in range(200):
+        o, d = (int(x) for x in rng.integers(0, n, 2))
+        ref_path = graph_snapshot.shortest_path(snap, o, d)
+        ref = None if ref_path is None else path_engine.path_cost(snap, ref_path)
+        reachable += ref is not None
+
+        astar_path, astar_cost = path_engine.astar_path(astar, o, d)
+        ch_path, ch_cost = path_engine.ch_path(ch, o, d)
+        for name, path, cost in (("astar", astar_path, astar_cost), ("ch", ch_path, ch_cost)):
+            walked = None if path is None else path_engine.path_cost(snap, path)
+            assert same_cost(walked, ref), f"{name} {o}->{d}: {walked} vs dijkstra {ref}"
+            if path is not None:
+                assert path[0] == o and path[-1] == d
+                assert same_cost(float(cost), ref)
+    assert reachable > 150
+
+def test_verify_against_networkx(snapshot_dir):
+    assert path_engine.verify(snapshot_dir, pairs=50)
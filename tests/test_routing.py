@@ -0,0 +1,120 @@
+"""
+get_dual_routes against a local stand-in for GraphHopper: slow, failing
+and unreachable upstreams must keep /route inside its budget, answer
+with the local fast route and leave that fallback out of the cache.
+
+    python -m pytest tests/test_routing.py
+"""
+import os
+import json
+import time
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+
+import routing
+from route_cache import RouteCache
+from fixtures import make_grid_graph
+
+BUDGET_S = 1.0
+# Scheduling slack on top of the budget
+SLACK_S = 0.2
+START, END = (21.10, 79.02), (21.18, 79.12)
+
+class GraphHopperStub(BaseHTTPRequestHandler):
+    mode = "ok"
+
+    def do_GET(self):
+        if self.mode == "error":
+            self.send_response(500)
+            self.end_headers()
+            return
+        if self.mode == "slow":
+            time.sleep(BUDGET_S * 3)
+        body = json.dumps({"paths": [{"points": {"coordinates": [[START[1], START[0]], [END[1], END[0]]]}}]})
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        try:
+            self.wfile.write(body.encode())
+        except OSError:
+            pass   # the client gave up on a slow answer
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture(scope="module")
+def grid(tmp_path_factory):
+    root = str(tmp_path_factory.mktemp("grid"))
+    make_grid_graph(root, n=15)
+    saved = routing.GRAPH_FILE, routing.ROUTING_BACKEND, routing.FAST_ROUTE_BACKEND
+    routing.GRAPH_FILE = os.path.join(root, "data", "nagpur_graph.graphml")
+    routing.ROUTING_BACKEND, routing.FAST_ROUTE_BACKEND = "networkx", "graphhopper"
+    routing.load_graph_if_needed()
+    yield
+    routing.GRAPH_FILE, routing.ROUTING_BACKEND, routing.FAST_ROUTE_BACKEND = saved
+
+@pytest.fixture(scope="module")
+def stub():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), GraphHopperStub)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield srv
+    srv.shutdown()
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = RouteCache()
+    monkeypatch.setattr(routing, "route_cache", cache)
+    return cache
+
+def closed_port_url():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{s.getsockname()[1]}/route"
+
+def fast_key():
+    return routing.route_cache_key("fast", *routing.snap_route_ends(*START, *END))
+
+@pytest.mark.parametrize("mode", ["slow", "error", "unreachable"])
+def test_graphhopper_failure_falls_back_within_budget(grid, stub, cache, monkeypatch, mode):
+    if mode == "unreachable":
+        url = closed_port_url()
+    else:
+        monkeypatch.setattr(GraphHopperStub, "mode", mode)
+        url = f"http://127.0.0.1:{stub.server_address[1]}/route"
+    monkeypatch.setattr(routing, "GH_API_URL", url)
+
+    t0 = time.monotonic()
+    fast, safe = routing.get_dual_routes(*START, *END, budget=BUDGET_S)
+    elapsed = time.monotonic() - t0
+
+    # GraphHopper is given up on at half the budget; the grid's fallback takes milliseconds
+    assert elapsed < BUDGET_S
+    assert fast == routing.get_local_fast_route(*START, *END)
+    assert len(fast) > 2 and safe
+    assert cache.get(fast_key()) is None
+
+def test_slow_fallback_still_meets_deadline(grid, cache, monkeypatch):
+    monkeypatch.setattr(routing, "GH_API_URL", closed_port_url())
+    local_fast_route = routing.get_local_fast_route
+
+    def slow_local_fast_route(*args):
+        time.sleep(BUDGET_S * 2)
+        return local_fast_route(*args)
+    monkeypatch.setattr(routing, "get_local_fast_route", slow_local_fast_route)
+
+    t0 = time.monotonic()
+    fast, safe = routing.get_dual_routes(*START, *END, budget=BUDGET_S)
+    assert time.monotonic() - t0 < BUDGET_S + SLACK_S
+    assert fast == [] and safe
+    assert cache.get(fast_key()) is None
+
+def test_graphhopper_route_is_cached(grid, stub, cache, monkeypatch):
+    monkeypatch.setattr(GraphHopperStub, "mode", "ok")
+    monkeypatch.setattr(routing, "GH_API_URL", f"http://127.0.0.1:{stub.server_address[1]}/route")
+
+    fast, _ = routing.get_dual_routes(*START, *END, budget=BUDGET_S)
+    assert fast == [list(START), list(END)]
+    assert cache.get(fast_key()) == fast